@@ -0,0 +1,171 @@
+import asyncio
+import json
+import os
+import ssl
+import urllib.parse
+import weakref
+
+DEFAULT_TIMEOUT = float(os.environ.get("PICOAGENT_LLM_TIMEOUT", "600"))
+
+
+class AsyncHTTPError(Exception):
+    def __init__(self, status, body):
+        super().__init__(f"HTTP {status}: {body[:500]!r}")
+        self.status = status
+        self.body = body
+
+
+class AsyncHTTPPool:
+    """
+    Minimal asyncio HTTP/1.1 client with per-host keep-alive connection pools.
+
+    Meant to be shared by all agent sessions on an event loop, `max_per_host` bounds the number
+    of concurrent connections (and so in-flight requests) to one backend.
+    """
+
+    def __init__(self, max_per_host=16, timeout=DEFAULT_TIMEOUT):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.idle = {}  # (scheme, host, port) -> [(reader, writer)]
+        self.limits = {}
+        self.ssl_context = None
+
+    def _limit(self, key):
+        if key not in self.limits:
+            self.limits[key] = asyncio.Semaphore(self.max_per_host)
+        return self.limits[key]
+
+    async def _connect(self, key):
+        idle = self.idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+
+        scheme, host, port = key
+        ssl_ctx = None
+        if scheme == "https":
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            ssl_ctx = self.ssl_context
+        return await asyncio.open_connection(host, port, ssl=ssl_ctx)
+
+    def _release(self, key, conn, keep_alive):
+        if keep_alive:
+            self.idle.setdefault(key, []).append(conn)
+        else:
+            conn[1].close()
+
+    async def request(self, method, url, headers={}, body=b""):
+        """Send a request and return (status, headers, body bytes)"""
+        u = urllib.parse.urlsplit(url)
+        port = u.port or (443 if u.scheme == "https" else 80)
+        key = (u.scheme, u.hostname, port)
+        path = (u.path or "/") + (f"?{u.query}" if u.query else "")
+
+        async with self._limit(key):
+            for attempt in range(2):
+                reused = bool(self.idle.get(key))
+                conn = await self._connect(key)
+                try:
+                    status, resp_headers, resp_body, keep_alive = await asyncio.wait_for(
+                        self._roundtrip(conn, method, u.netloc, path, headers, body), self.timeout
+                    )
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    conn[1].close()
+                    if reused and attempt == 0:
+                        continue  # stale keep-alive connection, retry on a fresh one
+                    raise
+                except BaseException:
+                    conn[1].close()
+                    raise
+                self._release(key, conn, keep_alive)
+                return status, resp_headers, resp_body
+
+    async def _roundtrip(self, conn, method, host, path, headers, body):
+        reader, writer = conn
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {host}", f"Content-Length: {len(body)}"]
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+        status_line = await reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+        resp_headers = {}
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            k, _, v = line.decode("latin-1").partition(":")
+            resp_headers[k.strip().lower()] = v.strip()
+
+        if resp_headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if size == 0:
+                    while await reader.readuntil(b"\r\n") != b"\r\n":
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            resp_body = b"".join(chunks)
+            keep_alive = resp_headers.get("connection", "").lower() != "close"
+        elif "content-length" in resp_headers:
+            resp_body = await reader.readexactly(int(resp_headers["content-length"]))
+            keep_alive = resp_headers.get("connection", "").lower() != "close"
+        else:
+            resp_body = await reader.read()
+            keep_alive = False
+
+        return status, resp_headers, resp_body, keep_alive
+
+    async def close(self):
+        for conns in self.idle.values():
+            for _, writer in conns:
+                writer.close()
+        self.idle = {}
+
+
+# connections and semaphores belong to the loop they were created on, so there is one pool per loop
+_default_pools = weakref.WeakKeyDictionary()
+
+
+def get_default_pool() -> AsyncHTTPPool:
+    """Shared pool of the running event loop"""
+    loop = asyncio.get_running_loop()
+    pool = _default_pools.get(loop)
+    if pool is None:
+        pool = _default_pools[loop] = AsyncHTTPPool()
+    return pool
+
+
+async def async_llm_chat(msgs, api_base=None, api_key=None, model=None, pool=None, **kwargs):
+    """
+    Async counterpart of llm_fns.llm.llm_chat for OpenAI-compatible chat completion APIs.
+    Extra kwargs (json_schema, response_format, temperature, cache_prompt...) go into the request body.
+    """
+    api_base = api_base or os.environ.get("OPENAI_API_BASE")
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+    if not api_base:
+        raise Exception("OPENAI_API_BASE is not set and api_base not given")
+
+    headers = {"Content-Type": "application/json", "Accept": "application/json"}
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+
+    body = dict(messages=list(msgs), **kwargs)
+    if model:
+        body["model"] = model
+
+    status, _, resp = await (pool or get_default_pool()).request(
+        "POST",
+        f"{api_base.rstrip('/')}/chat/completions",
+        headers,
+        json.dumps(body).encode("utf-8"),
+    )
+    if status != 200:
+        raise AsyncHTTPError(status, resp)
+
+    return json.loads(resp)["choices"][0]["message"]["content"]
@@ -0,0 +1,132 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from aio_llm import async_llm_chat, get_default_pool
+from main import LLMAgent, ai_msg, user_msg
+from tools import json_to_highlighted_str
+from util import printd
+
+# Shared by all sessions: tools in tool_defs block on requests/subprocess
+_tool_executor = None
+
+
+def get_tool_executor(max_workers=32) -> ThreadPoolExecutor:
+    global _tool_executor
+    if _tool_executor is None:
+        _tool_executor = ThreadPoolExecutor(max_workers, thread_name_prefix="picoagent-tool")
+    return _tool_executor
+
+
+class AsyncLLMAgent(LLMAgent):
+    """
+    asyncio-native LLMAgent: many independent sessions can run on one event loop.
+
+    LLM calls go through aio_llm's shared keep-alive connection pool, blocking tools and
+    tokenization run in a shared thread pool. Construct it inside a running loop and
+    `await agent.update(query)`; a first_user_msg is kept in `self.pending_query`, since the
+    constructor can't await.
+    """
+
+    journal_in_background = True  # journal records are written by a thread, see journal.open_session
+
+    def __init__(self, *args, first_user_msg=None, pool=None, executor=None, async_chat_fn=None, **kwargs):
+        if kwargs.get("stream_fc"):
+            raise ValueError("AsyncLLMAgent does not support stream_fc yet")
+        super().__init__(*args, first_user_msg=None, **kwargs)
+        self.pending_query = first_user_msg
+        self.pool = pool or get_default_pool()
+        self.executor = executor or get_tool_executor()
+        self.async_chat_fn = async_chat_fn or async_llm_chat
+        if self.router is not None and self.router.async_chat_fn is None:
+            self.router.async_chat_fn = self.async_chat_fn
+
+    async def run_blocking(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def allm_chat(self, msgs, **llm_api_kwargs):
+        if self.router is not None:
+            return await self.router.achat(msgs, session=self.session_id, pool=self.pool, **llm_api_kwargs)
+        return await self.async_chat_fn(msgs, pool=self.pool, **llm_api_kwargs)
+
+    async def llm_call_fc(self, msgs, llm_api_kwargs={}):
+        with self.tracer.span(
+            "llm.call", mode=self.function_calling_mode, model=self.llm_api_kwargs.get("model"), stream=False
+        ) as call_span:
+            _llm_api_kwargs = await self.run_blocking(self.prepare_llm_call, msgs, llm_api_kwargs)
+            await self.run_blocking(self.trace_prompt, call_span, msgs)
+
+            cache_key = self.completion_cache_key(msgs, _llm_api_kwargs)
+            if cache_key is not None:
+                json = await self.run_blocking(self.cached_completion, cache_key)
+                call_span.set(cache_hit=json is not None)
+                if json is not None:
+                    return json
+
+            n = 0
+            while n < self.n_attempts:
+                with self.tracer.span("llm.attempt", attempt=n + 1) as span:
+                    ret = await self.allm_chat(msgs, **_llm_api_kwargs)
+                    json = self.accept_llm_output(ret)
+                    span.set(outcome=self.llm_outcome(ret, json), output_chars=len(ret) if ret else 0)
+                call_span.set(attempts=n + 1, retries=n)
+                if json is not None:
+                    if cache_key is not None:
+                        await self.run_blocking(self.completion_cache.set, cache_key, ret)
+                    return json
+                n += 1
+
+            raise self.llm_format_failure()
+
+    async def update(self, query: str = None, stream=True, msg_printer=print, max_iter=3):
+        if query is None:
+            query, self.pending_query = self.pending_query, None
+
+        with self.tracer.span("agent.turn", session=self.session_id, query_chars=len(query)) as span:
+            self.turn_span = span if self.tracer.enabled else None
+            if self.journal is not None:
+                self.journal.begin_turn(query)
+            ret = await self.run_turn(query, msg_printer=msg_printer, max_iter=max_iter)
+            if self.journal is not None:
+                await asyncio.wrap_future(self.journal.end_turn(self.workdir))
+            span.set(history_msgs=len(self.msgs))
+            return ret
+
+    async def run_turn(self, query: str, msg_printer=print, max_iter=3):
+        self.msgs.append(user_msg(self.user_input_formatter(query)))
+        json_fc_obj = await self.llm_call_fc(self.msgs)
+
+        msg_turns = 0
+        while msg_turns < max_iter:
+            self.msgs.append(ai_msg(self.serialize_ai_msg(json_fc_obj)))
+
+            if isinstance(json_fc_obj, list):
+                next_msg = await self.run_blocking(self.run_multi_call, json_fc_obj, msg_printer)
+                if next_msg is None:
+                    return json_fc_obj
+                self.msgs.append(next_msg)
+                json_fc_obj = await self.llm_call_fc(self.msgs)
+                msg_turns += 1
+                continue
+
+            tool_name = json_fc_obj["call_tool"]
+            tool_args = json_fc_obj[self.tool_arg_field_name]
+
+            if msg_printer and tool_name == "send_message":
+                msg_printer(json_fc_obj[self.tool_arg_field_name]["message"])
+                return json_fc_obj
+
+            printd("LLM_RAW_OUT:", json_to_highlighted_str(json_fc_obj))
+
+            if self.tool_calls_allowed and self.tool_by_name.get(tool_name):
+                ret, error = await self.run_blocking(self.call_tool, tool_name, tool_args)
+                next_msg = self.tool_output_msg(ret, error)
+                self.msgs.append(next_msg)
+
+                printd(f"AI INNER MONOLOGUE: {json_to_highlighted_str(next_msg)}")
+                json_fc_obj = await self.llm_call_fc(self.msgs)
+            else:
+                return json_fc_obj
+
+            msg_turns += 1
+
+        return json_fc_obj
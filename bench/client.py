@@ -0,0 +1,40 @@
+import json
+
+from http_pool import get_session
+
+
+def openai_chat(msgs, api_base, api_key=None, model=None, stream=False, timeout=600, **kwargs):
+    """
+    Minimal llm_chat for OpenAI-compatible backends over the shared requests session, so the
+    benchmark measures the agent loop without llm_fns' client. Returns the completion text, or a
+    generator of text chunks when streaming.
+    """
+    headers = {"Content-Type": "application/json"}
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+    body = dict(messages=list(msgs), stream=stream, **kwargs)
+    if model:
+        body["model"] = model
+
+    response = get_session().post(
+        f"{api_base.rstrip('/')}/chat/completions", data=json.dumps(body), headers=headers, stream=stream, timeout=timeout
+    )
+    response.raise_for_status()
+    if not stream:
+        return response.json()["choices"][0]["message"]["content"]
+
+    def chunks():
+        try:
+            for line in response.iter_lines():
+                if not line.startswith(b"data: "):
+                    continue
+                data = line[len(b"data: ") :]
+                if data == b"[DONE]":
+                    break
+                content = json.loads(data)["choices"][0]["delta"].get("content")
+                if content:
+                    yield content
+        finally:
+            response.close()
+
+    return chunks()
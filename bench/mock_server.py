@@ -0,0 +1,195 @@
+"""
+OpenAI-compatible stand-in for an LLM backend: answers /chat/completions from a scripted responder
+or from recorded completions, with configurable latency and SSE streaming. Standalone:
+
+    python -m bench.mock_server --replay recorded.jsonl --latency 0.2 --port 8099
+"""
+import argparse
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from completion_cache import completion_key
+
+
+class ReplayResponder:
+    """
+    Serves completions recorded with `python -m bench.run --record`, one JSON object per line
+    with "completion" and optionally "messages". A request whose messages match a recording gets
+    that completion, anything else the next recording in file order (cycling).
+    """
+
+    def __init__(self, path):
+        self.records = []
+        self.by_messages = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                self.records.append(record["completion"])
+                if "messages" in record:
+                    self.by_messages[completion_key(record["messages"], {})] = record["completion"]
+        if not self.records:
+            raise ValueError(f"No recorded completions in {path}")
+        self.cursor = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, request):
+        completion = self.by_messages.get(completion_key(request.get("messages", []), {}))
+        if completion is not None:
+            return completion
+        with self.lock:
+            completion = self.records[self.cursor % len(self.records)]
+            self.cursor += 1
+        return completion
+
+
+class MockLLMServer:
+    """
+    Threaded HTTP server speaking the chat completions API on 127.0.0.1.
+
+    `responder(request_body) -> completion text` produces the answers. `latency` seconds pass before
+    the response (time to first token when streaming), streams send `chunk_chars` characters per SSE
+    event every `chunk_latency` seconds.
+    """
+
+    def __init__(self, responder, host="127.0.0.1", port=0, latency=0.0, chunk_latency=0.0, chunk_chars=8):
+        self.responder = responder
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.chunk_chars = chunk_chars
+        self.requests = 0
+        self.prompt_bytes = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def api_base(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> str:
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock-llm", daemon=True)
+        self.thread.start()
+        return self.api_base
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like llama.cpp and vLLM
+
+            def setup(self):
+                super().setup()
+                # headers and body go out in separate writes, don't let Nagle hold the body back
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status, obj):
+                body = json.dumps(obj).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self.send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+                else:
+                    self.send_json(404, {"error": {"message": f"no route {self.path}"}})
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_json(404, {"error": {"message": f"no route {self.path}"}})
+                    return
+                request = json.loads(raw)
+                with mock.lock:
+                    mock.requests += 1
+                    mock.prompt_bytes += len(raw)
+
+                completion = mock.responder(request)
+                if mock.latency:
+                    time.sleep(mock.latency)
+
+                if request.get("stream"):
+                    self.stream(completion, request.get("model", "mock"))
+                else:
+                    self.send_json(
+                        200,
+                        {
+                            "id": "mock",
+                            "object": "chat.completion",
+                            "model": request.get("model", "mock"),
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "message": {"role": "assistant", "content": completion},
+                                    "finish_reason": "stop",
+                                }
+                            ],
+                        },
+                    )
+
+            def stream(self, completion, model):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                n = mock.chunk_chars
+                try:
+                    for i in range(0, len(completion), n):
+                        if i and mock.chunk_latency:
+                            time.sleep(mock.chunk_latency)
+                        event = {
+                            "object": "chat.completion.chunk",
+                            "model": model,
+                            "choices": [{"index": 0, "delta": {"content": completion[i : i + n]}}],
+                        }
+                        self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client stops reading once the tool call is complete
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible LLM server")
+    parser.add_argument("--replay", required=True, help="JSONL file of recorded completions")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the (first chunk of the) response")
+    parser.add_argument("--chunk-latency", type=float, default=0.0, help="Seconds between streamed chunks")
+    parser.add_argument("--chunk-chars", type=int, default=8, help="Characters per streamed chunk")
+    args = parser.parse_args()
+
+    server = MockLLMServer(
+        ReplayResponder(args.replay),
+        port=args.port,
+        latency=args.latency,
+        chunk_latency=args.chunk_latency,
+        chunk_chars=args.chunk_chars,
+    )
+    print(f"Serving on {server.api_base}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Benchmark of the agent loop against a mock LLM backend, independent of model speed:
+
+    python -m bench.run --workload tools --turns 50 --latency 0.05
+
+reports per-phase timings (prompt build, LLM wait, parse, validate, tool execution, the remaining
+agent overhead) and how the history grows over the turns. With --api-base pointing at a real
+backend and --record, the completions are saved for later --replay runs.
+"""
+import argparse
+import contextlib
+import io
+import json
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+import main as agent_main
+from main import LLMAgent
+from tools import available_tools, load_fn_as_tool
+
+from bench.client import openai_chat
+from bench.mock_server import MockLLMServer, ReplayResponder
+from bench.workload import BENCH_TOOLS, WORKLOADS, ScriptedResponder, turn_query
+
+PHASES = ("prompt build", "llm wait", "llm stream", "parse", "validate", "tool exec", "overhead", "turn")
+
+
+class TimedAgent(LLMAgent):
+    """LLMAgent recording the wall time of each phase of update()"""
+
+    def __init__(self, *args, **kwargs):
+        self.phases = defaultdict(list)
+        super().__init__(*args, **kwargs)
+
+    @contextlib.contextmanager
+    def timed(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phase].append(time.perf_counter() - start)
+
+    def prepare_llm_call(self, msgs, llm_api_kwargs={}):
+        with self.timed("prompt build"):
+            return super().prepare_llm_call(msgs, llm_api_kwargs)
+
+    def llm_chat(self, msgs, **llm_api_kwargs):
+        if llm_api_kwargs.get("stream"):
+            return super().llm_chat(msgs, **llm_api_kwargs)  # consumed and timed in llm_chat_streamed
+        with self.timed("llm wait"):
+            return super().llm_chat(msgs, **llm_api_kwargs)
+
+    def llm_chat_streamed(self, msgs, llm_api_kwargs):
+        with self.timed("llm stream"):
+            return super().llm_chat_streamed(msgs, llm_api_kwargs)
+
+    def parse_llm_output(self, ret):
+        with self.timed("parse"):
+            return super().parse_llm_output(ret)
+
+    def validate_llm_output(self, json):
+        with self.timed("validate"):
+            return super().validate_llm_output(json)
+
+    def call_tool(self, tool_name, tool_args):
+        with self.timed("tool exec"):
+            return super().call_tool(tool_name, tool_args)
+
+
+def recording_chat(chat_fn, path):
+    """Wraps a chat function to append every completion with its messages to a JSONL file"""
+    f = open(path, "a", encoding="utf-8")
+
+    def chat(msgs, **kwargs):
+        ret = chat_fn(msgs, **kwargs)
+        if not isinstance(ret, str):
+            ret = "".join(ret)
+        f.write(json.dumps({"messages": list(msgs), "completion": ret}) + "\n")
+        f.flush()
+        return ret
+
+    return chat
+
+
+def history_size(msgs) -> int:
+    return sum(len(msgs.serialized(i)) for i in range(len(msgs)))
+
+
+def run(args, api_base):
+    chat_fn = openai_chat if args.client == "builtin" else agent_main.llm_chat
+    if args.record:
+        chat_fn = recording_chat(chat_fn, args.record)
+
+    tools = [available_tools["send_message"]] + [load_fn_as_tool(fn) for fn in BENCH_TOOLS]
+    agent = TimedAgent(
+        prompt=agent_main.prompt_tooluse_ultramin_thoughts_system_criticism,
+        tools=tools,
+        first_msg=json.dumps(
+            dict(thoughts="Benchmark session", call_tool="send_message", params=dict(message="Ready"))
+        ),
+        function_calling_mode=args.fc_mode,
+        llm_api_kwargs=dict(api_base=api_base, model=args.model),
+        stream_fc=args.stream,
+        stream_printer=None,
+        context_budget=args.context_budget,
+        chat_fn=chat_fn,
+    )
+
+    history = []
+    for i in range(args.turns):
+        llm_before = sum(agent.phases["llm wait"]) + sum(agent.phases["llm stream"])
+        tools_before = sum(agent.phases["tool exec"])
+        with agent.timed("turn"):
+            agent.update(turn_query(args.workload, i), msg_printer=lambda message: None)
+        turn = agent.phases["turn"][-1]
+        llm = sum(agent.phases["llm wait"]) + sum(agent.phases["llm stream"]) - llm_before
+        tools_time = sum(agent.phases["tool exec"]) - tools_before
+        agent.phases["overhead"].append(turn - llm - tools_time)
+        history.append((len(agent.msgs), history_size(agent.msgs)))
+
+    return agent.phases, history
+
+
+def summarize(samples):
+    ms = sorted(s * 1000 for s in samples)
+    return dict(
+        count=len(ms),
+        total_ms=sum(ms),
+        mean_ms=statistics.fmean(ms),
+        p50_ms=ms[len(ms) // 2],
+        p95_ms=ms[min(len(ms) - 1, int(len(ms) * 0.95))],
+        max_ms=ms[-1],
+    )
+
+
+def report(phases, history, turns):
+    lines = [f"{'phase':<14}{'count':>7}{'total ms':>11}{'mean':>9}{'p50':>9}{'p95':>9}{'max':>9}"]
+    for phase in PHASES:
+        if not phases.get(phase):
+            continue
+        s = summarize(phases[phase])
+        lines.append(
+            f"{phase:<14}{s['count']:>7}{s['total_ms']:>11.1f}{s['mean_ms']:>9.2f}{s['p50_ms']:>9.2f}{s['p95_ms']:>9.2f}{s['max_ms']:>9.2f}"
+        )
+
+    lines.append("")
+    lines.append(f"{'history after turn':<20}{'msgs':>7}{'bytes':>11}")
+    for i in sorted({0, turns // 4, turns // 2, 3 * turns // 4, turns - 1}):
+        n_msgs, n_bytes = history[i]
+        lines.append(f"{i + 1:<20}{n_msgs:>7}{n_bytes:>11}")
+    if turns > 1:
+        growth = (history[-1][1] - history[0][1]) / (turns - 1)
+        lines.append(f"growth: {growth:.0f} bytes/turn")
+
+    # prompt build cost scaling with history, first vs last quarter of the calls
+    builds = phases.get("prompt build", [])
+    if len(builds) >= 8:
+        q = len(builds) // 4
+        first, last = statistics.fmean(builds[:q]) * 1000, statistics.fmean(builds[-q:]) * 1000
+        lines.append(f"prompt build: {first:.2f} ms (first quarter) -> {last:.2f} ms (last quarter)")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the agent loop against a mock LLM backend")
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), default="tools")
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0, help="Mock backend seconds to first token")
+    parser.add_argument("--chunk-latency", type=float, default=0.0, help="Mock backend seconds between streamed chunks")
+    parser.add_argument("--stream", action="store_true", help="Stream completions through the incremental parser")
+    parser.add_argument(
+        "--fc-mode", choices=["json_schema", "grammar", "regex", "json_mode", "none"], default="json_schema"
+    )
+    parser.add_argument("--context-budget", type=int)
+    parser.add_argument(
+        "--client",
+        choices=["builtin", "llm_fns"],
+        default="builtin",
+        help="HTTP client: bench.client.openai_chat, or llm_fns' llm_chat as used by the agent CLI",
+    )
+    parser.add_argument("--replay", help="Serve recorded completions from this JSONL file instead of the workload script")
+    parser.add_argument("--api-base", help="Use this backend instead of the mock server")
+    parser.add_argument("--model", default="mock")
+    parser.add_argument("--record", help="Append completions with their messages to this JSONL file, for --replay")
+    parser.add_argument("--json", action="store_true", help="Print raw timings as JSON")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the agent's own output")
+    args = parser.parse_args()
+
+    server = None
+    api_base = args.api_base
+    if api_base is None:
+        responder = ReplayResponder(args.replay) if args.replay else ScriptedResponder(args.workload)
+        server = MockLLMServer(responder, latency=args.latency, chunk_latency=args.chunk_latency)
+        api_base = server.start()
+
+    try:
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+            phases, history = run(args, api_base)
+    finally:
+        if server is not None:
+            server.stop()
+
+    if args.json:
+        json.dump(dict(phases=phases, history=history), sys.stdout)
+        print()
+    else:
+        print(f"workload={args.workload} turns={args.turns} stream={args.stream} fc_mode={args.fc_mode}")
+        print(report(phases, history, args.turns))
+
+
+if __name__ == "__main__":
+    main()
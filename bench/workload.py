@@ -0,0 +1,115 @@
+"""
+Synthetic tools and scripted conversations for the benchmark. The scripted responder plays the
+LLM: for every turn of a workload it answers with that turn's tool calls, one per request, and
+then with send_message.
+"""
+import hashlib
+import json
+import re
+import time
+
+from util import read_only
+
+TURN_RE = re.compile(r"^BENCH TURN (\d+)\b")
+
+
+@read_only
+def bench_compute(self, n: int) -> str:
+    """
+    CPU-bound synthetic tool: chains n sha256 rounds.
+
+    Args:
+        n (int): Number of hash rounds.
+
+    Returns:
+        str: Final digest.
+    """
+    h = b""
+    for _ in range(n):
+        h = hashlib.sha256(h).digest()
+    return h.hex()
+
+
+@read_only
+def bench_wait(self, ms: int) -> str:
+    """
+    I/O-bound synthetic tool: sleeps like a network or disk call would block.
+
+    Args:
+        ms (int): Milliseconds to sleep.
+
+    Returns:
+        str: Confirmation.
+    """
+    time.sleep(ms / 1000)
+    return f"waited {ms} ms"
+
+
+@read_only
+def bench_blob(self, kb: int) -> str:
+    """
+    Synthetic tool with a large output, grows the history like a file read or web page does.
+
+    Args:
+        kb (int): Output size in KiB.
+
+    Returns:
+        str: Pseudo-random text of the requested size.
+    """
+    words = []
+    size = 0
+    h = hashlib.sha256(str(kb).encode("utf-8")).hexdigest()
+    while size < kb * 1024:
+        h = hashlib.sha256(h.encode("utf-8")).hexdigest()
+        word = h[: 3 + int(h[0], 16) % 8]
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+
+BENCH_TOOLS = (bench_compute, bench_wait, bench_blob)
+
+# workload name -> turns, each a list of (tool name, params) called before the send_message answer
+WORKLOADS = {
+    "chat": [[]],
+    "tools": [
+        [("bench_compute", {"n": 20000})],
+        [("bench_wait", {"ms": 20})],
+        [("bench_blob", {"kb": 4}), ("bench_compute", {"n": 5000})],
+    ],
+    "history": [[("bench_blob", {"kb": 32})]],
+}
+
+
+def turn_query(workload, i) -> str:
+    calls = WORKLOADS[workload][i % len(WORKLOADS[workload])]
+    return f"BENCH TURN {i}: " + (", ".join(name for name, _ in calls) or "reply")
+
+
+class ScriptedResponder:
+    """Mock server responder answering the turns of a workload, driven by the "BENCH TURN i" queries"""
+
+    def __init__(self, workload, tool_arg_field_name="params"):
+        self.turns = WORKLOADS[workload]
+        self.tool_arg_field_name = tool_arg_field_name
+
+    def __call__(self, request):
+        msgs = request["messages"]
+        for pos in range(len(msgs) - 1, -1, -1):
+            m = TURN_RE.match(msgs[pos]["content"]) if msgs[pos]["role"] == "user" else None
+            if m:
+                break
+        else:
+            return self.call("send_message", {"message": "No benchmark turn found"})
+
+        turn = int(m.group(1))
+        step = sum(1 for msg in msgs[pos + 1 :] if msg["role"] == "assistant")
+        calls = self.turns[turn % len(self.turns)]
+        if step < len(calls):
+            return self.call(*calls[step])
+        return self.call("send_message", {"message": f"Turn {turn} done"})
+
+    def call(self, tool_name, params):
+        return json.dumps(
+            {"thoughts": f"Benchmark step: {tool_name}", "call_tool": tool_name, self.tool_arg_field_name: params}
+        )
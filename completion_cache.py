@@ -0,0 +1,49 @@
+import hashlib
+import json
+import os
+import threading
+
+from msglog import MessageLog, serialize_msg
+from sqlite_cache import CACHE_DIR, SqliteCache
+
+# connection details and transport options, they don't change what a deterministic model generates
+UNKEYED_KWARGS = ("api_base", "api_key", "stream", "pool", "timeout")
+
+
+def is_deterministic(llm_api_kwargs) -> bool:
+    """Only greedy or explicitly seeded calls are cached, sampled ones are supposed to differ"""
+    return llm_api_kwargs.get("temperature") == 0 or llm_api_kwargs.get("seed") is not None
+
+
+def completion_key(msgs, llm_api_kwargs) -> str:
+    """
+    Cache key of an LLM call: chained hash of the canonical messages, plus the model, sampling
+    params and schema/grammar in canonical JSON.
+    """
+    if isinstance(msgs, MessageLog):
+        msgs_hash = msgs.prefix_hash()
+    else:
+        h = hashlib.sha256()
+        for msg in msgs:
+            h.update(hashlib.sha256(serialize_msg(msg)).digest())
+        msgs_hash = h.hexdigest()
+    params = {k: v for k, v in llm_api_kwargs.items() if k not in UNKEYED_KWARGS}
+    return msgs_hash + json.dumps(params, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+_completion_cache = None
+_completion_cache_lock = threading.Lock()
+
+
+def get_completion_cache():
+    """Shared cache of deterministic LLM completions, None if disabled with MEMGPT_DISABLE_COMPLETION_CACHE"""
+    global _completion_cache
+    if os.environ.get("MEMGPT_DISABLE_COMPLETION_CACHE"):
+        return None
+    with _completion_cache_lock:
+        if _completion_cache is None:
+            _completion_cache = SqliteCache(
+                os.path.join(CACHE_DIR, "completions.sqlite"),
+                max_bytes=int(os.environ.get("MEMGPT_COMPLETION_CACHE_MAX_BYTES", str(512 * 1024 * 1024))),
+            )
+        return _completion_cache
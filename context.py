@@ -0,0 +1,101 @@
+import re
+
+from util import printd
+
+TOOL_OUTPUT_RE = re.compile(r"(<tool-output[^>]*>\n?)(.*)(\n?</tool-output>)", re.DOTALL)
+
+
+class ContextWindow:
+    """
+    Keeps the agent's message log under a token budget.
+
+    Token counts are computed once per message content and cached, omnitokenizer falls back to a
+    local estimate when the backend has no tokenizer api. When the prompt goes over budget, old
+    tool outputs are cut down to their head and tail first (oldest first), then the oldest
+    messages are dropped. The system prompt and the last `keep_last` messages are never
+    touched. Compaction shrinks the prompt to `target_ratio * budget` so it doesn't have to run
+    (and break the backend prefix cache) on every turn.
+    """
+
+    def __init__(
+        self,
+        budget: int,
+        model=None,
+        keep_last=6,
+        target_ratio=0.8,
+        min_elide_tokens=256,
+        keep_chars=600,
+        msg_overhead=4,
+    ):
+        self.budget = budget
+        self.model = model
+        self.keep_last = keep_last
+        self.target_ratio = target_ratio
+        self.min_elide_tokens = min_elide_tokens
+        self.keep_chars = keep_chars
+        self.msg_overhead = msg_overhead
+        self.counts = {}
+
+    def count_many(self, msgs):
+        """Count tokens of all messages not seen before in one batched tokenizer call"""
+        missing = list({msg.get("content") or "" for msg in msgs} - self.counts.keys())
+        if missing:
+            from omnitokenizer import count_tokens_many
+
+            for content, n in zip(missing, count_tokens_many(missing, model=self.model)):
+                self.counts[content] = n + self.msg_overhead
+
+    def count(self, msg) -> int:
+        content = msg.get("content") or ""
+        if content not in self.counts:
+            self.count_many([msg])
+        return self.counts[content]
+
+    def total(self, msgs) -> int:
+        self.count_many(msgs)
+        return sum(self.count(msg) for msg in msgs)
+
+    def prune_counts(self, msgs):
+        live = {msg.get("content") or "" for msg in msgs}
+        self.counts = {k: v for k, v in self.counts.items() if k in live}
+
+    def elide_tool_output(self, content: str, tokens: int):
+        m = TOOL_OUTPUT_RE.search(content)
+        if not m or len(m.group(2)) <= 2 * self.keep_chars:
+            return None
+        body = m.group(2)
+        half = self.keep_chars // 2
+        note = f"\n[... tool output elided to fit context, was ~{tokens} tokens ...]\n"
+        return content[: m.start(2)] + body[:half] + note + body[-half:] + content[m.end(2) :]
+
+    def fit(self, msgs) -> bool:
+        """Compact msgs in place if they exceed the budget, returns True if anything changed"""
+        total = self.total(msgs)
+        if total <= self.budget:
+            return False
+
+        target = int(self.budget * self.target_ratio)
+        protected_from = max(1, len(msgs) - self.keep_last)
+        printd(f"[context] {total} tokens over budget {self.budget}, compacting to {target}")
+
+        for i in range(1, protected_from):
+            if total <= target:
+                break
+            msg = msgs[i]
+            tokens = self.count(msg)
+            if msg.get("role") != "user" or tokens < self.min_elide_tokens:
+                continue
+            content = self.elide_tool_output(msg.get("content") or "", tokens)
+            if content is None:
+                continue
+            msgs[i] = dict(msg, content=content)
+            total += self.count(msgs[i]) - tokens
+
+        while len(msgs) - 1 > self.keep_last and (total > target or msgs[1].get("role") != "user"):
+            # drop whole exchanges so the history after the system prompt still starts with a user turn
+            total -= self.count(msgs[1])
+            del msgs[1]
+
+        self.prune_counts(msgs)
+        printd(f"[context] compacted to {total} tokens, {len(msgs)} msgs")
+        return True
@@ -0,0 +1,201 @@
+import json
+import re
+
+import orjson
+
+# orjson only covers str keys and 64-bit ints, anything else goes through the stdlib
+_ORJSON_ERRORS = (orjson.JSONEncodeError, TypeError)
+
+
+def dumps(obj, sort_keys=False, indent=False) -> str:
+    """Compact JSON (no spaces after separators, non-ASCII kept as is) through orjson"""
+    option = (orjson.OPT_SORT_KEYS if sort_keys else 0) | (orjson.OPT_INDENT_2 if indent else 0)
+    try:
+        return orjson.dumps(obj, option=option).decode("utf-8")
+    except _ORJSON_ERRORS:
+        return json.dumps(
+            obj,
+            sort_keys=sort_keys,
+            ensure_ascii=False,
+            indent=2 if indent else None,
+            separators=(",", ": ") if indent else (",", ":"),
+        )
+
+
+def dumps_bytes(obj, sort_keys=False) -> bytes:
+    try:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    except _ORJSON_ERRORS:
+        return json.dumps(obj, sort_keys=sort_keys, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(s):
+    return orjson.loads(s)
+
+
+# tolerant parsing
+
+VALUE_START_RE = re.compile(r"[\[{]")
+# whitespace and //, # or /* */ comments
+WS_RE = re.compile(r"(?:\s+|//[^\n]*|#[^\n]*|/\*(?:[^*]|\*(?!/))*\*/)*")
+NUMBER_RE = re.compile(r"[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+IDENT_RE = re.compile(r"[A-Za-z_$][\w$]*")
+STRING_RUN_RE = {'"': re.compile(r'[^"\\]*'), "'": re.compile(r"[^'\\]*")}
+ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", "/": "/", "\\": "\\", '"': '"', "'": "'"}
+LITERALS = {"true": True, "True": True, "false": False, "False": False, "null": None, "None": None}
+
+MAX_DEPTH = 256
+MAX_STARTS = 8  # candidate start positions tried, bounds the work to MAX_STARTS passes over the text
+
+
+class TolerantParseError(ValueError):
+    pass
+
+
+class TolerantParser:
+    """
+    Single-pass recursive descent JSON parser for LLM output. Accepts what models tend to produce
+    around or inside otherwise valid JSON: single-quoted strings, unquoted keys, trailing or
+    missing commas, //, # and /* */ comments, Python literals, raw control characters in strings.
+    Parsing stops after the first complete value, whatever follows it is ignored. Every character
+    is looked at a bounded number of times, so the cost is linear in the input size.
+    """
+
+    def __init__(self, text):
+        self.s = text
+        self.n = len(text)
+
+    def fail(self, i, what):
+        raise TolerantParseError(f"{what} at position {i}")
+
+    def ws(self, i):
+        return WS_RE.match(self.s, i).end()
+
+    def value(self, i, depth=0):
+        if depth > MAX_DEPTH:
+            self.fail(i, "nesting too deep")
+        i = self.ws(i)
+        if i >= self.n:
+            self.fail(i, "unexpected end of input")
+        c = self.s[i]
+        if c == "{":
+            return self.object(i + 1, depth + 1)
+        if c == "[":
+            return self.array(i + 1, depth + 1)
+        if c == '"' or c == "'":
+            return self.string(i)
+        m = NUMBER_RE.match(self.s, i)
+        if m:
+            text = m.group(0)
+            if "." in text or "e" in text or "E" in text:
+                return float(text), m.end()
+            return int(text), m.end()
+        m = IDENT_RE.match(self.s, i)
+        if m and m.group(0) in LITERALS:
+            return LITERALS[m.group(0)], m.end()
+        self.fail(i, f"unexpected {c!r}")
+
+    def object(self, i, depth):
+        obj = {}
+        s = self.s
+        while True:
+            i = self.ws(i)
+            if i >= self.n:
+                self.fail(i, "unterminated object")
+            c = s[i]
+            if c == "}":
+                return obj, i + 1
+            if c == ",":  # trailing or doubled comma
+                i += 1
+                continue
+            if c == '"' or c == "'":
+                key, i = self.string(i)
+            else:
+                m = IDENT_RE.match(s, i)
+                if not m:
+                    self.fail(i, "expected an object key")
+                key, i = m.group(0), m.end()
+            i = self.ws(i)
+            if i >= self.n or s[i] != ":":
+                self.fail(i, "expected ':'")
+            obj[key], i = self.value(i + 1, depth)
+            # a missing comma before the next key is tolerated, the loop just reads on
+
+    def array(self, i, depth):
+        arr = []
+        s = self.s
+        while True:
+            i = self.ws(i)
+            if i >= self.n:
+                self.fail(i, "unterminated array")
+            c = s[i]
+            if c == "]":
+                return arr, i + 1
+            if c == ",":
+                i += 1
+                continue
+            item, i = self.value(i, depth)
+            arr.append(item)
+
+    def string(self, i):
+        s = self.s
+        quote = s[i]
+        run = STRING_RUN_RE[quote]
+        parts = []
+        surrogates = False
+        j = i + 1
+        while True:
+            m = run.match(s, j)
+            parts.append(m.group(0))
+            j = m.end()
+            if j >= self.n:
+                self.fail(i, "unterminated string")
+            if s[j] == quote:
+                text = "".join(parts)
+                if surrogates:
+                    text = text.encode("utf-16", "surrogatepass").decode("utf-16", "replace")
+                return text, j + 1
+            # backslash escape
+            esc = s[j + 1 : j + 2]
+            if esc == "u":
+                hex_digits = s[j + 2 : j + 6]
+                try:
+                    code = int(hex_digits, 16)
+                except ValueError:
+                    self.fail(j, "bad \\u escape")
+                surrogates = surrogates or 0xD800 <= code <= 0xDFFF
+                parts.append(chr(code))
+                j += 6
+            else:
+                parts.append(ESCAPES.get(esc, esc))
+                j += 2
+
+
+def tolerant_loads(text: str, accept=None):
+    """
+    First JSON object or array found in text, parsed leniently (see TolerantParser): code fences
+    and prose before or after it are skipped. With `accept`, values it rejects are skipped too,
+    e.g. a bracketed "[1]" in the prose before a tool call; if none is accepted the first value
+    parsed is returned. Raises TolerantParseError if there is none.
+    """
+    parser = TolerantParser(text)
+    error = None
+    first = None
+    pos = 0
+    for _ in range(MAX_STARTS):
+        m = VALUE_START_RE.search(text, pos)
+        if m is None:
+            break
+        pos = m.start() + 1
+        try:
+            value = parser.value(m.start())[0]
+        except (TolerantParseError, RecursionError) as e:
+            error = e
+            continue
+        if accept is None or accept(value):
+            return value
+        if first is None:
+            first = (value,)
+    if first is not None:
+        return first[0]
+    raise TolerantParseError(f"no JSON value found: {error}" if error else "no JSON value found")
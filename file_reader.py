@@ -0,0 +1,130 @@
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from omnitokenizer import local_tokenize
+
+INDEX_CHUNK_BYTES = 16 * 1024 * 1024
+INDEX_CACHE_ENTRIES = int(os.environ.get("MEMGPT_READ_INDEX_CACHE", "16"))
+READ_MAX_CHARS = int(os.environ.get("MEMGPT_READ_MAX_CHARS", "500"))
+READ_MAX_TOKENS = int(os.environ.get("MEMGPT_READ_MAX_TOKENS", "0")) or None
+UTF8_MAX_CHAR_BYTES = 4
+
+
+class LineIndex:
+    """
+    Byte offsets of line starts in a file, for O(1) seeks to any line.
+
+    Built in one pass over an mmap of the file, INDEX_CHUNK_BYTES at a time, with numpy doing the
+    newline search, so indexing a multi-GB log costs a sequential read and 8 bytes per line.
+    """
+
+    def __init__(self, path, mtime_ns, size):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.starts = self._build()
+
+    def _build(self):
+        parts = [np.zeros(1, dtype=np.int64)]
+        if self.size:
+            with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for pos in range(0, self.size, INDEX_CHUNK_BYTES):
+                    chunk = np.frombuffer(mm, dtype=np.uint8, count=min(INDEX_CHUNK_BYTES, self.size - pos), offset=pos)
+                    parts.append(np.flatnonzero(chunk == 10).astype(np.int64) + (pos + 1))
+                    del chunk  # release the buffer export before the mmap closes
+        starts = np.concatenate(parts)
+        if len(starts) > 1 and starts[-1] == self.size:
+            starts = starts[:-1]  # trailing newline doesn't start another line
+        return starts
+
+    @property
+    def num_lines(self) -> int:
+        return len(self.starts) if self.size else 0
+
+    def line_range(self, first, count):
+        """Byte range [start, end) covering `count` lines from 0-based line `first`"""
+        first = max(0, min(first, self.num_lines))
+        last = min(first + count, self.num_lines)
+        start = int(self.starts[first]) if first < self.num_lines else self.size
+        end = int(self.starts[last]) if last < self.num_lines else self.size
+        return start, end
+
+
+_index_cache = OrderedDict()
+_index_lock = threading.Lock()
+
+
+def get_line_index(path) -> LineIndex:
+    """Line index of a file, cached per (path, mtime, size)"""
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    with _index_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+
+    index = LineIndex(path, st.st_mtime_ns, st.st_size)
+    with _index_lock:
+        for stale in [k for k in _index_cache if k[0] == path]:
+            del _index_cache[stale]
+        _index_cache[key] = index
+        while len(_index_cache) > INDEX_CACHE_ENTRIES:
+            _index_cache.popitem(last=False)
+    return index
+
+
+def clamp_end(start, end, max_chars=None) -> int:
+    """End of [start, end) cut to the most bytes max_chars characters can take up in UTF-8"""
+    if max_chars is None:
+        return end
+    return min(end, start + max_chars * UTF8_MAX_CHAR_BYTES)
+
+
+def read_byte_range(path, start, end, max_chars=None) -> bytes:
+    """Bytes [start, end) of a file, only the first ones holding max_chars characters at most"""
+    size = os.path.getsize(path)
+    start, end = max(0, min(start, size)), max(0, min(end, size))
+    end = clamp_end(start, end, max_chars)
+    if end <= start:
+        return b""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return mm[start:end]
+
+
+def read_lines(path, line_start, num_lines, max_chars=None):
+    """
+    `num_lines` lines from 1-based line_start, returns (text, index, clamped). With max_chars only
+    as many bytes are read as could be returned, clamped tells whether the range was cut.
+    """
+    index = get_line_index(path)
+    start, end = index.line_range(line_start - 1, num_lines)
+    data = read_byte_range(index.path, start, end, max_chars)
+    return data.decode("utf-8", errors="replace"), index, start + len(data) < end
+
+
+def read_tail(path, num_lines, max_chars=None):
+    """Last `num_lines` lines, returns (text, 1-based number of the first line returned, index, clamped)"""
+    index = get_line_index(path)
+    first = max(0, index.num_lines - num_lines)
+    start, end = index.line_range(first, num_lines)
+    data = read_byte_range(index.path, start, end, max_chars)
+    return data.decode("utf-8", errors="replace"), first + 1, index, start + len(data) < end
+
+
+def apply_budget(text, max_chars=None, max_tokens=None, model=None):
+    """Cut text to the char and token budgets, returns (text, name of the budget that was hit or None)"""
+    hit = None
+    if max_chars is not None and len(text) > max_chars:
+        text, hit = text[:max_chars], f"max chars ({max_chars})"
+    if max_tokens is not None:
+        n = len(local_tokenize(text, model))
+        while n > max_tokens:
+            text = text[: max(0, int(len(text) * max_tokens / n) - 1)]
+            n, hit = len(local_tokenize(text, model)), f"max tokens ({max_tokens})"
+    return text, hit
@@ -0,0 +1,328 @@
+import json
+import re
+import threading
+
+from validation import schema_hash
+
+# llama.cpp's json-schema-to-grammar primitives: name -> (body, rules it references)
+GBNF_PRIMITIVES = {
+    "space": (r'| " " | "\n" [ \t]{0,20}', []),
+    "boolean": (r'("true" | "false") space', ["space"]),
+    "null": (r'"null" space', ["space"]),
+    "char": (r'[^"\\\x7F\x00-\x1F] | [\\] (["\\bfnrt] | "u" [0-9a-fA-F]{4})', []),
+    "string": (r'"\"" char* "\"" space', ["char", "space"]),
+    "integral-part": (r"[0] | [1-9] [0-9]{0,15}", []),
+    "decimal-part": (r"[0-9]{1,16}", []),
+    "integer": (r'("-"? integral-part) space', ["integral-part", "space"]),
+    "number": (
+        r'("-"? integral-part) ("." decimal-part)? ([eE] [-+]? integral-part)? space',
+        ["integral-part", "decimal-part", "space"],
+    ),
+    "value": (r"object | array | string | number | boolean | null", ["object", "array", "string", "number", "boolean", "null"]),
+    "object": (
+        r'"{" space ( string ":" space value ("," space string ":" space value)* )? "}" space',
+        ["string", "value", "space"],
+    ),
+    "array": (r'"[" space ( value ("," space value)* )? "]" space', ["value", "space"]),
+}
+
+RE_SPACE = r"(?: |\n[ \t]{0,20})?"
+RE_CHAR = r'(?:[^"\\\x00-\x1f\x7f]|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))'
+RE_INTEGER = r"-?(?:0|[1-9][0-9]{0,15})"
+RE_NUMBER = RE_INTEGER + r"(?:\.[0-9]{1,16})?(?:[eE][-+]?(?:0|[1-9][0-9]{0,15}))?"
+RE_SCALARS = {
+    "string": f'"{RE_CHAR}*"',
+    "integer": RE_INTEGER,
+    "number": RE_NUMBER,
+    "boolean": "(?:true|false)",
+    "null": "null",
+}
+RE_ANY_DEPTH = 2  # nesting allowed for schema-less values, regular expressions can't recurse
+
+
+def gbnf_literal(s: str) -> str:
+    out = []
+    for ch in s:
+        if ch in '"\\':
+            out.append("\\" + ch)
+        elif ch == "\n":
+            out.append("\\n")
+        elif ch == "\r":
+            out.append("\\r")
+        elif ch == "\t":
+            out.append("\\t")
+        elif ord(ch) < 0x20 or ord(ch) == 0x7F:
+            out.append(f"\\x{ord(ch):02X}")
+        else:
+            out.append(ch)
+    return '"' + "".join(out) + '"'
+
+
+def json_literal(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def repeat(lo, hi) -> str:
+    """GBNF/regex quantifier for lo..hi repetitions, hi=None is unbounded"""
+    if hi is None:
+        return "*" if lo == 0 else ("+" if lo == 1 else f"{{{lo},}}")
+    if (lo, hi) == (0, 1):
+        return "?"
+    return f"{{{lo},{hi}}}" if lo != hi else f"{{{lo}}}"
+
+
+def branch_hint(schema, default):
+    """Readable rule name for an anyOf branch: the value of its const property (the tool name) if any"""
+    for prop in schema.get("properties", {}).values():
+        if isinstance(prop, dict) and isinstance(prop.get("const"), str):
+            return prop["const"]
+    return default
+
+
+def object_layout(schema):
+    props = list(schema.get("properties", {}).items())
+    required = set(schema.get("required", []))
+    return [(name, prop, name in required) for name, prop in props]
+
+
+def sequence_props(kvs, comma, opt, alt):
+    """
+    Expression matching the key-value pairs in declared order, required ones always present and
+    optional ones skippable, with separators only between the pairs actually emitted.
+    kvs is [(expression, required)], opt/alt build optional and alternative groups.
+    """
+    after = first = ""
+    for kv, required in reversed(kvs):
+        if required:
+            after, first = f"{comma}{kv}{after}", f"{kv}{after}"
+        else:
+            after, first = f"{opt(comma + kv)}{after}", alt(f"{kv}{after}", first)
+    return first
+
+
+def tuple_items(schema):
+    """Item schemas of a fixed-length array, in the draft-07 (list valued items) or 2020-12 (prefixItems) form"""
+    if isinstance(schema.get("items"), list):
+        return schema["items"]
+    return schema.get("prefixItems")
+
+
+class GBNFCompiler:
+    """Compiles a JSON schema into a llama.cpp GBNF grammar, one rule per object/array/union"""
+
+    def __init__(self):
+        self.rules = {}  # name -> body, in definition order
+        self.names_by_body = {}
+        self.primitives = set()
+
+    def add_rule(self, hint, body):
+        if body in self.names_by_body:
+            return self.names_by_body[body]
+        base = re.sub(r"[^a-zA-Z0-9-]+", "-", str(hint)).strip("-").lower() or "rule"
+        name, i = base, 1
+        while name in self.rules or name in GBNF_PRIMITIVES or name == "root":
+            i += 1
+            name = f"{base}-{i}"
+        self.rules[name] = body
+        self.names_by_body[body] = name
+        return name
+
+    def primitive(self, name):
+        self.primitives.add(name)
+        return name
+
+    def visit(self, schema, hint) -> str:
+        """Returns the name of a rule matching schema followed by optional whitespace"""
+        if schema is True or not schema or set(schema) <= {"title", "description", "$schema", "default"}:
+            return self.primitive("value")
+
+        if "const" in schema:
+            return self.add_rule(hint, f"{gbnf_literal(json_literal(schema['const']))} {self.primitive('space')}")
+
+        if "enum" in schema:
+            alts = " | ".join(gbnf_literal(json_literal(v)) for v in schema["enum"])
+            return self.add_rule(hint, f"({alts}) {self.primitive('space')}")
+
+        branches = schema.get("anyOf") or schema.get("oneOf")
+        if branches:
+            names = [self.visit(b, branch_hint(b, f"{hint}-{i}")) for i, b in enumerate(branches)]
+            return names[0] if len(names) == 1 else self.add_rule(hint, " | ".join(names))
+
+        t = schema.get("type")
+        if isinstance(t, list):
+            names = [self.visit({**schema, "type": x}, f"{hint}-{x}") for x in t]
+            return self.add_rule(hint, " | ".join(names))
+        if t is None:
+            t = "object" if "properties" in schema else "array" if "items" in schema else None
+        if t is None:
+            return self.primitive("value")
+
+        if t == "object":
+            return self.visit_object(schema, hint)
+        if t == "array":
+            return self.visit_array(schema, hint)
+        if t == "string" and ("minLength" in schema or "maxLength" in schema):
+            self.primitive("char")
+            q = repeat(schema.get("minLength", 0), schema.get("maxLength"))
+            return self.add_rule(hint, f'"\\"" char{q} "\\"" {self.primitive("space")}')
+        if t in ("string", "integer", "number", "boolean", "null"):
+            return self.primitive(t)
+        raise ValueError(f"Unsupported JSON schema type {t!r}")
+
+    def visit_object(self, schema, hint):
+        space = self.primitive("space")
+        layout = object_layout(schema)
+        if layout:
+            kvs = [
+                (f'{gbnf_literal(json_literal(name))} {space} ":" {space} {self.visit(prop, f"{hint}-{name}")} ', required)
+                for name, prop, required in layout
+            ]
+            inner = sequence_props(kvs, f'"," {space} ', lambda e: f"({e.strip()})? ", lambda a, b: f"({a.strip()} | {b.strip()}) ")
+            return self.add_rule(hint, f'"{{" {space} {inner}"}}" {space}')
+
+        extra = schema.get("additionalProperties")
+        if isinstance(extra, dict):
+            kv = f'{self.primitive("string")} ":" {space} {self.visit(extra, f"{hint}-value")}'
+            return self.add_rule(hint, f'"{{" {space} ({kv} ("," {space} {kv})*)? "}}" {space}')
+        if extra is False:
+            return self.add_rule(hint, f'"{{" {space} "}}" {space}')
+        return self.primitive("object")
+
+    def visit_array(self, schema, hint):
+        space = self.primitive("space")
+        prefix = tuple_items(schema)
+        if prefix:
+            items = f' "," {space} '.join(self.visit(s, f"{hint}-{i}") for i, s in enumerate(prefix))
+            return self.add_rule(hint, f'"[" {space} {items} "]" {space}')
+
+        if "items" not in schema and "minItems" not in schema and "maxItems" not in schema:
+            return self.primitive("array")
+        item = self.visit(schema.get("items", {}), f"{hint}-item")
+        lo, hi = schema.get("minItems", 0), schema.get("maxItems")
+        if hi == 0:
+            return self.add_rule(hint, f'"[" {space} "]" {space}')
+        rest = f' ("," {space} {item}){repeat(max(lo - 1, 0), None if hi is None else hi - 1)}' if hi != 1 else ""
+        if lo == 0:
+            return self.add_rule(hint, f'"[" {space} ({item}{rest})? "]" {space}')
+        return self.add_rule(hint, f'"[" {space} {item}{rest} "]" {space}')
+
+    def compile(self, schema) -> str:
+        root = self.visit(schema, schema.get("title", "response") if isinstance(schema, dict) else "response")
+        lines = [f"root ::= {root}"]
+        lines += [f"{name} ::= {body}" for name, body in self.rules.items()]
+
+        needed, stack = set(), list(self.primitives)
+        while stack:
+            name = stack.pop()
+            if name not in needed:
+                needed.add(name)
+                stack.extend(GBNF_PRIMITIVES[name][1])
+        lines += [f"{name} ::= {body}" for name, (body, _) in GBNF_PRIMITIVES.items() if name in needed]
+        return "\n".join(re.sub(r" {2,}", " ", line).rstrip() for line in lines) + "\n"
+
+
+class RegexCompiler:
+    """Compiles a JSON schema into an equivalent regular expression, for engines with regex-guided decoding"""
+
+    def visit(self, schema, depth=RE_ANY_DEPTH) -> str:
+        """Regex matching schema followed by optional whitespace"""
+        if schema is True or not schema or set(schema) <= {"title", "description", "$schema", "default"}:
+            return self.any_value(depth)
+
+        if "const" in schema:
+            return re.escape(json_literal(schema["const"])) + RE_SPACE
+
+        if "enum" in schema:
+            return "(?:" + "|".join(re.escape(json_literal(v)) for v in schema["enum"]) + ")" + RE_SPACE
+
+        branches = schema.get("anyOf") or schema.get("oneOf")
+        if branches:
+            return "(?:" + "|".join(self.visit(b, depth) for b in branches) + ")"
+
+        t = schema.get("type")
+        if isinstance(t, list):
+            return "(?:" + "|".join(self.visit({**schema, "type": x}, depth) for x in t) + ")"
+        if t is None:
+            t = "object" if "properties" in schema else "array" if "items" in schema else None
+        if t is None:
+            return self.any_value(depth)
+
+        if t == "object":
+            return self.visit_object(schema, depth)
+        if t == "array":
+            return self.visit_array(schema, depth)
+        if t == "string" and ("minLength" in schema or "maxLength" in schema):
+            return f'"{RE_CHAR}{repeat(schema.get("minLength", 0), schema.get("maxLength"))}"' + RE_SPACE
+        if t in RE_SCALARS:
+            return RE_SCALARS[t] + RE_SPACE
+        raise ValueError(f"Unsupported JSON schema type {t!r}")
+
+    def any_value(self, depth):
+        alts = [s + RE_SPACE for s in RE_SCALARS.values()]
+        if depth > 0:
+            value = self.any_value(depth - 1)
+            kv = RE_SCALARS["string"] + RE_SPACE + ":" + RE_SPACE + value
+            alts.append(r"\{" + RE_SPACE + f"(?:{kv}(?:," + RE_SPACE + f"{kv})*)?" + r"\}" + RE_SPACE)
+            alts.append(r"\[" + RE_SPACE + f"(?:{value}(?:," + RE_SPACE + f"{value})*)?" + r"\]" + RE_SPACE)
+        return "(?:" + "|".join(alts) + ")"
+
+    def visit_object(self, schema, depth):
+        layout = object_layout(schema)
+        if layout:
+            kvs = [
+                (re.escape(json_literal(name)) + RE_SPACE + ":" + RE_SPACE + self.visit(prop, depth), required)
+                for name, prop, required in layout
+            ]
+            inner = sequence_props(kvs, "," + RE_SPACE, lambda e: f"(?:{e})?", lambda a, b: f"(?:{a}|{b})")
+            return r"\{" + RE_SPACE + inner + r"\}" + RE_SPACE
+
+        extra = schema.get("additionalProperties")
+        if isinstance(extra, dict):
+            kv = RE_SCALARS["string"] + RE_SPACE + ":" + RE_SPACE + self.visit(extra, depth)
+            return r"\{" + RE_SPACE + f"(?:{kv}(?:," + RE_SPACE + f"{kv})*)?" + r"\}" + RE_SPACE
+        if extra is False:
+            return r"\{" + RE_SPACE + r"\}" + RE_SPACE
+        return self.any_value(max(depth, 1))
+
+    def visit_array(self, schema, depth):
+        prefix = tuple_items(schema)
+        if prefix:
+            items = ("," + RE_SPACE).join(self.visit(s, depth) for s in prefix)
+            return r"\[" + RE_SPACE + items + r"\]" + RE_SPACE
+
+        item = self.visit(schema.get("items", {}), depth - 1 if "items" not in schema else depth)
+        lo, hi = schema.get("minItems", 0), schema.get("maxItems")
+        if hi == 0:
+            return r"\[" + RE_SPACE + r"\]" + RE_SPACE
+        rest = f"(?:,{RE_SPACE}{item}){repeat(max(lo - 1, 0), None if hi is None else hi - 1)}" if hi != 1 else ""
+        if lo == 0:
+            return r"\[" + RE_SPACE + f"(?:{item}{rest})?" + r"\]" + RE_SPACE
+        return r"\[" + RE_SPACE + item + rest + r"\]" + RE_SPACE
+
+    def compile(self, schema) -> str:
+        return self.visit(schema)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _cached(kind, schema, compile_fn):
+    key = (kind, schema_hash(schema))
+    with _cache_lock:
+        ret = _cache.get(key)
+    if ret is None:
+        ret = compile_fn()
+        with _cache_lock:
+            _cache[key] = ret
+    return ret
+
+
+def schema_to_gbnf(schema) -> str:
+    """llama.cpp GBNF grammar accepting exactly the JSON documents valid for schema, cached per schema"""
+    return _cached("gbnf", schema, lambda: GBNFCompiler().compile(schema))
+
+
+def schema_to_regex(schema) -> str:
+    """Regular expression equivalent of schema_to_gbnf, schema-less values are limited to RE_ANY_DEPTH nesting"""
+    return _cached("regex", schema, lambda: RegexCompiler().compile(schema))
@@ -0,0 +1,93 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CONNECT_TIMEOUT = float(os.environ.get("MEMGPT_HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.environ.get("MEMGPT_HTTP_READ_TIMEOUT", "30"))
+MAX_RETRIES = int(os.environ.get("MEMGPT_HTTP_RETRIES", "2"))
+BACKOFF_FACTOR = float(os.environ.get("MEMGPT_HTTP_BACKOFF", "0.5"))
+MAX_BYTES = int(os.environ.get("MEMGPT_HTTP_MAX_BYTES", str(4 * 1024 * 1024)))
+POOL_MAXSIZE = int(os.environ.get("MEMGPT_HTTP_POOL_MAXSIZE", "16"))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class HTTPResult:
+    def __init__(self, status_code, headers, content, encoding, url, truncated):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+        self.url = url
+        self.truncated = truncated
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors="replace")
+
+
+def get_session() -> requests.Session:
+    """Process-wide session: keep-alive connection pools per host, bounded retries with backoff"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=MAX_RETRIES,
+                backoff_factor=BACKOFF_FACTOR,
+                status_forcelist=(429, 500, 502, 503, 504),
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=32, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def http_request(method: str, url: str, max_bytes=MAX_BYTES, timeout=None, **kwargs) -> HTTPResult:
+    """
+    Send a request through the shared session and read at most max_bytes of the body.
+    Bodies are streamed and the connection is dropped once the cap is hit, `truncated` is set then.
+    """
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+    with get_session().request(method, url, stream=True, timeout=timeout, **kwargs) as response:
+        chunks = []
+        size = 0
+        truncated = False
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            if max_bytes is not None and size + len(chunk) > max_bytes:
+                chunks.append(chunk[: max_bytes - size])
+                truncated = True
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+
+        if "charset" in response.headers.get("Content-Type", "").lower():
+            encoding = response.encoding
+        else:
+            encoding = "utf-8"
+
+        return HTTPResult(
+            response.status_code,
+            dict(response.headers),
+            b"".join(chunks),
+            encoding or "utf-8",
+            response.url,
+            truncated,
+        )
+
+
+def http_get(url: str, **kwargs) -> HTTPResult:
+    return http_request("GET", url, **kwargs)
+
+
+def http_post(url: str, **kwargs) -> HTTPResult:
+    return http_request("POST", url, **kwargs)
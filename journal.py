@@ -0,0 +1,189 @@
+import concurrent.futures
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import cbor2
+
+from msglog import apply_op
+from sqlite_cache import CACHE_DIR
+from util import printd
+
+JOURNAL_DIR = os.path.join(CACHE_DIR, "sessions")
+
+# record framing: payload length, crc32 of the payload, then the CBOR payload
+HEADER = struct.Struct(">II")
+MAX_RECORD_BYTES = 256 * 1024 * 1024
+
+
+def encode_record(record) -> bytes:
+    payload = cbor2.dumps(record)
+    return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def iter_records(f, offset=0):
+    """
+    Yield (record, end offset) from an open journal file. Stops at the end of the file or at the
+    first torn or corrupt record, which is what a crash in the middle of a write leaves behind.
+    """
+    f.seek(offset)
+    while True:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return
+        size, crc = HEADER.unpack(header)
+        if size > MAX_RECORD_BYTES:
+            return
+        payload = f.read(size)
+        if len(payload) < size or zlib.crc32(payload) != crc:
+            return
+        offset += HEADER.size + size
+        yield cbor2.loads(payload), offset
+
+
+def new_state():
+    return dict(session_id=None, workdir=None, open_turn=None, turns=0)
+
+
+def replay(path, msgs, state, offset=0) -> int:
+    """
+    Apply the records after `offset` to msgs (a list) and state (see new_state), returns the offset
+    after the last valid record. Called again with that offset it only reads what was appended since.
+    """
+    with open(path, "rb") as f:
+        for record, end in iter_records(f, offset):
+            kind = record["t"]
+            if kind == "msg":
+                apply_op(msgs, record["op"])
+            elif kind == "session":
+                state["session_id"] = record["id"]
+            elif kind == "turn":
+                state["open_turn"] = record["query"]
+            elif kind == "turn_end":
+                state["open_turn"] = None
+                state["turns"] += 1
+                if "workdir" in record:
+                    state["workdir"] = record["workdir"]
+            offset = end
+    return offset
+
+
+class SessionJournal:
+    """
+    Append-only, crash-safe journal of an agent session: every MessageLog change and turn boundary
+    is one length-prefixed, checksummed CBOR record, written with a single unbuffered write. A torn
+    record at the end of the file is cut off when the journal is reopened. Records are fsynced at
+    the end of every turn, or after each write with fsync=True.
+
+    With background=True records are handed to a writer thread in order, so an event loop never
+    blocks on the disk; end_turn then returns a Future resolved once the turn is synced.
+    """
+
+    def __init__(self, path, valid_end=None, fsync=False, background=False):
+        self.path = path
+        self.fsync_each = fsync
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, "ab", buffering=0)
+        if valid_end is not None and self.file.tell() > valid_end:
+            printd(f"[journal] dropping {self.file.tell() - valid_end} bytes of a torn record in {path}")
+            self.file.truncate(valid_end)
+            self.file.seek(valid_end)  # truncate() leaves the position at the old end
+        self.offset = self.file.tell()
+        self.error = None
+        self.queue = None
+        if background:
+            self.queue = queue.SimpleQueue()
+            self.writer = threading.Thread(target=self._writer, name="picoagent-journal", daemon=True)
+            self.writer.start()
+
+    def _write(self, data, sync=False):
+        self.file.write(data)
+        self.offset += len(data)
+        if sync or self.fsync_each:
+            os.fsync(self.file.fileno())
+
+    def _writer(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            data, sync, future = item
+            try:
+                if self.error is None:
+                    self._write(data, sync)
+            except Exception as e:
+                printd(f"[journal] write to {self.path} failed: {e}")
+                self.error = e
+            if future is not None:
+                if self.error is not None:
+                    future.set_exception(self.error)
+                else:
+                    future.set_result(self.offset)
+
+    def write(self, record, sync=False):
+        """Append a record, returns a Future of its completion in background mode, else None"""
+        data = encode_record(record)  # on the caller's thread, so later changes to the messages can't leak in
+        if self.queue is None:
+            self._write(data, sync)
+            return None
+        future = concurrent.futures.Future() if sync else None
+        self.queue.put((data, sync, future))
+        return future
+
+    def on_msglog_op(self, op):
+        self.write({"t": "msg", "op": list(op)})
+
+    def begin_session(self, session_id, msgs):
+        self.write({"t": "session", "id": session_id, "created": time.time()})
+        self.on_msglog_op(("set", 0, 0, list(msgs)))
+
+    def begin_turn(self, query):
+        self.write({"t": "turn", "query": query})
+
+    def end_turn(self, workdir=None):
+        return self.write({"t": "turn_end", "workdir": workdir}, sync=True)
+
+    def close(self):
+        if self.queue is not None:
+            self.queue.put(None)
+            self.writer.join()
+        self.file.close()
+
+
+def session_path(name) -> str:
+    """Journal file of a named session, names containing a path separator are used as paths"""
+    if os.sep in name or name.endswith(".journal"):
+        return name
+    return os.path.join(JOURNAL_DIR, f"{name}.journal")
+
+
+def open_session(agent, path, fsync=False) -> dict:
+    """
+    Journal the agent's session to `path`, resuming it first if the journal exists: the messages,
+    session id and working directory are restored from the records without re-running any tool.
+    Agents with journal_in_background set (AsyncLLMAgent) get a journal with a writer thread.
+    Returns the replayed state, whose open_turn is the query of a turn the previous process didn't finish.
+    """
+    state = new_state()
+    valid_end = None
+    if os.path.exists(path):
+        msgs = []
+        valid_end = replay(path, msgs, state)
+        if msgs:
+            agent.msgs[:] = msgs
+        if state["session_id"]:
+            agent.session_id = state["session_id"]
+        if state["workdir"]:
+            agent.workdir = state["workdir"]
+
+    journal = SessionJournal(
+        path, valid_end=valid_end, fsync=fsync, background=getattr(agent, "journal_in_background", False)
+    )
+    if journal.offset == 0:
+        journal.begin_session(agent.session_id, agent.msgs)
+    agent.msgs.listeners.append(journal.on_msglog_op)
+    agent.journal = journal
+    return state
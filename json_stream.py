@@ -0,0 +1,369 @@
+import json
+
+WHITESPACE = " \t\n\r"
+LITERAL_CHARS = set("0123456789+-.eEtruefalsn")
+ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class JSONStreamError(Exception):
+    pass
+
+
+class StreamRejected(Exception):
+    """Raised when a streamed LLM output prefix can no longer match the tool call schema"""
+
+    pass
+
+
+def value_kind(c):
+    if c == "{":
+        return "object"
+    if c == "[":
+        return "array"
+    if c == '"':
+        return "string"
+    if c in "tf":
+        return "boolean"
+    if c == "n":
+        return "null"
+    return "number"
+
+
+class IncrementalJSONParser:
+    """
+    Push-style JSON parser which is fed text chunks as they arrive from the LLM.
+
+    Text before the first "{" or "[" (code fences, prose) is skipped and parsing stops once the
+    top-level value is closed. Callbacks receive the path of a value as a tuple of object keys
+    and array indices:
+        on_start(path, kind) - a value of JSON type `kind` starts at `path`
+        on_string_delta(path, delta) - new decoded characters of a string value
+        on_value(path, value) - a value is complete
+    """
+
+    def __init__(self, on_start=None, on_string_delta=None, on_value=None):
+        self.on_start = on_start
+        self.on_string_delta = on_string_delta
+        self.on_value = on_value
+
+        self.stack = []  # frames: [container, current key]
+        self.state = "start"
+        self.done = False
+        self.value = None
+
+        self.string_is_key = False
+        self.string_chars = []
+        self.delta_from = 0
+        self.escape = None
+        self.literal = []
+
+    def path(self):
+        ret = []
+        for container, key in self.stack:
+            ret.append(key if isinstance(container, dict) else len(container))
+        return tuple(ret)
+
+    def feed(self, chunk: str):
+        for c in chunk:
+            if self.done:
+                break
+            self._feed_char(c)
+
+        if self.state == "string" and not self.string_is_key:
+            self._flush_delta()
+
+    def _flush_delta(self, final=False):
+        end = len(self.string_chars)
+        if not final and end and "\ud800" <= self.string_chars[-1] <= "\udbff":
+            end -= 1  # wait for the low half of a surrogate pair
+        if self.on_string_delta and self.delta_from < end:
+            self.on_string_delta(self.path(), "".join(self.string_chars[self.delta_from : end]))
+        self.delta_from = end
+
+    def _start_value(self, c):
+        kind = value_kind(c)
+        if self.on_start:
+            self.on_start(self.path(), kind)
+
+        if kind == "object":
+            self.stack.append([{}, None])
+            self.state = "key_or_end"
+        elif kind == "array":
+            self.stack.append([[], None])
+            self.state = "value_or_end"
+        elif kind == "string":
+            self.string_is_key = False
+            self.string_chars = []
+            self.delta_from = 0
+            self.state = "string"
+        elif c in LITERAL_CHARS:
+            self.literal = [c]
+            self.state = "literal"
+        else:
+            raise JSONStreamError(f"Unexpected character {c!r} at value start")
+
+    def _emit(self, value):
+        path = self.path()
+        if not self.stack:
+            self.value = value
+            self.done = True
+            self.state = "done"
+        else:
+            container, key = self.stack[-1]
+            if isinstance(container, dict):
+                container[key] = value
+            else:
+                container.append(value)
+            self.state = "comma_or_end"
+
+        if self.on_value:
+            self.on_value(path, value)
+
+    def _close(self, c):
+        container, _ = self.stack[-1]
+        if (c == "}") != isinstance(container, dict):
+            raise JSONStreamError(f"Mismatched closing bracket {c!r}")
+        self.stack.pop()
+        self._emit(container)
+
+    def _finish_literal(self):
+        literal = "".join(self.literal)
+        try:
+            value = json.loads(literal)
+        except ValueError:
+            raise JSONStreamError(f"Invalid literal {literal!r}")
+        self._emit(value)
+
+    def _feed_char(self, c):
+        state = self.state
+
+        if state == "string":
+            if self.escape is not None:
+                self.escape += c
+                if self.escape[0] != "u":
+                    if c not in ESCAPES:
+                        raise JSONStreamError(f"Invalid escape \\{c}")
+                    self.string_chars.append(ESCAPES[c])
+                    self.escape = None
+                elif len(self.escape) == 5:
+                    code = int(self.escape[1:], 16)
+                    prev = self.string_chars[-1] if self.string_chars else ""
+                    if 0xDC00 <= code <= 0xDFFF and "\ud800" <= prev <= "\udbff":
+                        # join a surrogate pair into a single character
+                        code = 0x10000 + ((ord(prev) - 0xD800) << 10) + (code - 0xDC00)
+                        self.string_chars.pop()
+                    self.string_chars.append(chr(code))
+                    self.escape = None
+            elif c == "\\":
+                self.escape = ""
+            elif c == '"':
+                s = "".join(self.string_chars)
+                if self.string_is_key:
+                    self.stack[-1][1] = s
+                    self.state = "colon"
+                else:
+                    self._flush_delta(final=True)
+                    self._emit(s)
+            else:
+                self.string_chars.append(c)
+            return
+
+        if state == "literal":
+            if c in LITERAL_CHARS:
+                self.literal.append(c)
+                return
+            self._finish_literal()
+            state = self.state
+
+        if c in WHITESPACE:
+            return
+
+        if state == "start":
+            if c in "{[":
+                self._start_value(c)
+        elif state == "value":
+            self._start_value(c)
+        elif state == "value_or_end":
+            if c == "]":
+                self._close(c)
+            else:
+                self._start_value(c)
+        elif state in ("key_or_end", "key"):
+            if c == "}" and state == "key_or_end":
+                self._close(c)
+            elif c == '"':
+                self.string_is_key = True
+                self.string_chars = []
+                self.state = "string"
+            else:
+                raise JSONStreamError(f"Expected object key, got {c!r}")
+        elif state == "colon":
+            if c != ":":
+                raise JSONStreamError(f"Expected ':', got {c!r}")
+            self.state = "value"
+        elif state == "comma_or_end":
+            if c == ",":
+                self.state = "key" if isinstance(self.stack[-1][0], dict) else "value"
+            elif c in "}]":
+                self._close(c)
+            else:
+                raise JSONStreamError(f"Expected ',' or closing bracket, got {c!r}")
+
+
+def schema_kind_matches(schema_type, kind):
+    if schema_type is None:
+        return True
+    if isinstance(schema_type, list):
+        return any(schema_kind_matches(t, kind) for t in schema_type)
+    if schema_type == "integer":
+        return kind == "number"
+    return schema_type == kind
+
+
+class CallState:
+    def __init__(self):
+        self.tool_name = None
+        self.tool_name_prefix = ""
+        self.params = None
+        self.pending_message = []
+        self.pending_kinds = []
+        self.ready = False
+
+
+class ToolCallStreamMonitor:
+    """
+    Watches a streamed tool call against the schema from construct_json_schema.
+
+    Raises StreamRejected as soon as the prefix cannot validate anymore (unknown tool name prefix,
+    wrong parameter types), forwards the send_message text as it is generated and reports a call
+    as ready once both the tool name and its complete params are known. With a multi-call schema
+    every item of a top-level array is tracked as a separate call. Malformed JSON only disables
+    monitoring, since the tolerant parse_llm_json fallbacks may still recover it.
+    """
+
+    def __init__(
+        self,
+        json_schema,
+        tool_name_field="call_tool",
+        args_name="params",
+        message_tool="send_message",
+        message_field="message",
+        on_message_delta=None,
+        on_call_ready=None,
+    ):
+        self.tool_name_field = tool_name_field
+        self.args_name = args_name
+        self.message_tool = message_tool
+        self.message_field = message_field
+        self.on_message_delta = on_message_delta
+        self.on_call_ready = on_call_ready
+
+        self.params_schemas = {}
+        self.multi_call = False
+        for branch in json_schema.get("anyOf", []):
+            if branch.get("type") == "array":
+                self.multi_call = True
+                continue
+            props = branch.get("properties", {})
+            name = props.get(tool_name_field, {}).get("const")
+            if name is not None:
+                self.params_schemas[name] = props.get(args_name, {})
+
+        self.calls = {}  # call index in a multi-call array (None for a single call) -> CallState
+        self.broken = False
+
+        self.parser = IncrementalJSONParser(
+            on_start=self._on_start,
+            on_string_delta=self._on_string_delta,
+            on_value=self._on_value,
+        )
+
+    @property
+    def done(self):
+        return self.parser.done
+
+    def feed(self, chunk: str):
+        if self.broken or self.parser.done:
+            return
+        try:
+            self.parser.feed(chunk)
+        except JSONStreamError:
+            self.broken = True
+
+    def _split(self, path):
+        """Split a value path into the call it belongs to and the path inside that call"""
+        if path and isinstance(path[0], int):
+            index, path = path[0], path[1:]
+        else:
+            index = None
+        if index not in self.calls:
+            self.calls[index] = CallState()
+        return self.calls[index], path
+
+    def _check_param_kind(self, call, key, kind):
+        prop = self.params_schemas[call.tool_name].get("properties", {}).get(key)
+        if prop is not None and not schema_kind_matches(prop.get("type"), kind):
+            raise StreamRejected(
+                f"parameter '{key}' of {call.tool_name} must be {prop.get('type')}, got {kind}"
+            )
+
+    def _on_start(self, path, kind):
+        if path == ():
+            if kind == "array" and self.multi_call:
+                return
+            if kind != "object":
+                raise StreamRejected(f"tool call must be a JSON object, got {kind}")
+        if len(path) == 1 and isinstance(path[0], int) and kind != "object":
+            raise StreamRejected(f"tool call must be a JSON object, got {kind}")
+
+        call, path = self._split(path)
+        if path == (self.tool_name_field,) and kind != "string":
+            raise StreamRejected(f"'{self.tool_name_field}' must be a string, got {kind}")
+        if path == (self.args_name,) and kind != "object":
+            raise StreamRejected(f"'{self.args_name}' must be an object, got {kind}")
+        if len(path) == 2 and path[0] == self.args_name:
+            if call.tool_name is None:
+                call.pending_kinds.append((path[1], kind))
+            else:
+                self._check_param_kind(call, path[1], kind)
+
+    def _on_string_delta(self, path, delta):
+        call, path = self._split(path)
+        if path == (self.tool_name_field,):
+            call.tool_name_prefix += delta
+            if not any(name.startswith(call.tool_name_prefix) for name in self.params_schemas):
+                raise StreamRejected(f"unknown tool '{call.tool_name_prefix}...'")
+        elif path == (self.args_name, self.message_field):
+            if call.tool_name is None:
+                call.pending_message.append(delta)
+            elif call.tool_name == self.message_tool and self.on_message_delta:
+                self.on_message_delta(delta)
+
+    def _on_value(self, path, value):
+        if path == () or (len(path) == 1 and isinstance(path[0], int)):
+            return
+
+        call, path = self._split(path)
+        if path == (self.tool_name_field,):
+            if value not in self.params_schemas:
+                raise StreamRejected(f"unknown tool '{value}'")
+            call.tool_name = value
+            for key, kind in call.pending_kinds:
+                self._check_param_kind(call, key, kind)
+            if call.tool_name == self.message_tool and self.on_message_delta and call.pending_message:
+                self.on_message_delta("".join(call.pending_message))
+            call.pending_kinds = []
+            call.pending_message = []
+        elif path == (self.args_name,):
+            call.params = value
+        elif len(path) == 2 and path[0] == self.args_name and call.tool_name is not None:
+            prop = self.params_schemas[call.tool_name].get("properties", {}).get(path[1], {})
+            if prop.get("type") == "integer" and not isinstance(value, int):
+                raise StreamRejected(f"parameter '{path[1]}' of {call.tool_name} must be integer")
+        else:
+            return
+
+        if call.tool_name is not None and call.params is not None and not call.ready:
+            call.ready = True
+            if self.on_call_ready:
+                self.on_call_ready(call.tool_name, call.params)
@@ -0,0 +1,328 @@
+import hashlib
+import random
+import threading
+import time
+
+from util import printd
+
+POLICIES = ("least_outstanding", "latency")
+
+
+class NoBackendAvailable(Exception):
+    pass
+
+
+class Backend:
+    """One OpenAI-compatible endpoint (a llama.cpp or vLLM replica) and its routing state"""
+
+    def __init__(self, api_base, name=None, api_key=None, model=None, weight=1.0, max_outstanding=None):
+        self.api_base = api_base
+        self.name = name or api_base
+        self.api_key = api_key
+        self.model = model
+        self.weight = float(weight)
+        self.max_outstanding = max_outstanding
+
+        self.outstanding = 0
+        self.latency = None  # EWMA seconds, time to first chunk for streams
+        self.failures = 0  # consecutive
+        self.open_until = 0.0  # circuit breaker: no traffic before this time
+        self.cooldown = 0.0
+        self.probing = False  # half-open: a single trial request is in flight
+        self.healthy = True
+
+    def state(self, now) -> str:
+        if self.failures == 0 or self.cooldown == 0:
+            return "closed"
+        return "open" if now < self.open_until else "half-open"
+
+    def __repr__(self):
+        return f"Backend({self.name!r}, outstanding={self.outstanding}, latency={self.latency}, failures={self.failures})"
+
+
+class BackendStream:
+    """
+    Chunks of a streamed completion holding a slot of its backend until exhausted, closed or
+    garbage collected, also when it is dropped before the first chunk was read.
+    """
+
+    def __init__(self, router, backend, first, it):
+        self.router = router
+        self.backend = backend
+        self.first = first
+        self.it = it
+        self.released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.first is not None:
+            chunk, self.first = self.first, None
+            return chunk
+        if self.released:
+            raise StopIteration
+        try:
+            return next(self.it)
+        except BaseException:  # StopIteration included
+            self.close()
+            raise
+
+    def close(self):
+        if self.released:
+            return
+        self.released = True
+        close = getattr(self.it, "close", None)
+        if close:
+            close()
+        self.router.release(self.backend)
+
+    def __del__(self):
+        self.close()
+
+
+class LLMRouter:
+    """
+    Spreads LLM calls over several backends with failover.
+
+    Backends are picked by least outstanding requests (per unit of weight) or, with policy="latency",
+    by expected wait: EWMA latency times (outstanding + 1). Calls tagged with a session go to the
+    same replica through rendezvous hashing, so its KV prefix cache is reused; they only move when
+    that replica is down or saturated (max_outstanding), and come back once it recovers.
+
+    After failure_threshold consecutive errors a backend's circuit opens for `cooldown` seconds,
+    doubling up to max_cooldown, then a single trial request decides whether it closes again. A
+    background thread polls `{api_base}/models` every health_check_interval seconds; unhealthy
+    backends are skipped unless nothing else is left. A failed call is retried on the next backend
+    until each one was tried once; streams fail over only before their first chunk.
+    """
+
+    def __init__(
+        self,
+        backends,
+        chat_fn=None,
+        async_chat_fn=None,
+        policy="least_outstanding",
+        failure_threshold=3,
+        cooldown=10.0,
+        max_cooldown=300.0,
+        health_check_interval=15.0,
+        health_check_timeout=2.0,
+        latency_alpha=0.3,
+    ):
+        if not backends:
+            raise ValueError("LLMRouter needs at least one backend")
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown routing policy {policy!r}, expected one of {POLICIES}")
+        self.backends = list(backends)
+        self.chat_fn = chat_fn
+        self.async_chat_fn = async_chat_fn
+        self.policy = policy
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self.latency_alpha = latency_alpha
+
+        self.lock = threading.RLock()  # reentrant, BackendStream.__del__ may release during a locked section
+        self.health_thread = None
+        self.stopped = threading.Event()
+
+    @classmethod
+    def from_config(cls, config, chat_fn=None, async_chat_fn=None, defaults={}):
+        """
+        Router from the `backends` list and optional `router` section of picoagent.yaml.
+        `defaults` (api_key, model) fill in fields a backend entry leaves out.
+        """
+        backends = []
+        for entry in config["backends"]:
+            if isinstance(entry, str):
+                entry = dict(api_base=entry)
+            entry = {**{k: v for k, v in defaults.items() if v is not None}, **entry}
+            backends.append(Backend(**entry))
+        return cls(backends, chat_fn=chat_fn, async_chat_fn=async_chat_fn, **config.get("router", {}))
+
+    # selection
+
+    def available(self, backend, now) -> bool:
+        state = backend.state(now)
+        if state == "open" or (state == "half-open" and backend.probing):
+            return False
+        return backend.max_outstanding is None or backend.outstanding < backend.max_outstanding
+
+    def score(self, backend):
+        if self.policy == "latency":
+            known = [b.latency for b in self.backends if b.latency is not None]
+            latency = backend.latency if backend.latency is not None else (min(known) if known else 0.0)
+            return latency * (backend.outstanding + 1) / backend.weight, random.random()
+        return backend.outstanding / backend.weight, random.random()
+
+    @staticmethod
+    def affinity(session, backend) -> int:
+        digest = hashlib.blake2b(f"{session}\0{backend.name}".encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    def pick(self, session=None, exclude=()) -> Backend:
+        """Choose a backend and count the request as outstanding on it"""
+        now = time.monotonic()
+        with self.lock:
+            candidates = [b for b in self.backends if b not in exclude and self.available(b, now)]
+            healthy = [b for b in candidates if b.healthy]
+            candidates = healthy or candidates
+            if not candidates:
+                raise NoBackendAvailable("all LLM backends are down, saturated or already tried")
+
+            if session is not None:
+                # the session's preferred replica among those usable right now
+                backend = max(candidates, key=lambda b: self.affinity(session, b))
+            else:
+                backend = min(candidates, key=self.score)
+
+            if backend.state(now) == "half-open":
+                backend.probing = True
+            backend.outstanding += 1
+            return backend
+
+    # bookkeeping
+
+    def record_success(self, backend, latency):
+        with self.lock:
+            backend.outstanding -= 1
+            backend.probing = False
+            backend.failures = 0
+            backend.cooldown = 0.0
+            if latency is not None:
+                a = self.latency_alpha
+                backend.latency = latency if backend.latency is None else a * latency + (1 - a) * backend.latency
+
+    def record_failure(self, backend, error, counted=True):
+        with self.lock:
+            if counted:
+                backend.outstanding -= 1
+            was_probing, backend.probing = backend.probing, False
+            backend.failures += 1
+            if was_probing or backend.failures >= self.failure_threshold:
+                backend.cooldown = min(self.max_cooldown, backend.cooldown * 2 or self.base_cooldown)
+                backend.open_until = time.monotonic() + backend.cooldown
+                print(f"[router] {backend.name} failing ({error}), circuit open for {backend.cooldown:.1f}s")
+
+    def release(self, backend):
+        """Stream closed after it was already counted as a success"""
+        with self.lock:
+            backend.outstanding -= 1
+
+    def call_kwargs(self, backend, kwargs):
+        kw = dict(kwargs, api_base=backend.api_base)
+        if backend.api_key is not None:
+            kw["api_key"] = backend.api_key
+        if backend.model is not None:
+            kw["model"] = backend.model
+        return kw
+
+    # calls
+
+    def chat(self, msgs, session=None, **kwargs):
+        """chat_fn(msgs, **kwargs) on a routed backend, retrying on the others when it fails"""
+        tried = []
+        last_error = None
+        while len(tried) < len(self.backends):
+            try:
+                backend = self.pick(session, exclude=tried)
+            except NoBackendAvailable:
+                break
+            tried.append(backend)
+
+            start = time.monotonic()
+            try:
+                ret = self.chat_fn(msgs, **self.call_kwargs(backend, kwargs))
+                if kwargs.get("stream") and not isinstance(ret, str):
+                    return self._stream(backend, iter(ret), start)
+            except Exception as e:
+                last_error = e
+                self.record_failure(backend, e)
+                continue
+            self.record_success(backend, time.monotonic() - start)
+            return ret
+
+        raise NoBackendAvailable(f"no LLM backend could serve the request, last error: {last_error}") from last_error
+
+    def _stream(self, backend, it, start):
+        # the first chunk is fetched here, so connection errors still fail over to another backend
+        try:
+            first = next(it, None)
+        except Exception:
+            close = getattr(it, "close", None)
+            if close:
+                close()
+            raise
+        self.record_success(backend, time.monotonic() - start)
+        with self.lock:
+            backend.outstanding += 1  # still streaming, released when the stream is exhausted or closed
+        return BackendStream(self, backend, first, it)
+
+    async def achat(self, msgs, session=None, **kwargs):
+        """Async counterpart of chat() over async_chat_fn"""
+        tried = []
+        last_error = None
+        while len(tried) < len(self.backends):
+            try:
+                backend = self.pick(session, exclude=tried)
+            except NoBackendAvailable:
+                break
+            tried.append(backend)
+
+            start = time.monotonic()
+            try:
+                ret = await self.async_chat_fn(msgs, **self.call_kwargs(backend, kwargs))
+            except Exception as e:
+                last_error = e
+                self.record_failure(backend, e)
+                continue
+            self.record_success(backend, time.monotonic() - start)
+            return ret
+
+        raise NoBackendAvailable(f"no LLM backend could serve the request, last error: {last_error}") from last_error
+
+    # health checks
+
+    def check_health(self, backend) -> bool:
+        from http_pool import http_get
+
+        headers = {"Authorization": f"Bearer {backend.api_key}"} if backend.api_key else {}
+        try:
+            response = http_get(
+                f"{backend.api_base.rstrip('/')}/models",
+                headers=headers,
+                timeout=(self.health_check_timeout, self.health_check_timeout),
+                max_bytes=64 * 1024,
+            )
+            ok = response.status_code < 500
+        except Exception as e:
+            printd(f"[router] health check of {backend.name} failed: {e}")
+            ok = False
+
+        with self.lock:
+            if ok and not backend.healthy:
+                print(f"[router] {backend.name} is healthy again")
+            elif not ok and backend.healthy:
+                print(f"[router] {backend.name} failed its health check")
+            backend.healthy = ok
+            if ok and backend.state(time.monotonic()) == "open":
+                backend.open_until = time.monotonic()  # let a trial request through
+        return ok
+
+    def start_health_checks(self):
+        if self.health_thread is not None or not self.health_check_interval:
+            return
+
+        def loop():
+            while not self.stopped.wait(self.health_check_interval):
+                for backend in self.backends:
+                    self.check_health(backend)
+
+        self.health_thread = threading.Thread(target=loop, name="picoagent-llm-health", daemon=True)
+        self.health_thread.start()
+
+    def stop(self):
+        self.stopped.set()
@@ -1,27 +1,36 @@
+import time
+
+STARTUP_T0 = time.perf_counter()  # before the other imports, for --profile-startup
+
 import os
-import yaml
+import sys
 from pathlib import Path
 import argparse
 import json
-import inspect
-import demjson3 as demjson
-import jsonschema
-import re
+import fastjsonschema
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 from llm_fns.llm import llm_chat
 from tools import available_tools, json_to_highlighted_str
-from util import enable_debug, printd
-
-# sys.path.append("gbnf-compiler")
-
-# import gnbf_compiler as gbnfc
-
-# tools = gbnfc.MultipleChoice('tool', ['calculator', 'web-search', 'web-browse'])
-# c = gbnfc.GBNFCompiler(template, { 'tool': tools, 'reason': SingleSentence() })
-# print(c.grammar())
+import fastjson
+from fastjson import TolerantParseError, tolerant_loads
+from json_stream import ToolCallStreamMonitor, StreamRejected
+from validation import get_validator
+from msglog import MessageLog
+from speculative import SpeculativeExecutor
+from context import ContextWindow
+from completion_cache import completion_key, get_completion_cache, is_deterministic
+from llm_router import LLMRouter
+from grammar import schema_to_gbnf, schema_to_regex
+import tracing
+from tracing import get_tracer
+from util import PhaseTimer, enable_debug, printd
 
 def load_config():
     """Load config from yaml files in standard locations"""
+    import yaml
+
     config_paths = [
         'picoagent.yaml',
         os.path.expanduser('~/.picoagent.yaml'),
@@ -39,12 +48,13 @@ def load_config():
             
     return {}
 
-def parse_llm_json(llm_response: str):
+def parse_llm_json(llm_response: str, accept=None):
     """
     Parse JSON from LLM response, handling code blocks and various formats.
     
     Args:
         llm_response (str): Raw LLM response text
+        accept (callable): Optional check of a candidate value found in prose, rejected ones are skipped
         
     Returns:
         dict: Parsed JSON object or fallback dictionary with error info
@@ -53,30 +63,20 @@ def parse_llm_json(llm_response: str):
         >>> parse_llm_json('```json\n{"key": "value"}\n```')
         {'key': 'value'}
     """
-    # Strip whitespace
     text = llm_response.strip()
-    
-    # Extract from code block if present
-    code_block_match = re.search(r'```(?:json)?\n(.*?)\n```', text, re.DOTALL)
-    if code_block_match:
-        text = code_block_match.group(1).strip()
-    
-    # Try multiple parsing approaches
-    parsers = [
-        # Standard JSON parser
-        lambda t: json.loads(t),
-        # More permissive JSON parser
-        lambda t: demjson.decode(t),
-        # Find first JSON-like structure
-        lambda t: json.loads(re.search(r'\{.*\}', t, re.DOTALL).group(0))
-    ]
-    
-    for parser in parsers:
-        try:
-            return parser(text)
-        except Exception:
-            continue
-            
+
+    # well-formed output, the common case with json_schema or grammar constrained decoding
+    try:
+        return fastjson.loads(text)
+    except ValueError:
+        pass
+
+    # code fences, prose around the object, trailing commas, single quotes...
+    try:
+        return tolerant_loads(text, accept=accept)
+    except TolerantParseError:
+        pass
+
     # Fallback with error handling
     return {
         "error": "Failed to parse JSON",
@@ -85,6 +85,16 @@ def parse_llm_json(llm_response: str):
         "contains_malicious_elements": "contains_malicious_elements: t" in text.lower()
     }
 
+def iter_llm_chunks(ret):
+    """Normalize llm_chat output to an iterator of text chunks, a plain string is a single chunk"""
+    if isinstance(ret, str):
+        yield ret
+        return
+    for chunk in ret:
+        if chunk:
+            yield chunk
+
+
 def toolset(*args, exclude=[]):
     ret = []
     sret = set()
@@ -119,6 +129,8 @@ def construct_json_schema(
     args_name="params",
     thoughts_required=False,
     thoughts_field="thoughts",
+    multi_call=False,
+    max_calls=8,
 ):
     any_of_schemas = []
     required = [tool_name_field, args_name]
@@ -136,6 +148,21 @@ def construct_json_schema(
                 "required": required,
             }
         )
+    if multi_call:
+        # a response is either a single call or an array of independent calls executed together
+        return {
+            "$schema": "http://json-schema.org/draft-07/schema#",
+            "title": title,
+            "anyOf": any_of_schemas
+            + [
+                {
+                    "type": "array",
+                    "items": {"type": "object", "anyOf": any_of_schemas},
+                    "minItems": 1,
+                    "maxItems": max_calls,
+                }
+            ],
+        }
     return {
         "$schema": "http://json-schema.org/draft-07/schema#",
         "title": title,
@@ -144,14 +171,26 @@ def construct_json_schema(
     }
 
 
+_tool_defs_cache = {}
+
+
 def format_tool_defs(tools=[], sep="\n", indent_basic=True, indent_json=True) -> str:
+    # Rendered once per toolset, tool schemas are never mutated after load so their identity is a stable key
+    key = (tuple(id(tool["json_schema"]) for tool in tools), sep, indent_basic, indent_json)
+    cached = _tool_defs_cache.get(key)
+    if cached is not None:
+        return cached[1]
+
     ret = []
     isep = "\n" if indent_basic else ""
     for tool in tools:
         ret.append(
             f"<tool type=\"json-schema\">{isep}{json.dumps(tool['json_schema'], indent=indent_json)}{isep}</tool>"
         )
-    return sep.join(ret)
+    ret = sep.join(ret)
+    # keep the schemas referenced so their ids can't be reused by other objects
+    _tool_defs_cache[key] = ([tool["json_schema"] for tool in tools], ret)
+    return ret
 
 
 def prompt_react(assistant_name="Assistant", tools=[]):
@@ -310,17 +349,33 @@ agents = dict(
     ]
 )
 
-toolsets = dict(
-    basic=toolset("send_message"),
-    webgpt=toolset("send_message", "duckduckgo_search"),
-    shell=toolset("send_message", "exec_shell_cmd"),
-    all=toolset("send_message", "exec_shell_cmd", "*"),
-    allV1d1=toolset(
+class LazyToolsets(dict):
+    """Named toolsets, each one built on first lookup"""
+
+    def __init__(self, **factories):
+        super().__init__()
+        self.factories = factories
+
+    def __missing__(self, name):
+        ret = self[name] = self.factories[name]()
+        return ret
+
+
+toolsets = LazyToolsets(
+    basic=lambda: toolset("send_message"),
+    webgpt=lambda: toolset("send_message", "duckduckgo_search"),
+    shell=lambda: toolset("send_message", "exec_shell_cmd"),
+    all=lambda: toolset("send_message", "exec_shell_cmd", "*"),
+    allV1d1=lambda: toolset(
         "send_message", "exec_shell_cmd", "*", exclude=["read_from_text_file"]
     ),
 )
 
 
+# Function calling modes where the backend decodes under a grammar compiled from the call schema
+CONSTRAINED_FC_MODES = ("grammar", "regex")
+
+
 class ToolCallEngine:
     pass
 
@@ -341,7 +396,7 @@ def format_tool_output_pseudoxmljson(
 
     iserror = "" if not error else ' error="true"'
 
-    serialized = j if avoid_json_for_str_ret and isinstance(j, str) else json.dumps(j)
+    serialized = j if avoid_json_for_str_ret and isinstance(j, str) else fastjson.dumps(j)
 
     return f"<system{hints}>{tagsep}<tool-output{iserror}>{tagsep}{serialized}{tagsep}</tool-output>{tagsep}</system>"
 
@@ -351,12 +406,12 @@ def format_user_input_pseudoxml(s):
 
 def validate_json(json_obj, schema):
     try:
-        jsonschema.validate(instance=json_obj, schema=schema)
+        get_validator(schema)(json_obj)
         return True
-    except jsonschema.ValidationError as e:
+    except fastjsonschema.JsonSchemaValueException as e:
         print(f"Validation error: {e}")
         return False
-    except jsonschema.SchemaError as e:
+    except fastjsonschema.JsonSchemaDefinitionException as e:
         print(f"Schema error: {e}")
         return False
     except Exception as e:
@@ -379,10 +434,36 @@ class LLMAgent:
         function_calling_mode=None,
         max_n_retries=5,  # useful for backends that do not support proper json schema
         llm_api_kwargs={},
-        tool_arg_field_name="params"
+        tool_arg_field_name="params",
+        stream_fc=False,
+        stream_printer=lambda s: print(s, end="", flush=True),
+        context_budget=None,
+        parallel_tool_calls=False,
+        max_parallel_tools=8,
+        speculative_tools=True,  # with stream_fc, start read-only tools before the response is complete
+        router=None,  # llm_router.LLMRouter spreading calls over several backends
+        cache_completions=False,  # reuse stored outputs of temperature 0 or seeded calls
+        chat_fn=None,  # llm_chat(msgs, **llm_api_kwargs) replacement, e.g. a mock backend client
+        tracer=None,  # tracing.Tracer, the process-wide one by default
+        tool_output_config={},  # per tool overrides of the output pipeline, see tool_output.TOOL_PIPELINES
     ):
         self.tool_arg_field_name = tool_arg_field_name
+        self.stream_fc = stream_fc
+        self.stream_printer = stream_printer
+        self.streamed_message = None
+        self.context = (
+            ContextWindow(context_budget, model=llm_api_kwargs.get("model"))
+            if context_budget
+            else None
+        )
         self.llm_api_kwargs = llm_api_kwargs
+        self.chat_fn = chat_fn or llm_chat
+        self.tracer = tracer or get_tracer()
+        self.tool_output_config = tool_output_config
+        self.turn_span = None  # parent of tool call spans, which may run in pool threads
+        self.router = router
+        self.session_id = uuid.uuid4().hex  # keeps this conversation on one backend, see LLMRouter
+        self.completion_cache = get_completion_cache() if cache_completions else None
         self.user_input_formatter = user_input_formatter
         self.tool_output_formatter = tool_output_formatter
         self.avoid_json_for_str_ret = avoid_json_for_str_ret
@@ -392,17 +473,34 @@ class LLMAgent:
         self.tools = []
         self.tool_by_name = {}
 
+        # per-session tool state, see tool_defs.noexport_workdir / noexport_shell_session
+        self.workdir = None
+        self.shell_session = None
+
+        # python_function is resolved on the first call, see tools.LazyTool
         for tool in tools:
-            self.tool_by_name[tool["json_schema"]["name"]] = tool["python_function"]
+            self.tool_by_name[tool["json_schema"]["name"]] = tool
 
         self.sysprompt = prompt(tools)
-        self.msgs = [dict(role="system", content=self.sysprompt)]
+        self.msgs = MessageLog([dict(role="system", content=self.sysprompt)])
+        self.last_llm_output = None
+        self.journal = None  # journal.SessionJournal, see journal.open_session
         if first_msg:
             self.msgs.append(ai_msg(first_msg))
 
         self.json_schema = construct_json_schema(
-            tools, thoughts_required=thoughts_required
+            tools,
+            thoughts_required=thoughts_required,
+            multi_call=parallel_tool_calls,
+            max_calls=max_parallel_tools,
         )
+        # constrained decoding artifacts are compiled once here, not on every LLM call
+        self.fc_grammar = schema_to_gbnf(self.json_schema) if function_calling_mode == "grammar" else None
+        self.fc_regex = schema_to_regex(self.json_schema) if function_calling_mode == "regex" else None
+        self.max_parallel_tools = max_parallel_tools
+        self.tool_pool = None
+        self.speculative_tools = speculative_tools
+        self.speculation = None
 
         self.tool_calls_allowed = tool_calls_allowed
 
@@ -413,83 +511,359 @@ class LLMAgent:
             print(f"Executing user query: {first_user_msg}")
             self.update(first_user_msg)
 
-    def llm_call_fc(self, msgs, llm_api_kwargs={}):
-
+    def prepare_llm_call(self, msgs, llm_api_kwargs={}):
+        """Fit msgs into the context budget and build llm_chat kwargs for the function calling mode"""
         _llm_api_kwargs = {**self.llm_api_kwargs, **llm_api_kwargs}
 
+        if self.context is not None:
+            self.context.fit(msgs)
+
+        if isinstance(msgs, MessageLog):
+            printd(f"PROMPT PREFIX HASH: {msgs.prefix_hash()} ({len(msgs)} msgs)")
+
         if self.function_calling_mode == "json_schema":
             _llm_api_kwargs['json_schema'] = self.json_schema
-        elif self.function_calling_mode == "json_format":
+        elif self.function_calling_mode == "grammar":
+            _llm_api_kwargs['grammar'] = self.fc_grammar
+        elif self.function_calling_mode == "regex":
+            _llm_api_kwargs['guided_regex'] = self.fc_regex
+        elif self.function_calling_mode in ("json_mode", "json_format"):
             _llm_api_kwargs['response_format'] = {"type": "json_object"}
 
-        n = 0
-        while n < self.max_n_retries:
-            ret = llm_chat(msgs, **_llm_api_kwargs)
-            json = parse_llm_json(ret)
-            if json is not None and validate_json(json, self.json_schema):
-                return json
-            n += 1
+        return _llm_api_kwargs
+
+    def matches_schema(self, obj) -> bool:
+        """Silent validate_json, for picking the tool call out of several JSON values in the output"""
+        try:
+            get_validator(self.json_schema)(obj)
+            return True
+        except Exception:
+            return False
+
+    def parse_llm_output(self, ret):
+        return parse_llm_json(ret, accept=self.matches_schema)
+
+    def validate_llm_output(self, json) -> bool:
+        return validate_json(json, self.json_schema)
+
+    def accept_llm_output(self, ret):
+        """Parse and validate raw LLM output, returns the tool call object or None"""
+        if ret is None:
+            return None
+        json = self.parse_llm_output(ret)
+        if json is not None and self.validate_llm_output(json):
+            self.last_llm_output = ret
+            return json
+        return None
+
+    @property
+    def n_attempts(self):
+        # grammar constrained output can't be an invalid call, a failure there means the backend ignored the grammar
+        return 1 if self.function_calling_mode in CONSTRAINED_FC_MODES else self.max_n_retries
+
+    def llm_format_failure(self):
+        return Exception(
+            f"LLM format failure: cannot receive valid JSON object after {self.n_attempts} attempts"
+        )
+
+    def completion_cache_key(self, msgs, llm_api_kwargs):
+        """Cache key of the call, None if the completion cache is off or the call isn't deterministic"""
+        if self.completion_cache is None or not is_deterministic(llm_api_kwargs):
+            return None
+        return completion_key(msgs, llm_api_kwargs)
+
+    def cached_completion(self, cache_key):
+        """Tool call object of a stored completion, None on a miss"""
+        json = self.accept_llm_output(self.completion_cache.get(cache_key))
+        if json is not None:
+            printd(f"COMPLETION CACHE HIT: {cache_key[:16]}")
+            self.streamed_message = None  # nothing was streamed, update() prints the message itself
+        return json
+
+    def llm_chat(self, msgs, **llm_api_kwargs):
+        if self.router is not None:
+            return self.router.chat(msgs, session=self.session_id, **llm_api_kwargs)
+        return self.chat_fn(msgs, **llm_api_kwargs)
+
+    def trace_prompt(self, span, msgs):
+        if not self.tracer.enabled:
+            return
+        span.set(
+            prompt_msgs=len(msgs),
+            prompt_chars=sum(len(msg.get("content") or "") for msg in msgs),
+            # token counts are only known for free when the context window already keeps them
+            prompt_tokens=self.context.total(msgs) if self.context is not None else None,
+        )
+
+    @staticmethod
+    def llm_outcome(ret, json) -> str:
+        if ret is None:
+            return "rejected"  # stopped while streaming
+        return "invalid" if json is None else "ok"
+
+    def llm_call_fc(self, msgs, llm_api_kwargs={}):
+        with self.tracer.span(
+            "llm.call", mode=self.function_calling_mode, model=self.llm_api_kwargs.get("model"), stream=self.stream_fc
+        ) as call_span:
+            _llm_api_kwargs = self.prepare_llm_call(msgs, llm_api_kwargs)
+            self.trace_prompt(call_span, msgs)
+
+            cache_key = self.completion_cache_key(msgs, _llm_api_kwargs)
+            if cache_key is not None:
+                json = self.cached_completion(cache_key)
+                call_span.set(cache_hit=json is not None)
+                if json is not None:
+                    return json
+
+            n = 0
+            while n < self.n_attempts:
+                with self.tracer.span("llm.attempt", attempt=n + 1) as span:
+                    if self.stream_fc:
+                        ret = self.llm_chat_streamed(msgs, _llm_api_kwargs)
+                    else:
+                        ret = self.llm_chat(msgs, **_llm_api_kwargs)
+                    json = self.accept_llm_output(ret)
+                    span.set(outcome=self.llm_outcome(ret, json), output_chars=len(ret) if ret else 0)
+                call_span.set(attempts=n + 1, retries=n)
+                if json is not None:
+                    if cache_key is not None:
+                        self.completion_cache.set(cache_key, ret)
+                    return json
+                n += 1
+
+            raise self.llm_format_failure()
+
+    def llm_chat_streamed(self, msgs, llm_api_kwargs):
+        """
+        Feed streamed completion chunks into the incremental tool call parser.
+        send_message text is printed while it is generated, read-only tools start as soon as their call
+        is complete (see SpeculativeExecutor). Returns None if the output was rejected early.
+        """
+        self.streamed_message = None
+        printed = []
+
+        # results speculated for a previous response or a rejected attempt are never used
+        if self.speculation is not None:
+            self.speculation.discard()
+        self.speculation = (
+            SpeculativeExecutor(self.call_tool, self.is_read_only_tool, self.get_tool_pool(), passive=("send_message",))
+            if self.speculative_tools and self.tool_calls_allowed
+            else None
+        )
+
+        def on_message_delta(delta):
+            printed.append(delta)
+            self.stream_printer(delta)
+
+        monitor = ToolCallStreamMonitor(
+            self.json_schema,
+            args_name=self.tool_arg_field_name,
+            on_message_delta=on_message_delta if self.stream_printer else None,
+            on_call_ready=self.speculation.on_call_ready if self.speculation else None,
+        )
+
+        stream = self.llm_chat(msgs, stream=True, **llm_api_kwargs)
+        text = []
+        try:
+            for chunk in iter_llm_chunks(stream):
+                text.append(chunk)
+                monitor.feed(chunk)
+                if monitor.done:
+                    break
+        except StreamRejected as e:
+            print(f"LLM output rejected while streaming: {e}")
+            return None
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+            if printed:
+                self.stream_printer("\n")
+
+        if printed:
+            self.streamed_message = "".join(printed)
+
+        return "".join(text)
+
+    def serialize_ai_msg(self, json_fc_obj) -> str:
+        """
+        Keep the model's own output text in history when it is exact JSON for the call, so the
+        assistant turn matches the tokens already in the backend KV cache instead of a re-dump.
+        """
+        raw = (self.last_llm_output or "").strip()
+        try:
+            if raw and fastjson.loads(raw) == json_fc_obj:
+                return raw
+        except ValueError:
+            pass
+        return fastjson.dumps(json_fc_obj)
+
+    def call_tool(self, tool_name, tool_args):
+        """Run a tool with arguments from a validated call, returns (output, error)"""
+        print(f"CALLING {tool_name} @ {tool_args} ... ", end="")
+
+        from schema_generator import coerce_args  # pydantic is only needed once tools run
+
+        with self.tracer.span("tool.call", parent=self.turn_span, tool=tool_name) as span:
+            tool_fn = self.tool_by_name[tool_name]["python_function"]
+
+            error = False
+            try:
+                # deadlines are per tool: shell commands (procrunner/shell_session) and HTTP requests (http_pool)
+                ret = tool_fn(self, **coerce_args(tool_fn, tool_args))
+            except Exception as e:
+                error = True
+                ret = str(e)
+                print(f"TOOL CALL FAILED: {ret}")
+            span.set(error=error, output_chars=len(ret) if isinstance(ret, str) else None)
+
+            print("SUCCESS" if not error else "FAILED")
+
+            ret = remove_pseudotag_content(
+                ret
+            )  # Not really necessary, just an experiment
+
+            from tool_output import process_tool_output
+
+            ret = process_tool_output(
+                tool_name, ret, overrides=self.tool_output_config, model=self.llm_api_kwargs.get("model")
+            )
+            span.set(prompt_chars=len(ret) if isinstance(ret, str) else None)
+
+        return ret, error
 
-        raise Exception(
-            f"LLM format failure: cannot receive valid JSON object after {self.max_n_retries} attempts"
+    def is_read_only_tool(self, tool_name) -> bool:
+        tool = self.tool_by_name.get(tool_name)
+        return bool(tool) and tool.get("read_only", False)
+
+    def get_tool_pool(self) -> ThreadPoolExecutor:
+        if self.tool_pool is None:
+            self.tool_pool = ThreadPoolExecutor(self.max_parallel_tools, thread_name_prefix="picoagent-tool")
+        return self.tool_pool
+
+    def take_speculated(self, tool_name, tool_args):
+        """Future of the same call started while the response was streaming, None if there is none"""
+        return self.speculation.take(tool_name, tool_args) if self.speculation is not None else None
+
+    def run_tool_call(self, tool_name, tool_args):
+        """call_tool, reusing the result of a speculative run of the same call"""
+        future = self.take_speculated(tool_name, tool_args)
+        if future is not None:
+            return future.result()
+        return self.call_tool(tool_name, tool_args)
+
+    def tool_output_msg(self, ret, error=False):
+        # TODO: decide on ai vs user format for return msgs
+        # next_msg = ai_msg(self.tool_output_formatter(ret, error=error, avoid_json_for_str_ret=self.avoid_json_for_str_ret))
+        return user_msg(
+            self.tool_output_formatter(
+                ret,
+                error=error,
+                avoid_json_for_str_ret=self.avoid_json_for_str_ret,
+            )
         )
 
+    def call_tools(self, calls):
+        """
+        Run the tool calls of a multi-call response, returns [(output, error)] in call order.
+        Runs of consecutive read-only calls execute concurrently, other calls run alone in order.
+        """
+        results = [None] * len(calls)
+        batch = []
+
+        def flush():
+            if len(batch) == 1:
+                i = batch[0]
+                results[i] = self.run_tool_call(calls[i]["call_tool"], calls[i][self.tool_arg_field_name])
+            elif batch:
+                futures = {}
+                for i in batch:
+                    name, args = calls[i]["call_tool"], calls[i][self.tool_arg_field_name]
+                    futures[i] = self.take_speculated(name, args) or self.get_tool_pool().submit(self.call_tool, name, args)
+                for i, future in futures.items():
+                    results[i] = future.result()
+            batch.clear()
+
+        for i, call in enumerate(calls):
+            if self.is_read_only_tool(call["call_tool"]):
+                batch.append(i)
+                continue
+            flush()
+            results[i] = self.run_tool_call(call["call_tool"], call[self.tool_arg_field_name])
+        flush()
+
+        return results
+
+    def tool_outputs_msg(self, calls, results):
+        """Merge the outputs of a multi-call response into one tool output message"""
+        outputs = [
+            dict(call_tool=call["call_tool"], output=ret, error=error)
+            for call, (ret, error) in zip(calls, results)
+        ]
+        return user_msg(self.tool_output_formatter(outputs, error=all(error for _, error in results)))
+
+    def run_multi_call(self, calls, msg_printer=print):
+        """Handle a multi-call response, returns the merged tool output message or None if there is nothing to run"""
+        tool_calls = [
+            call
+            for call in calls
+            if call["call_tool"] != "send_message" and self.tool_by_name.get(call["call_tool"])
+        ]
+        results = self.call_tools(tool_calls) if self.tool_calls_allowed and tool_calls else None
+
+        messages = [
+            call[self.tool_arg_field_name]["message"] for call in calls if call["call_tool"] == "send_message"
+        ]
+        if msg_printer and not (self.stream_fc and "".join(messages) == self.streamed_message):
+            for message in messages:
+                msg_printer(message)
+
+        return self.tool_outputs_msg(tool_calls, results) if results else None
+
     def update(self, query: str, stream=True, msg_printer=print, max_iter=3):
+        with self.tracer.span("agent.turn", session=self.session_id, query_chars=len(query)) as span:
+            self.turn_span = span if self.tracer.enabled else None
+            if self.journal is not None:
+                self.journal.begin_turn(query)
+            ret = self.run_turn(query, msg_printer=msg_printer, max_iter=max_iter)
+            if self.journal is not None:
+                self.journal.end_turn(workdir=self.workdir)
+            span.set(history_msgs=len(self.msgs))
+            return ret
+
+    def run_turn(self, query: str, msg_printer=print, max_iter=3):
         self.msgs.append(user_msg(self.user_input_formatter(query)))
         json_fc_obj = self.llm_call_fc(self.msgs)
 
         msg_turns = 0
         while msg_turns < max_iter:
-            self.msgs.append(ai_msg(json.dumps(json_fc_obj)))
+            self.msgs.append(ai_msg(self.serialize_ai_msg(json_fc_obj)))
+
+            if isinstance(json_fc_obj, list):
+                next_msg = self.run_multi_call(json_fc_obj, msg_printer=msg_printer)
+                if next_msg is None:
+                    return json_fc_obj
+                self.msgs.append(next_msg)
+                printd(f"AI INNER MONOLOGUE: {json_to_highlighted_str(next_msg)}")
+                json_fc_obj = self.llm_call_fc(self.msgs)
+                msg_turns += 1
+                continue
 
             tool_name = json_fc_obj["call_tool"]
             tool_args = json_fc_obj[self.tool_arg_field_name]
 
             if msg_printer and tool_name == "send_message":
-                msg_printer(json_fc_obj[self.tool_arg_field_name]["message"])
+                message = json_fc_obj[self.tool_arg_field_name]["message"]
+                if not (self.stream_fc and message == self.streamed_message):
+                    msg_printer(message)
                 return json_fc_obj
 
             printd("LLM_RAW_OUT:", json_to_highlighted_str(json_fc_obj))
 
             if self.tool_calls_allowed and self.tool_by_name.get(tool_name):
-                print(f"CALLING {tool_name} @ {tool_args} ... ", end="")
-
-                tool_fn = self.tool_by_name.get(tool_name)
-
-                spec = inspect.getfullargspec(tool_fn).annotations
-
-                for name, arg in tool_args.items():
-                    if isinstance(tool_args[name], dict):
-                        tool_args[name] = spec[name](**tool_args[name])
-
-                error = False
-                try:
-                    # TODO timeout
-                    ret = tool_fn(self, **tool_args)
-                except Exception as e:
-                    error = True
-                    ret = str(e)
-                    print(f"TOOL CALL FAILED: {ret}")
-
-                print("SUCCESS" if not error else "FAILED")
-
-                ret = remove_pseudotag_content(
-                    ret
-                )  # Not really necessary, just an experiment
-
-                # TODO: decide on ai vs user format for return msgs
-                # next_msg = ai_msg(self.tool_output_formatter(ret, error=error, avoid_json_for_str_ret=self.avoid_json_for_str_ret))
-                
-                next_msg = user_msg(
-                    self.tool_output_formatter(
-                        ret,
-                        error=error,
-                        avoid_json_for_str_ret=self.avoid_json_for_str_ret,
-                    )
-                )
-
+                ret, error = self.run_tool_call(tool_name, tool_args)
+                next_msg = self.tool_output_msg(ret, error)
                 self.msgs.append(next_msg)
-                
+
                 if tool_name == "exec_shell_cmd" and not error:
                     printd(ret)
 
@@ -508,10 +882,20 @@ class LLMAgent:
         return json_fc_obj
 
 
-chat_history = []
+def startup_report(timer: PhaseTimer) -> str:
+    from tools import schema_cache_stats
+
+    heavy = [m for m in ("requests", "bs4", "numpy", "pygments", "yaml", "tool_defs") if m in sys.modules]
+    lines = ["Startup profile:", timer.report()]
+    lines.append(f"  tool schema cache: {', '.join(f'{k} {v}' for k, v in schema_cache_stats.items()) or 'unused'}")
+    lines.append(f"  modules loaded: {len(sys.modules)}, heavy: {', '.join(heavy) or 'none'}")
+    return "\n".join(lines)
 
 
 def main():
+    startup = PhaseTimer(STARTUP_T0)
+    startup.mark("imports")
+
     parser = argparse.ArgumentParser(description="LLM Chat CLI")
     parser.add_argument(
         "query", type=str, nargs="?", default="", help="Initial query to the agent"
@@ -519,12 +903,37 @@ def main():
     parser.add_argument("--agent", help="The agent to use")
     parser.add_argument(
         "--fc-mode",
-        choices=["json_schema", "json_mode", "none"],
+        choices=["json_schema", "grammar", "regex", "json_mode", "none"],
         default="json_schema",
-        help="Function calling mode: json_schema (llama.cpp, tabbyAPI), json_mode (Groq, OpenAI, Together), none. Currently only json_schema is supported and tested",
+        help="Function calling mode: json_schema (llama.cpp, tabbyAPI), grammar (llama.cpp GBNF compiled from the tool schemas), regex (vLLM guided_regex), json_mode (Groq, OpenAI, Together), none",
     )
     # TODO: vLLM guided_json support https://github.com/noamgat/lm-format-enforcer
     # TODO: Togethers, Mistral's fc support https://docs.together.ai/docs/function-calling
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream LLM output through the incremental tool call parser: print send_message text as it is generated and reject invalid calls early",
+    )
+    parser.add_argument(
+        "--cache-prompt",
+        action="store_true",
+        help="Ask the backend to reuse the KV cache of the common prompt prefix (llama.cpp cache_prompt)",
+    )
+    parser.add_argument(
+        "--context-budget",
+        type=int,
+        help="Token budget for the prompt, old tool outputs and messages are compacted above it",
+    )
+    parser.add_argument(
+        "--parallel-tools",
+        action="store_true",
+        help="Allow the LLM to answer with an array of tool calls, independent read-only calls run concurrently",
+    )
+    parser.add_argument(
+        "--cache-completions",
+        action="store_true",
+        help="Store and reuse LLM outputs of deterministic calls (temperature 0 or a seed), e.g. to replay eval runs",
+    )
     parser.add_argument("--sysprompt", help="The system prompt")
     parser.add_argument("--context", help="The context for the agent")
     parser.add_argument("--toolset", default="<default>", help="Tools given to agent")
@@ -534,11 +943,23 @@ def main():
     parser.add_argument(
         "-v", "--verbose", action="store_true", help="Enable debug mode"
     )
+    parser.add_argument(
+        "--profile-startup", action="store_true", help="Print how long each startup phase took"
+    )
+    parser.add_argument(
+        "--session",
+        help="Journal the session under this name (or journal file path) and resume it if it exists",
+    )
+    parser.add_argument("--trace", help="Append spans of turns, LLM attempts and tool calls to this JSONL file")
+    parser.add_argument("--trace-otlp", help="Append the spans in OpenTelemetry OTLP/JSON encoding to this file")
+    parser.add_argument("--metrics-file", help="Prometheus text format metrics file, rewritten after every turn")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics over HTTP on this port")
     parser.add_argument("-b", "--api-base", help="API base URL")
     parser.add_argument("-k", "--api-key", help="API key")
     parser.add_argument("-m", "--api-model", help="API LLM model")
 
     args = parser.parse_args()
+    startup.mark("parse args")
 
     if args.verbose:
         enable_debug()
@@ -550,6 +971,7 @@ def main():
 
     # Load config and extract api params
     config = load_config()
+    startup.mark("load config")
     llm_api_kwargs = {}
 
     # Command line args override config file
@@ -568,9 +990,39 @@ def main():
     elif config.get('api_model'):
         llm_api_kwargs['model'] = config['api_model']
 
+    if args.cache_prompt or config.get('cache_prompt'):
+        llm_api_kwargs['cache_prompt'] = True
+
+    # sampling params, temperature 0 or a seed make calls eligible for --cache-completions
+    for key in ('temperature', 'seed'):
+        if config.get(key) is not None:
+            llm_api_kwargs[key] = config[key]
+
+    # several replicas in the config, unless --api-base picks one
+    router = None
+    if config.get('backends') and not args.api_base:
+        router = LLMRouter.from_config(
+            config,
+            chat_fn=llm_chat,
+            defaults=dict(api_key=llm_api_kwargs.get('api_key'), model=llm_api_kwargs.get('model')),
+        )
+        router.start_health_checks()
+
+    trace_jsonl = args.trace or config.get("trace")
+    trace_otlp = args.trace_otlp or config.get("trace_otlp")
+    metrics_file = args.metrics_file or config.get("metrics_file")
+    metrics_port = args.metrics_port or config.get("metrics_port")
+    if trace_jsonl or trace_otlp or metrics_file or metrics_port:
+        tracer = tracing.configure(trace_jsonl, trace_otlp, metrics=bool(metrics_file or metrics_port))
+        if metrics_port:
+            tracer.metrics.serve(metrics_port)
+
+    tools = toolsets["allV1d1"]
+    startup.mark("build toolset")
+
     agent = LLMAgent(
         prompt=prompt_tooluse_ultramin_thoughts_system_criticism,  # prompt_tooluse_ultramin,
-        tools=toolsets["allV1d1"],
+        tools=tools,
         first_msg=json.dumps(
             dict(
                 thoughts="This is the first time I see user, I should analyze their intent and be ready to execute their request while greeting them and showing I'm ready to help",
@@ -578,12 +1030,38 @@ def main():
                 params=dict(message="How can I help you today?"),
             )
         ),
-        first_user_msg=args.query if len(args.query) else None,
+        first_user_msg=args.query if len(args.query) and not args.session else None,
         function_calling_mode=args.fc_mode,
-        llm_api_kwargs=llm_api_kwargs
+        llm_api_kwargs=llm_api_kwargs,
+        stream_fc=args.stream or config.get("stream", False),
+        context_budget=args.context_budget or config.get("context_budget"),
+        parallel_tool_calls=args.parallel_tools or config.get("parallel_tools", False),
+        speculative_tools=config.get("speculative_tools", True),
+        router=router,
+        cache_completions=args.cache_completions or config.get("cache_completions", False),
+        tool_output_config=config.get("tool_output", {}),
     )
+    startup.mark("agent init + first query" if args.query and not args.session else "agent init")
+
+    if args.session:
+        from journal import open_session, session_path
+
+        state = open_session(agent, session_path(args.session), fsync=config.get("journal_fsync", False))
+        if state["turns"] or state["open_turn"]:
+            print(f"Resumed session {args.session}: {state['turns']} turns, {len(agent.msgs)} messages")
+        if state["open_turn"] is not None:
+            print(f"The last turn was interrupted, tools of its unfinished step were not re-run: {state['open_turn']}")
+        startup.mark("open session")
+        if args.query:
+            print(f"Executing user query: {args.query}")
+            agent.update(args.query)
+
+    if args.profile_startup:
+        print(startup_report(startup), file=sys.stderr)
 
     while True:
+        if metrics_file:
+            get_tracer().metrics.write(metrics_file)
         user_input = input("> ")
         _ = agent.update(user_input)
 
@@ -0,0 +1,138 @@
+import hashlib
+
+import fastjson
+
+
+def serialize_msg(msg) -> bytes:
+    """Canonical serialization of a chat message, stable across turns and processes"""
+    return fastjson.dumps_bytes(msg, sort_keys=True)
+
+
+class MessageLog(list):
+    """
+    Chat message list that keeps the prompt prefix byte-stable across turns.
+
+    Messages are copied on insertion so later mutation of the caller's dicts can't change what
+    was already sent to the backend, each message is serialized once and the serializations are
+    chained into prefix hashes. Appending never invalidates earlier hashes, so an unchanged
+    prefix_hash(n) means the first n messages are byte-identical to what the server has already
+    prefilled (and what llama.cpp's cache_prompt can reuse).
+
+    Listeners are called after every mutation with an operation that replays it on a plain list,
+    see apply_op: ("append", msg), ("insert", i, msg), ("set", start, stop, [msgs]) and
+    ("delete", start, stop), indices already resolved against the length before the change.
+    """
+
+    def __init__(self, msgs=()):
+        super().__init__()
+        self._serialized = []
+        self._hashes = []
+        self.listeners = []
+        self.extend(msgs)
+
+    def _notify(self, *op):
+        for listener in self.listeners:
+            listener(op)
+
+    def _range(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                raise ValueError("MessageLog does not support extended slices")
+            return start, max(start, stop)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("MessageLog index out of range")
+        return i, i + 1
+
+    def _invalidate(self, i=0):
+        # negative indices are resolved against the current length, which may invalidate one extra entry
+        if i < 0:
+            i = max(0, len(self) + i)
+        del self._serialized[i:]
+        del self._hashes[i:]
+
+    def append(self, msg):
+        msg = dict(msg)
+        super().append(msg)
+        self._notify("append", msg)
+
+    def extend(self, msgs):
+        for msg in msgs:
+            self.append(msg)
+
+    def insert(self, i, msg):
+        i = max(0, min(len(self), i + len(self) if i < 0 else i))
+        msg = dict(msg)
+        super().insert(i, msg)
+        self._invalidate(i)
+        self._notify("insert", i, msg)
+
+    def __setitem__(self, i, msg):
+        if isinstance(i, slice):
+            start, stop = self._range(i)
+            msgs = [dict(m) for m in msg]
+            super().__setitem__(slice(start, stop), msgs)
+        else:
+            start, stop = self._range(i)
+            msgs = [dict(msg)]
+            super().__setitem__(start, msgs[0])
+        self._invalidate(start)
+        self._notify("set", start, stop, msgs)
+
+    def __delitem__(self, i):
+        start, stop = self._range(i)
+        super().__delitem__(slice(start, stop))
+        self._invalidate(start)
+        self._notify("delete", start, stop)
+
+    def __iadd__(self, msgs):
+        self.extend(msgs)
+        return self
+
+    def pop(self, i=-1):
+        ret = self[i]
+        del self[i]
+        return ret
+
+    def remove(self, msg):
+        del self[self.index(msg)]
+
+    def clear(self):
+        del self[:]
+
+    def serialized(self, i) -> bytes:
+        self._advance(i + 1 if i >= 0 else len(self) + i + 1)
+        return self._serialized[i]
+
+    def _advance(self, n):
+        prev = self._hashes[-1] if self._hashes else b""
+        for i in range(len(self._serialized), n):
+            s = serialize_msg(self[i])
+            prev = hashlib.sha256(prev + s).digest()
+            self._serialized.append(s)
+            self._hashes.append(prev)
+
+    def prefix_hash(self, n=None) -> str:
+        """Hash of the first n messages (all by default), changes iff any of them changed"""
+        n = len(self) if n is None else min(n, len(self))
+        if n == 0:
+            return hashlib.sha256(b"").hexdigest()
+        self._advance(n)
+        return self._hashes[n - 1].hex()
+
+
+def apply_op(msgs, op):
+    """Replay a MessageLog listener operation on a list"""
+    kind = op[0]
+    if kind == "append":
+        msgs.append(op[1])
+    elif kind == "insert":
+        msgs.insert(op[1], op[2])
+    elif kind == "set":
+        msgs[op[1] : op[2]] = op[3]
+    elif kind == "delete":
+        del msgs[op[1] : op[2]]
+    else:
+        raise ValueError(f"Unknown MessageLog operation {kind!r}")
@@ -1,9 +1,15 @@
 import os
 import re
 import json
+import time
+import hashlib
+import threading
+import http.client
+import urllib.parse
 import urllib.request
-import tiktoken
 import urllib.error
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 
 def check_azure_or_openai(string):
@@ -30,7 +36,7 @@ def send_test_request(url, post_data, headers={}):
             method="POST",
             headers=headers,
         )
-        response = urllib.request.urlopen(request)
+        response = urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT)
         if response.getcode() == 200:
             return json.loads(response.read().decode("utf-8"))
     except urllib.error.URLError as e:
@@ -42,16 +48,23 @@ def send_test_request(url, post_data, headers={}):
 
 
 saved_tokenizers = {}
-api_found = None
+apis_found = {}  # api_base -> api name or False
 
 supported_tokenizer_apis = dict(
     tabbyapi=["/v1/token/encode", lambda s: dict(text=s), lambda j: j["tokens"]],
-    llamacpp=["/tokenize", lambda s: dict(content=s), lambda j: j],
+    llamacpp=["/tokenize", lambda s: dict(content=s), lambda j: j["tokens"] if isinstance(j, dict) else j],
 )
 
+REQUEST_TIMEOUT = float(os.environ.get("OMNITOKENIZER_TIMEOUT", "2.0"))
+SLOW_SERVER_COOLDOWN = 60.0  # seconds to use the local counter after the server timed out
+CACHE_MAX_BYTES = int(os.environ.get("OMNITOKENIZER_CACHE_BYTES", str(64 * 1024 * 1024)))
+N_CONNECTIONS = 4
+
+server_slow_until = 0.0
+
 
 def get_full_api_path(api_base, path):
-    _api_base = api_base.rstrip("/").rstrip("/v1")
+    _api_base = api_base.rstrip("/").removesuffix("/v1")
     return f"{_api_base}{path}"
 
 
@@ -59,6 +72,10 @@ def automatic_api_guess(api_base, headers={}):
     if not api_base:
         raise Exception("OPENAI_API_BASE not given to guessing engine")
 
+    forced = os.environ.get("OMNITOKENIZER_API")
+    if forced:
+        return forced
+
     for api, api_config in supported_tokenizer_apis.items():
         path, compose_fn, extract_fn = api_config
         try:
@@ -74,19 +91,139 @@ def automatic_api_guess(api_base, headers={}):
     return False
 
 
-def tokenize(text, model=None, api_key=None):
-    global api_found
-
+class TokenCache:
+    """LRU cache of tokenizations keyed by (model, text hash), evicting by approximate total bytes"""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(model, text):
+        return (model, hashlib.sha1(text.encode("utf-8", "surrogatepass")).digest())
+
+    @staticmethod
+    def entry_size(tokens):
+        return 8 * len(tokens) + 96
+
+    def get(self, key):
+        with self.lock:
+            tokens = self.entries.get(key)
+            if tokens is not None:
+                self.entries.move_to_end(key)
+            return tokens
+
+    def put(self, key, tokens):
+        size = self.entry_size(tokens)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= self.entry_size(old)
+            self.entries[key] = tokens
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= self.entry_size(evicted)
+
+
+token_cache = TokenCache()
+
+APPROX_TOKEN_RE = re.compile(r" ?\w{1,5}| ?[^\w\s]|\s+")
+
+
+def local_tokenize(text, model=None):
+    """
+    Local tokenizer used when no server tokenizer is available or it is too slow.
+    Uses tiktoken if installed (exact for OpenAI models, a close estimate otherwise), else splits
+    text into short word pieces and punctuation, which approximates BPE token counts.
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return APPROX_TOKEN_RE.findall(text)
+
+    name = model if model and model.startswith("gpt-") else "cl100k_base"
+    if name not in saved_tokenizers:
+        debug(f"[omnitokenizer]: loading tiktoken encoder for {name}")
+        if name.startswith("gpt-"):
+            saved_tokenizers[name] = tiktoken.encoding_for_model(name)
+        else:
+            saved_tokenizers[name] = tiktoken.get_encoding(name)
+    return saved_tokenizers[name].encode(text)
+
+
+class KeepAliveClient:
+    """POSTs JSON over persistent HTTP connections, one per thread"""
+
+    def __init__(self, api_url, headers):
+        self.url = urllib.parse.urlparse(api_url)
+        self.headers = headers
+        self.local = threading.local()
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.url.scheme == "https" else http.client.HTTPConnection
+            conn = self.local.conn = cls(self.url.netloc, timeout=REQUEST_TIMEOUT)
+        return conn
+
+    def post_json(self, data):
+        body = json.dumps(data).encode("utf-8")
+        path = self.url.path or "/"
+        for attempt in range(2):
+            conn = self.connection()
+            try:
+                conn.request("POST", path, body, self.headers)
+                response = conn.getresponse()
+                payload = response.read()
+                if response.status != 200:
+                    raise Exception(f"[omnitokenizer]: tokenizer api returned {response.status}")
+                return json.loads(payload.decode("utf-8"))
+            except (http.client.RemoteDisconnected, http.client.CannotSendRequest, ConnectionResetError, BrokenPipeError):
+                # the server closed an idle keep-alive connection, reconnect once
+                conn.close()
+                self.local.conn = None
+                if attempt:
+                    raise
+            except Exception:
+                conn.close()
+                self.local.conn = None
+                raise
+
+
+clients = {}
+clients_lock = threading.Lock()
+executor = None
+
+
+def get_client(api_url, headers):
+    key = (api_url, tuple(sorted(headers.items())))
+    with clients_lock:
+        if key not in clients:
+            clients[key] = KeepAliveClient(api_url, headers)
+        return clients[key]
+
+
+def get_executor():
+    global executor
+    with clients_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(N_CONNECTIONS, thread_name_prefix="omnitokenizer")
+        return executor
+
+
+def server_tokenize_many(texts, model=None, api_key=None):
+    """Tokenize texts with the backend's tokenizer api, raises if it is not available"""
     oai_api_base = os.environ.get("OPENAI_API_BASE")
 
-    if check_azure_or_openai(oai_api_base) or not oai_api_base:
-        if model.startswith("gpt-"):
-            if model not in saved_tokenizers:
-                print(f"[omnitokenizer]: loading tiktoken encoder for {model}")
-                saved_tokenizers[model] = tiktoken.encoding_for_model(model)
-            return saved_tokenizers.get(model)(text)
-        else:
-            raise Exception(f"Unknown model for openai or azure api: {model}")
+    if not oai_api_base or check_azure_or_openai(oai_api_base):
+        if model and model.startswith("gpt-"):
+            return [local_tokenize(text, model) for text in texts]
+        raise Exception(f"Unknown model for openai or azure api: {model}")
 
     headers = {}
 
@@ -98,25 +235,86 @@ def tokenize(text, model=None, api_key=None):
 
     headers["Content-Type"] = "application/json"
 
-    if api_found is None:
-        api_found = automatic_api_guess(oai_api_base, headers)
+    if oai_api_base not in apis_found:
+        apis_found[oai_api_base] = automatic_api_guess(oai_api_base, headers)
+    api_found = apis_found[oai_api_base]
 
     if api_found is False or api_found not in supported_tokenizer_apis:
         raise Exception(
             f"[omnitokenizer]: Automatic tokenizer api guess failed, supported apis: {list(supported_tokenizer_apis.keys())}"
         )
 
-    tokens_api = supported_tokenizer_apis[api_found]
-    path, compose_fn, extract_fn = tokens_api
-    api_url = get_full_api_path(oai_api_base, path)
+    path, compose_fn, extract_fn = supported_tokenizer_apis[api_found]
+    client = get_client(get_full_api_path(oai_api_base, path), headers)
+
+    def run(text):
+        return extract_fn(client.post_json(compose_fn(text)))
+
+    if len(texts) == 1:
+        return [run(texts[0])]
+
+    # tokenizer endpoints take one text per request, overlap round trips over a few keep-alive connections
+    return list(get_executor().map(run, texts))
+
+
+def tokenize_many(texts, model=None, api_key=None, fallback=True):
+    """
+    Tokenize a batch of texts with caching.
+
+    Cache misses are sent to the server tokenizer in one batch over persistent connections.
+    If the server is unavailable or slow and `fallback` is set, the local tokenizer is used and
+    the server is skipped for SLOW_SERVER_COOLDOWN seconds. Fallback results are not cached.
+    """
+    global server_slow_until
+
+    ret = [None] * len(texts)
+    missing = {}  # text -> indices, duplicates are only tokenized once
+    for i, text in enumerate(texts):
+        tokens = token_cache.get(TokenCache.key(model, text))
+        if tokens is None:
+            missing.setdefault(text, []).append(i)
+        else:
+            ret[i] = tokens
+
+    if not missing:
+        return ret
+
+    miss_texts = list(missing)
+
+    if fallback and time.monotonic() < server_slow_until:
+        results = None
+    else:
+        try:
+            results = server_tokenize_many(miss_texts, model=model, api_key=api_key)
+        except Exception as e:
+            if not fallback:
+                raise
+            debug(f"[omnitokenizer]: server tokenizer failed, using local fallback: {e}")
+            server_slow_until = time.monotonic() + SLOW_SERVER_COOLDOWN
+            results = None
+
+    for n, text in enumerate(miss_texts):
+        if results is None:
+            tokens = local_tokenize(text, model)
+        else:
+            tokens = results[n]
+            token_cache.put(TokenCache.key(model, text), tokens)
+        for i in missing[text]:
+            ret[i] = tokens
+
+    return ret
+
+
+def tokenize(text, model=None, api_key=None, fallback=False):
+    return tokenize_many([text], model=model, api_key=api_key, fallback=fallback)[0]
+
 
-    data = json.dumps(compose_fn(text)).encode("utf-8")
+def count_tokens_many(texts, model=None, api_key=None):
+    return [len(tokens) for tokens in tokenize_many(texts, model=model, api_key=api_key)]
 
-    req = urllib.request.Request(api_url, data, headers)
-    with urllib.request.urlopen(req) as response:
-        result = json.loads(response.read().decode())
 
-    return extract_fn(result)
+def count_tokens(text, model=None, api_key=None):
+    return count_tokens_many([text], model=model, api_key=api_key)[0]
 
 
 if __name__ == "__main__":
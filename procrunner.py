@@ -0,0 +1,155 @@
+import os
+import selectors
+import signal
+import subprocess
+import time
+
+KILL_GRACE = 2.0  # seconds between SIGTERM and SIGKILL
+EOF_GRACE = 0.5  # seconds to keep reading after exit, background children may hold the pipes open
+
+
+class HeadTailBuffer:
+    """Bounded output buffer keeping the first and last max_bytes/2 bytes of a stream"""
+
+    def __init__(self, max_bytes: int):
+        self.head_max = max_bytes // 2
+        self.tail_max = max_bytes - self.head_max
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def write(self, data: bytes):
+        self.total += len(data)
+        if len(self.head) < self.head_max:
+            n = self.head_max - len(self.head)
+            self.head += data[:n]
+            data = data[n:]
+        if data:
+            self.tail += data
+            if len(self.tail) > 2 * self.tail_max:
+                del self.tail[: len(self.tail) - self.tail_max]
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > self.head_max + self.tail_max
+
+    @property
+    def omitted(self) -> int:
+        return max(0, self.total - self.head_max - self.tail_max)
+
+    def getvalue(self, encoding="utf-8") -> str:
+        tail = bytes(self.tail[-self.tail_max :]) if self.tail_max else b""
+        if not self.truncated:
+            return (bytes(self.head) + tail).decode(encoding, errors="replace")
+        return (
+            bytes(self.head).decode(encoding, errors="replace")
+            + f"\n[... {self.omitted} bytes omitted ...]\n"
+            + tail.decode(encoding, errors="replace")
+        )
+
+
+class ProcessResult:
+    def __init__(self, returncode, stdout: HeadTailBuffer, stderr: HeadTailBuffer, timed_out, elapsed):
+        self.returncode = returncode
+        self.stdout_buf = stdout
+        self.stderr_buf = stderr
+        self.timed_out = timed_out
+        self.elapsed = elapsed
+
+    @property
+    def stdout(self) -> str:
+        return self.stdout_buf.getvalue()
+
+    @property
+    def stderr(self) -> str:
+        return self.stderr_buf.getvalue()
+
+    @property
+    def truncated(self) -> bool:
+        return self.stdout_buf.truncated or self.stderr_buf.truncated
+
+    def truncation_note(self) -> str:
+        notes = []
+        for name, buf in (("stdout", self.stdout_buf), ("stderr", self.stderr_buf)):
+            if buf.truncated:
+                notes.append(f"{name}: {buf.total} bytes, {buf.omitted} omitted from the middle")
+        return f"[output truncated - {'; '.join(notes)}]" if notes else ""
+
+
+def kill_process_group(proc):
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            return
+        try:
+            proc.wait(timeout=KILL_GRACE)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+
+def run_shell(cmd: str, cwd=None, timeout=None, cpu_timeout=None, max_bytes=64 * 1024, env=None) -> ProcessResult:
+    """
+    Run a shell command in its own process group, streaming stdout/stderr into bounded head+tail buffers.
+
+    `timeout` is wall-clock seconds, `cpu_timeout` is enforced with `ulimit -t` in the shell. On
+    timeout the whole process group gets SIGTERM, then SIGKILL.
+    """
+    if cpu_timeout:
+        cmd = f"ulimit -t {int(cpu_timeout)}; {cmd}"
+
+    start = time.monotonic()
+    deadline = start + timeout if timeout else None
+    proc = subprocess.Popen(
+        cmd,
+        shell=True,
+        cwd=cwd,
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    )
+
+    out_buf, err_buf = HeadTailBuffer(max_bytes), HeadTailBuffer(max_bytes)
+    bufs = {proc.stdout.fileno(): out_buf, proc.stderr.fileno(): err_buf}
+    sel = selectors.DefaultSelector()
+    for f in (proc.stdout, proc.stderr):
+        sel.register(f, selectors.EVENT_READ)
+
+    timed_out = False
+    exited_at = None
+    try:
+        while sel.get_map():
+            now = time.monotonic()
+            if deadline is not None and now > deadline:
+                timed_out = True
+                kill_process_group(proc)
+                break
+            if proc.poll() is not None:
+                exited_at = exited_at or now
+                if now - exited_at > EOF_GRACE:
+                    break
+
+            wait = 0.1 if deadline is None else max(0.0, min(0.1, deadline - now))
+            for key, _ in sel.select(wait):
+                data = os.read(key.fd, 64 * 1024)
+                if data:
+                    bufs[key.fd].write(data)
+                else:
+                    sel.unregister(key.fileobj)
+    finally:
+        sel.close()
+        proc.stdout.close()
+        proc.stderr.close()
+
+    if not timed_out:
+        try:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            proc.wait(timeout=remaining)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            kill_process_group(proc)
+
+    return ProcessResult(proc.wait(), out_buf, err_buf, timed_out, time.monotonic() - start)
@@ -1,63 +1,158 @@
+import copy
+import enum
+import hashlib
 import inspect
+import marshal
+import threading
+import types
 import typing
 from typing import get_args, get_origin
 
 from docstring_parser import parse
 from pydantic import BaseModel
 
+# Mapping of Python scalar types to JSON schema types
+TYPE_MAP = {
+    int: "integer",
+    str: "string",
+    bool: "boolean",
+    float: "number",
+}
+
+UNION_TYPES = (typing.Union, types.UnionType)
+
+_schema_cache = {}  # (module, qualname, code hash) -> schema
+_plan_cache = {}  # function -> coercion plan
+_cache_lock = threading.Lock()
+
+
 def is_optional(annotation):
     # Check if the annotation is a Union
-    if getattr(annotation, "__origin__", None) is typing.Union:
+    if get_origin(annotation) in UNION_TYPES:
         # Check if None is one of the options in the Union
-        return type(None) in annotation.__args__
+        return type(None) in get_args(annotation)
     return False
 
 
 def optional_length(annotation):
     if is_optional(annotation):
         # Subtract 1 to account for NoneType
-        return len(annotation.__args__) - 1
+        return len(get_args(annotation)) - 1
     else:
         raise ValueError("The annotation is not an Optional type")
 
 
+def literal_type(values):
+    """JSON schema type shared by all enum/Literal values, None if they are mixed"""
+    kinds = {TYPE_MAP.get(type(v)) for v in values}
+    return kinds.pop() if len(kinds) == 1 else None
+
+
+def inline_refs(schema, defs, depth=0):
+    """Replace pydantic's "$ref": "#/$defs/X" with the definitions, so the schema can be nested anywhere"""
+    if depth > 32:
+        raise ValueError("Recursive pydantic models are not supported in tool parameters")
+    if isinstance(schema, dict):
+        ref = schema.get("$ref")
+        if isinstance(ref, str) and ref.startswith("#/$defs/"):
+            resolved = inline_refs(defs[ref[len("#/$defs/"):]], defs, depth + 1)
+            extra = {k: inline_refs(v, defs, depth) for k, v in schema.items() if k != "$ref"}
+            return {**resolved, **extra}
+        return {k: inline_refs(v, defs, depth) for k, v in schema.items() if k != "$defs"}
+    if isinstance(schema, list):
+        return [inline_refs(v, defs, depth) for v in schema]
+    return schema
+
+
+def pydantic_model_schema(model):
+    """Self-contained JSON schema of a pydantic model, with field descriptions taken from its docstring"""
+    schema = model.model_json_schema()
+    schema = inline_refs(schema, schema.get("$defs", {}))
+    docstring = parse(model.__doc__ or "")
+    for param in docstring.params:
+        prop = schema.get("properties", {}).get(param.arg_name)
+        if prop is not None and param.description and "description" not in prop:
+            prop["description"] = param.description
+    return schema
+
+
+def type_to_json_schema(py_type) -> dict:
+    """
+    Maps a Python type annotation to a JSON schema.
+    Handles Optional/Union, Literal, Enum, list/tuple/set, dict, Any and pydantic models, nested.
+    """
+    if py_type is typing.Any:
+        return {}
+
+    if py_type in TYPE_MAP:
+        return {"type": TYPE_MAP[py_type]}
+
+    origin = get_origin(py_type)
+    args = get_args(py_type)
+
+    if origin in UNION_TYPES:
+        members = [a for a in args if a is not type(None)]
+        if len(members) == 1:
+            # Optional[X] is described as X, leaving the parameter out of the call means None
+            return type_to_json_schema(members[0])
+        return {"anyOf": [type_to_json_schema(a) for a in members]}
+
+    if origin is typing.Literal:
+        schema = {"enum": list(args)}
+        if (kind := literal_type(args)) is not None:
+            schema["type"] = kind
+        return schema
+
+    if inspect.isclass(py_type) and issubclass(py_type, enum.Enum):
+        values = [m.value for m in py_type]
+        schema = {"enum": values}
+        if (kind := literal_type(values)) is not None:
+            schema["type"] = kind
+        return schema
+
+    if inspect.isclass(py_type) and issubclass(py_type, BaseModel):
+        return pydantic_model_schema(py_type)
+
+    if py_type in (list, tuple, set, frozenset) or origin in (list, tuple, set, frozenset):
+        schema = {"type": "array"}
+        if origin is tuple and args and args[-1] is not Ellipsis:
+            # draft-07 tuple form, construct_json_schema declares draft-07 so prefixItems would be ignored
+            schema["items"] = [type_to_json_schema(a) for a in args]
+            schema["additionalItems"] = False
+            schema["minItems"] = schema["maxItems"] = len(args)
+        elif args:
+            schema["items"] = type_to_json_schema(args[0])
+        if py_type in (set, frozenset) or origin in (set, frozenset):
+            schema["uniqueItems"] = True
+        return schema
+
+    if py_type is dict or origin is dict:
+        schema = {"type": "object"}
+        if args:
+            if args[0] is not str:
+                raise ValueError(f"Only str keys can be represented in JSON objects, got {py_type}")
+            schema["additionalProperties"] = type_to_json_schema(args[1])
+        return schema
+
+    raise ValueError(f"Python type {py_type} has no corresponding JSON schema type")
+
+
 def type_to_json_schema_type(py_type):
     """
     Maps a Python type to a JSON schema type.
     Specifically handles typing.Optional and common Python types.
     """
-    # if get_origin(py_type) is typing.Optional:
     if is_optional(py_type):
         # Assert that Optional has only one type argument
-        type_args = get_args(py_type)
         assert optional_length(py_type) == 1, f"Optional type must have exactly one type argument, but got {py_type}"
 
-        # Extract and map the inner type
-        return type_to_json_schema_type(type_args[0])
-
-    # Mapping of Python types to JSON schema types
-    type_map = {
-        int: "integer",
-        str: "string",
-        bool: "boolean",
-        float: "number",
-        list[str]: "array",
-        # Add more mappings as needed
-    }
-    if py_type not in type_map:
-        raise ValueError(f"Python type {py_type} has no corresponding JSON schema type")
-
-    return type_map.get(py_type, "string")  # Default to "string" if type not in map
+    return type_to_json_schema(py_type).get("type", "string")
 
 
 def pydantic_model_to_open_ai(model):
     schema = model.model_json_schema()
     docstring = parse(model.__doc__ or "")
-    parameters = {k: v for k, v in schema.items() if k not in ("title", "description")}
-    for param in docstring.params:
-        if (name := param.arg_name) in parameters["properties"] and (description := param.description):
-            if "description" not in parameters["properties"][name]:
-                parameters["properties"][name]["description"] = description
+    parameters = {k: v for k, v in pydantic_model_schema(model).items() if k not in ("title", "description")}
 
     parameters["required"] = sorted(k for k, v in parameters["properties"].items() if "default" not in v)
 
@@ -74,7 +169,30 @@ def pydantic_model_to_open_ai(model):
     }
 
 
+def code_hash(function) -> str:
+    """Hash of everything the schema of a function depends on: code, docstring, annotations, defaults"""
+    h = hashlib.sha1(marshal.dumps(function.__code__))
+    h.update(repr((function.__doc__, function.__annotations__, function.__defaults__, function.__kwdefaults__)).encode("utf-8"))
+    return h.hexdigest()
+
+
 def generate_schema(function):
+    """
+    JSON schema of a tool function from its signature and docstring.
+    Memoized by qualname and code hash, so re-registering unchanged functions is a dict lookup.
+    """
+    key = (function.__module__, function.__qualname__, code_hash(function))
+    with _cache_lock:
+        schema = _schema_cache.get(key)
+    if schema is None:
+        schema = _generate_schema(function)
+        with _cache_lock:
+            _schema_cache[key] = schema
+            _plan_cache[function] = _generate_coercion_plan(function)
+    return copy.deepcopy(schema)
+
+
+def _generate_schema(function):
     # Get the signature of the function
     sig = inspect.signature(function)
 
@@ -104,24 +222,80 @@ def generate_schema(function):
         if not param_doc or not param_doc.description:
             raise ValueError(f"Parameter '{param.name}' in function '{function.__name__}' lacks a description in the docstring")
 
-        if inspect.isclass(param.annotation) and issubclass(param.annotation, BaseModel):
-            schema["parameters"]["properties"][param.name] = pydantic_model_to_open_ai(param.annotation)
-        else:
-            # Add parameter details to the schema
-            param_doc = next((d for d in docstring.params if d.arg_name == param.name), None)
-            schema["parameters"]["properties"][param.name] = {
-                # "type": "string" if param.annotation == str else str(param.annotation),
-                "type": type_to_json_schema_type(param.annotation) if param.annotation != inspect.Parameter.empty else "string",
-                "description": param_doc.description,
-            }
+        prop = type_to_json_schema(param.annotation)
+        prop.pop("title", None)
+        prop["description"] = param_doc.description
+        schema["parameters"]["properties"][param.name] = prop
+
         if param.default == inspect.Parameter.empty:
             schema["parameters"]["required"].append(param.name)
 
-        if get_origin(param.annotation) is list:
-            if get_args(param.annotation)[0] is str:
-                schema["parameters"]["properties"][param.name]["items"] = {"type": "string"}
+    return schema
 
-        if param.annotation == inspect.Parameter.empty:
-            schema["parameters"]["required"].append(param.name)
 
-    return schema
+def type_converter(py_type):
+    """Function converting a validated JSON value to py_type, None if the JSON value can be used as is"""
+    origin = get_origin(py_type)
+    args = get_args(py_type)
+
+    if origin in UNION_TYPES:
+        members = [a for a in args if a is not type(None)]
+        convert = type_converter(members[0]) if len(members) == 1 else None
+        if convert is None:
+            return None
+        return lambda v: None if v is None else convert(v)
+
+    if inspect.isclass(py_type) and issubclass(py_type, BaseModel):
+        return py_type.model_validate
+
+    if inspect.isclass(py_type) and issubclass(py_type, enum.Enum):
+        return py_type
+
+    if origin in (list, tuple, set, frozenset) or py_type in (tuple, set, frozenset):
+        container = origin or py_type
+        if origin is tuple and args and args[-1] is not Ellipsis:
+            converters = [type_converter(a) or (lambda x: x) for a in args]
+            return lambda v: tuple(c(x) for c, x in zip(converters, v))
+        convert = type_converter(args[0]) if args else None
+        if convert is None:
+            return None if container is list else container
+        return lambda v: container(convert(x) for x in v)
+
+    if origin is dict and args:
+        convert = type_converter(args[1])
+        if convert is None:
+            return None
+        return lambda v: {k: convert(x) for k, x in v.items()}
+
+    return None
+
+
+def _generate_coercion_plan(function):
+    plan = {}
+    for param in inspect.signature(function).parameters.values():
+        if param.name == "self" or param.annotation == inspect.Parameter.empty:
+            continue
+        convert = type_converter(param.annotation)
+        if convert is not None:
+            plan[param.name] = convert
+    return plan
+
+
+def coercion_plan(function) -> dict:
+    """
+    Precomputed {param name: converter} turning validated JSON arguments into the annotated Python types
+    (pydantic models, enums, tuples...). Parameters whose JSON value is usable as is are left out.
+    """
+    plan = _plan_cache.get(function)
+    if plan is None:
+        plan = _generate_coercion_plan(function)
+        with _cache_lock:
+            _plan_cache[function] = plan
+    return plan
+
+
+def coerce_args(function, args: dict) -> dict:
+    plan = coercion_plan(function)
+    if not plan:
+        return args
+    return {k: plan[k](v) if k in plan and v is not None else v for k, v in args.items()}
@@ -0,0 +1,296 @@
+import hashlib
+import os
+import pickle
+import re
+import threading
+from collections import deque
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # python < 3.11
+    import sre_parse
+
+from sqlite_cache import CACHE_DIR
+
+SKIP_DIRS = {".git", ".hg", ".svn", "node_modules", "__pycache__", ".venv", "venv", ".mypy_cache", ".pytest_cache", ".tox"}
+MAX_FILE_BYTES = int(os.environ.get("MEMGPT_SEARCH_MAX_FILE_BYTES", str(2 * 1024 * 1024)))
+MAX_LINE_CHARS = 300
+INDEX_VERSION = 2
+
+
+def trigrams(text: str):
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def required_literals(pattern: str, flags=0):
+    """
+    Literal strings every match of a regex must contain, from runs of plain characters at the top
+    level of the pattern. Returns [] when nothing is certain (alternations, only classes, etc).
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return []
+
+    literals = []
+    run = []
+    for op, arg in parsed:
+        if op is sre_parse.LITERAL:
+            run.append(chr(arg))
+            continue
+        if op is sre_parse.BRANCH:
+            return []
+        if op is not sre_parse.AT and run:
+            literals.append("".join(run))
+            run = []
+    if run:
+        literals.append("".join(run))
+    return [lit.lower() for lit in literals if len(lit) >= 3]
+
+
+def is_text(data: bytes) -> bool:
+    return b"\0" not in data[:8192]
+
+
+class TrigramIndex:
+    """
+    Incremental trigram index of the text files under a directory, persisted in MEMGPT_CACHE_DIR.
+
+    refresh() stats every file and re-reads only the ones whose mtime or size changed, so
+    repeated searches over a large tree cost a directory walk plus the candidate files. Trigrams
+    are lowercased, so one index serves case sensitive and insensitive queries. Text files over
+    MAX_FILE_BYTES are not indexed but are a candidate of every search.
+    """
+
+    def __init__(self, root, index_path=None):
+        self.root = os.path.abspath(root)
+        if index_path is None:
+            name = hashlib.sha1(self.root.encode("utf-8")).hexdigest()
+            index_path = os.path.join(CACHE_DIR, "search", f"{name}.pickle")
+        self.index_path = index_path
+        self.files = {}  # relpath -> (mtime_ns, size, frozenset of trigrams, None for large text files)
+        self.postings = {}  # trigram -> set of relpaths
+        self.large = set()  # relpaths of text files too large to index, always scanned
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, "rb") as f:
+                version, root, files = pickle.load(f)
+        except Exception:
+            return
+        if version != INDEX_VERSION or root != self.root:
+            return
+        self.files = files
+        for relpath, (_, _, grams) in files.items():
+            if grams is None:
+                self.large.add(relpath)
+                continue
+            for g in grams:
+                self.postings.setdefault(g, set()).add(relpath)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump((INDEX_VERSION, self.root, self.files), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.index_path)
+
+    def _remove(self, relpath):
+        _, _, grams = self.files.pop(relpath)
+        if grams is None:
+            self.large.discard(relpath)
+            return
+        for g in grams:
+            s = self.postings.get(g)
+            if s is not None:
+                s.discard(relpath)
+                if not s:
+                    del self.postings[g]
+
+    def _add(self, relpath, mtime, size):
+        try:
+            with open(os.path.join(self.root, relpath), "rb") as f:
+                data = f.read(MAX_FILE_BYTES + 1)
+        except OSError:
+            return
+        if not is_text(data):
+            grams = frozenset()
+        elif len(data) > MAX_FILE_BYTES:
+            grams = None
+            self.large.add(relpath)
+        else:
+            grams = frozenset(trigrams(data.decode("utf-8", errors="replace").lower()))
+        self.files[relpath] = (mtime, size, grams)
+        for g in grams or ():
+            self.postings.setdefault(g, set()).add(relpath)
+
+    def refresh(self, subpath=None):
+        """Update the index for the files under root, or only under its subdirectory subpath"""
+        top = os.path.join(self.root, subpath) if subpath else self.root
+        prefix = subpath.rstrip(os.sep) + os.sep if subpath else ""
+        with self.lock:
+            seen = set()
+            changed = False
+            for dirpath, dirnames, filenames in os.walk(top):
+                dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+                for name in filenames:
+                    full = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(full)
+                    except OSError:
+                        continue
+                    relpath = os.path.relpath(full, self.root)
+                    seen.add(relpath)
+                    old = self.files.get(relpath)
+                    if old is not None and old[0] == st.st_mtime_ns and old[1] == st.st_size:
+                        continue
+                    if old is not None:
+                        self._remove(relpath)
+                    self._add(relpath, st.st_mtime_ns, st.st_size)
+                    changed = True
+
+            for relpath in [p for p in self.files if p.startswith(prefix) and p not in seen]:
+                self._remove(relpath)
+                changed = True
+
+            if changed:
+                self._save()
+
+    def candidates(self, literals, subpath=None):
+        """Indexed text files that may contain all the literals, optionally under a subdirectory"""
+        with self.lock:
+            grams = {g for lit in literals for g in trigrams(lit)}
+            if grams:
+                paths = None
+                for g in grams:
+                    s = self.postings.get(g, set())
+                    paths = set(s) if paths is None else paths & s
+                    if not paths:
+                        break
+                paths |= self.large
+            else:
+                paths = [p for p, (_, _, grams) in self.files.items() if grams or grams is None]
+
+        if subpath:
+            prefix = subpath.rstrip(os.sep) + os.sep
+            paths = [p for p in paths if p == subpath or p.startswith(prefix)]
+        return sorted(paths)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(root) -> TrigramIndex:
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        if root not in _indexes:
+            _indexes[root] = TrigramIndex(root)
+        return _indexes[root]
+
+
+def compile_pattern(pattern: str, ignore_case: bool):
+    flags = re.IGNORECASE if ignore_case else 0
+    try:
+        return re.compile(pattern, flags), required_literals(pattern, flags)
+    except re.error:
+        # not a valid regex, search for it literally
+        return re.compile(re.escape(pattern), flags), required_literals(re.escape(pattern), flags)
+
+
+def search_file(full_path, regex, context_lines=0, max_hits=None):
+    """
+    Stream a text file for lines matching regex, returns (lines, hits, count): the first max_hits
+    matching line indices, {index: (text, matched)} for them and their context lines, and the
+    total number of matching lines. Memory stays bounded whatever the size of the file.
+    """
+    lines = {}
+    hits = []
+    count = 0
+    before = deque(maxlen=context_lines)
+    after = 0
+    try:
+        with open(full_path, "r", encoding="utf-8", errors="replace") as f:
+            for i, line in enumerate(f):
+                line = line.rstrip("\n")
+                matched = regex.search(line) is not None
+                count += matched
+                if matched and (max_hits is None or len(hits) < max_hits):
+                    hits.append(i)
+                    lines.update(before)
+                    before.clear()
+                    lines[i] = (line[:MAX_LINE_CHARS], True)
+                    after = context_lines
+                elif after:
+                    lines[i] = (line[:MAX_LINE_CHARS], matched)
+                    after -= 1
+                elif context_lines:
+                    before.append((i, (line[:MAX_LINE_CHARS], matched)))
+    except OSError:
+        return {}, [], 0
+    return lines, hits, count
+
+
+def format_matches(relpath, lines, hits, context_lines, limit):
+    out = []
+    shown = set()
+    last = None
+    for i in hits[:limit]:
+        lo, hi = max(0, i - context_lines), i + context_lines + 1
+        if last is not None and lo > last + 1 and context_lines:
+            out.append("--")
+        for j in range(lo, hi):
+            if j in shown or j not in lines:
+                continue
+            shown.add(j)
+            text, matched = lines[j]
+            sep = ":" if matched else "-"
+            out.append(f"{relpath}{sep}{j + 1}{sep}{text}")
+        last = hi - 1
+    return out
+
+
+def search(root, pattern, subpath=None, ignore_case=True, context_lines=0, max_results=50) -> str:
+    """
+    Search text files under root for a regex, ranking files by number of matching lines.
+    Output is grep-like: `path:line:text` for matches and `path-line-text` for context lines.
+    """
+    regex, literals = compile_pattern(pattern, ignore_case)
+
+    target = os.path.join(root, subpath) if subpath else root
+    if os.path.isfile(target):
+        lines, hits, _ = search_file(target, regex, context_lines, max_results)
+        if not hits:
+            return "No matches found"
+        return "\n".join(format_matches(subpath, lines, hits, context_lines, max_results))
+
+    index = get_index(root)
+    subpath = os.path.normpath(subpath) if subpath else None
+    if subpath == os.curdir:
+        subpath = None
+    index.refresh(subpath)
+
+    results = []
+    for relpath in index.candidates(literals, subpath=subpath):
+        lines, hits, count = search_file(os.path.join(index.root, relpath), regex, context_lines, max_results)
+        if hits:
+            results.append((count, relpath, lines, hits))
+
+    if not results:
+        return "No matches found"
+
+    results.sort(key=lambda r: (-r[0], r[1]))
+    total = sum(r[0] for r in results)
+    out = []
+    remaining = max_results
+    for count, relpath, lines, hits in results:
+        if remaining <= 0:
+            break
+        out.extend(format_matches(relpath, lines, hits, context_lines, remaining))
+        remaining -= count
+
+    if total > max_results:
+        out.append(f"[{total} matching lines in {len(results)} files, showing the first {max_results}]")
+    return "\n".join(out)
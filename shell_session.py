@@ -0,0 +1,160 @@
+import base64
+import os
+import pty
+import select
+import signal
+import subprocess
+import termios
+import time
+import uuid
+import weakref
+
+from procrunner import HeadTailBuffer
+
+
+class ShellSessionError(Exception):
+    pass
+
+
+def _terminate(proc, fd):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    try:
+        os.close(fd)
+    except OSError:
+        pass
+    proc.wait()
+
+
+class ShellResult:
+    def __init__(self, returncode, output: HeadTailBuffer, cwd, elapsed):
+        self.returncode = returncode
+        self.output_buf = output
+        self.cwd = cwd
+        self.elapsed = elapsed
+
+    @property
+    def output(self) -> str:
+        return self.output_buf.getvalue()
+
+    def truncation_note(self) -> str:
+        buf = self.output_buf
+        return f"[output truncated - {buf.total} bytes, {buf.omitted} omitted from the middle]" if buf.truncated else ""
+
+
+class ShellSession:
+    """
+    Long-lived bash process on a PTY, keeping cwd, environment and activated virtualenvs between commands.
+
+    Each command is sent base64-encoded to `eval` followed by a sentinel line carrying its exit code
+    and the new working directory, so syntax errors or unbalanced quotes can't desync the framing.
+    stdout and stderr arrive interleaved, as on a terminal. The shell has no controlling terminal,
+    so a command that hits the timeout is stopped by killing the whole session; the next command
+    starts a fresh shell in the last known directory.
+    """
+
+    def __init__(self, cwd, env=None, max_bytes=64 * 1024):
+        self.cwd = cwd
+        self.env = env
+        self.max_bytes = max_bytes
+        self.proc = None
+        self.fd = None
+        self._finalizer = None
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self):
+        master, slave = pty.openpty()
+        attrs = termios.tcgetattr(slave)
+        attrs[1] &= ~termios.ONLCR  # keep \n as is
+        attrs[3] &= ~termios.ECHO  # don't echo the framing commands back
+        termios.tcsetattr(slave, termios.TCSANOW, attrs)
+
+        env = dict(self.env if self.env is not None else os.environ)
+        env.update(TERM="dumb", PS1="", PS2="", PROMPT_COMMAND="", HISTFILE="/dev/null")
+
+        self.proc = subprocess.Popen(
+            ["bash", "--noprofile", "--norc", "--noediting", "-i"],
+            stdin=slave,
+            stdout=slave,
+            stderr=slave,
+            cwd=self.cwd,
+            env=env,
+            start_new_session=True,
+        )
+        os.close(slave)
+        self.fd = master
+        self._finalizer = weakref.finalize(self, _terminate, self.proc, self.fd)
+
+        # swallow startup noise ("no job control" etc) up to the first sentinel
+        self.run("set +m +H", timeout=10)
+
+    def close(self):
+        if self._finalizer is not None:
+            self._finalizer()
+        self.proc = None
+        self.fd = None
+
+    def run(self, cmd: str, timeout=None) -> ShellResult:
+        if not self.alive:
+            self.close()
+            self.start()
+
+        start = time.monotonic()
+        token = uuid.uuid4().hex
+        marker = f"__PICO_{token}__".encode()
+        encoded = base64.b64encode(cmd.encode("utf-8")).decode("ascii")
+        line = (
+            f"eval \"$(printf '%s' '{encoded}' | base64 -d)\"; "
+            f"printf '\\n{marker.decode()} %d %s\\n' \"$?\" \"$PWD\"\n"
+        )
+        os.write(self.fd, line.encode("utf-8"))
+
+        buf = HeadTailBuffer(self.max_bytes)
+        pending = b""
+        deadline = start + timeout if timeout else None
+        while True:
+            wait = None if deadline is None else deadline - time.monotonic()
+            if wait is not None and wait <= 0:
+                partial = buf.getvalue() + pending.decode("utf-8", errors="replace")
+                self.close()
+                raise ShellSessionError(
+                    f"Command '{cmd}' timed out after {timeout}s, the shell session was killed and will be restarted, partial output:\n{partial}"
+                )
+
+            ready, _, _ = select.select([self.fd], [], [], wait)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError:
+                data = b""
+            if not data:
+                output = buf.getvalue() + pending.decode("utf-8", errors="replace")
+                self.close()
+                raise ShellSessionError(f"Shell session exited while running '{cmd}':\n{output}")
+
+            pending += data
+            idx = pending.find(b"\n" + marker)
+            end = pending.find(b"\n", idx + len(marker) + 1) if idx >= 0 else -1
+            if end >= 0:
+                buf.write(pending[:idx])
+                status = pending[idx + len(marker) + 1 : end].decode("utf-8", errors="replace")
+                returncode, _, cwd = status.lstrip().partition(" ")
+                self.cwd = cwd or self.cwd
+                return ShellResult(int(returncode), buf, self.cwd, time.monotonic() - start)
+
+            if idx >= 0:
+                # marker found but its status line is incomplete, keep all of it
+                buf.write(pending[:idx])
+                pending = pending[idx:]
+                continue
+            # keep enough bytes to match a marker split across reads
+            keep = len(marker) + 1
+            if len(pending) > keep:
+                buf.write(pending[:-keep])
+                pending = pending[-keep:]
@@ -0,0 +1,46 @@
+import copy
+import json
+
+
+class SpeculativeExecutor:
+    """
+    Runs read-only tool calls while the LLM response is still streaming.
+
+    on_call_ready is the ToolCallStreamMonitor hook: as soon as a call has its tool name and complete
+    params, a read-only tool is submitted to the pool. Only the read-only prefix of a multi-call
+    response is speculated, calls after a side-effecting one could observe state from before it ran.
+    Once the full response is parsed and validated, take() hands out the future for a call with the
+    same tool name and params. discard() drops whatever was not taken, which is harmless since the
+    speculated tools have no side effects.
+    """
+
+    def __init__(self, run_call, is_read_only, pool, passive=()):
+        self.run_call = run_call  # (tool_name, params) -> result
+        self.is_read_only = is_read_only
+        self.pool = pool
+        self.passive = frozenset(passive)  # calls that are not executed as tools, e.g. send_message
+        self.started = {}  # (tool_name, canonical params) -> Future
+        self.stopped = False  # a side-effecting call was seen in this response
+
+    @staticmethod
+    def key(tool_name, params):
+        return tool_name, json.dumps(params, sort_keys=True)
+
+    def on_call_ready(self, tool_name, params):
+        if self.stopped or tool_name in self.passive:
+            return
+        if not self.is_read_only(tool_name):
+            self.stopped = True
+            return
+        key = self.key(tool_name, params)
+        if key not in self.started:
+            self.started[key] = self.pool.submit(self.run_call, tool_name, copy.deepcopy(params))
+
+    def take(self, tool_name, params):
+        """Future of a speculated call identical to a validated one, None if it wasn't started"""
+        return self.started.pop(self.key(tool_name, params), None)
+
+    def discard(self):
+        for future in self.started.values():
+            future.cancel()  # calls already running finish in the background, their results are dropped
+        self.started.clear()
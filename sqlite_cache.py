@@ -0,0 +1,125 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+CACHE_DIR = os.environ.get("MEMGPT_CACHE_DIR", os.path.expanduser("~/.cache/picoagent"))
+
+
+class SqliteCache:
+    """
+    Persistent string key-value cache in a local SQLite file, safe to share between threads and processes.
+
+    Keys are hashed, so arbitrary strings (normalized urls, queries, prompts) can be used.
+    Entries older than `ttl` seconds are treated as missing, and once the stored values exceed
+    `max_bytes` the least recently used entries are evicted.
+    """
+
+    def __init__(self, path, ttl=None, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, size INTEGER, created REAL, accessed REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self.db.commit()
+
+    @staticmethod
+    def hash_key(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        h = self.hash_key(key)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT value, created FROM cache WHERE key = ?", (h,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                self.db.execute("DELETE FROM cache WHERE key = ?", (h,))
+                self.db.commit()
+                return None
+            self.db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, h))
+            self.db.commit()
+            return value
+
+    def set(self, key: str, value: str):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (self.hash_key(key), value, size, now, now),
+            )
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        if self.ttl is not None:
+            self.db.execute("DELETE FROM cache WHERE created < ?", (time.time() - self.ttl,))
+
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        to_free = total - self.max_bytes
+        victims = []
+        for key, size in self.db.execute("SELECT key, size FROM cache ORDER BY accessed"):
+            victims.append((key,))
+            to_free -= size
+            if to_free <= 0:
+                break
+        self.db.executemany("DELETE FROM cache WHERE key = ?", victims)
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM cache")
+            self.db.commit()
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a url for cache keys: lowercase scheme/host, no default port, fragment or utm_* params, sorted query"""
+    u = urllib.parse.urlsplit(url.strip())
+    scheme = u.scheme.lower()
+    host = (u.hostname or "").lower()
+    if u.port and not ((scheme == "http" and u.port == 80) or (scheme == "https" and u.port == 443)):
+        host = f"{host}:{u.port}"
+    query = sorted(
+        (k, v) for k, v in urllib.parse.parse_qsl(u.query, keep_blank_values=True) if not k.startswith("utm_")
+    )
+    return urllib.parse.urlunsplit((scheme, host, u.path or "/", urllib.parse.urlencode(query), ""))
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+_web_cache = None
+_web_cache_lock = threading.Lock()
+
+
+def get_web_cache():
+    """Shared cache of web tool results, None if disabled with MEMGPT_DISABLE_WEB_CACHE"""
+    global _web_cache
+    if os.environ.get("MEMGPT_DISABLE_WEB_CACHE"):
+        return None
+    with _web_cache_lock:
+        if _web_cache is None:
+            _web_cache = SqliteCache(
+                os.path.join(CACHE_DIR, "web.sqlite"),
+                ttl=float(os.environ.get("MEMGPT_WEB_CACHE_TTL", str(24 * 3600))),
+                max_bytes=int(os.environ.get("MEMGPT_WEB_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+            )
+        return _web_cache
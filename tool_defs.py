@@ -1,13 +1,36 @@
 import json
 import os
 import re
-import subprocess
+import shlex
 from typing import Optional
-from bs4 import BeautifulSoup
-import requests
 import urllib.parse
+from sqlite_cache import get_web_cache, normalize_url, normalize_query
+from procrunner import run_shell
+from shell_session import ShellSession, ShellSessionError
+import search_index
+from util import read_only
+
+# requests, bs4 and numpy are imported by the tools that use them, so loading the tool set stays cheap
 
 MEMGPT_WORKDIR = os.environ.get('MEMGPT_WORKDIR', os.path.expanduser('~'))
+SHELL_TIMEOUT = float(os.environ.get('MEMGPT_SHELL_TIMEOUT', '120'))
+SHELL_CPU_TIMEOUT = float(os.environ.get('MEMGPT_SHELL_CPU_TIMEOUT', '0')) or None
+SHELL_MAX_OUTPUT_BYTES = int(os.environ.get('MEMGPT_SHELL_MAX_OUTPUT_BYTES', str(64 * 1024)))
+SHELL_ONESHOT = bool(os.environ.get('MEMGPT_SHELL_ONESHOT'))  # spawn a new shell per command instead of a session
+
+
+def noexport_workdir(agent) -> str:
+    """Working directory of an agent session, MEMGPT_WORKDIR for calls made outside of an agent"""
+    return getattr(agent, "workdir", None) or MEMGPT_WORKDIR
+
+
+def noexport_shell_session(agent) -> ShellSession:
+    """Persistent shell of an agent session, started on first use"""
+    session = getattr(agent, "shell_session", None)
+    if session is None:
+        session = agent.shell_session = ShellSession(noexport_workdir(agent), max_bytes=SHELL_MAX_OUTPUT_BYTES)
+    return session
+
 JSON_LOADS_STRICT = True
 JSON_ENSURE_ASCII = True
 
@@ -26,7 +49,8 @@ def send_message(self, message: str) -> Optional[str]:
 
 def noexport_remove_high_entropy_strings(s):
     """
-    Remove high-entropy substrings from a string.
+    Remove high-entropy substrings (base64/hex/token blobs, line-number gutters) from a string,
+    see tool_output.strip_high_entropy.
 
     Args:
         s (str): The input string.
@@ -34,19 +58,11 @@ def noexport_remove_high_entropy_strings(s):
     Returns:
         str: The input string with high-entropy substrings removed.
     """
-    patterns = [
-        r"[a-zA-Z0-9+/]{20,}",  # base64-like strings
-        r"[0-9a-fA-F]{20,}",  # hex-encoded strings
-        r"[a-zA-Z0-9_-]{20,}",  # other high-entropy strings (e.g., tokens, hashes)
-        r'1\n([2-9]\n|1[0-9]\n|2[0-9]\n|3[0-9]\n|4[0-9]\n|5[0-9]\n|6[0-9]\n|7[0-9]\n|8[0-9]\n|9[0-9]\n|100\n)*'
-    ]
+    from tool_output import strip_high_entropy
 
+    return strip_high_entropy(s)
 
-    for pattern in patterns:
-        s = re.sub(pattern, "", s)
-
-    return s
-
+@read_only
 def browse_url(self, url: str) -> str:
     """
     Open url in web browser to extract the main content of a webpage.
@@ -57,59 +73,89 @@ def browse_url(self, url: str) -> str:
     Returns:
         str: The extracted url content string, or an error message if failed.
     """
+    from http_pool import http_get
+
+    cache = get_web_cache()
+    cache_key = f"browse_url:{normalize_url(url)}"
+    if cache is not None:
+        content = cache.get(cache_key)
+        if content is not None:
+            print(f"[HTTP] cache hit for {url}")
+            return content
+
     try:
         readability_url = f"https://r.jina.ai/{url}"
         print(f"[HTTP] launching GET request to {readability_url}")
-        response = requests.get(readability_url)
+        response = http_get(readability_url)
         if response.status_code == 200:
             content = response.text
             content = noexport_remove_high_entropy_strings(content)
+            if response.truncated:
+                content += "\n[SYSTEM ALERT - page too large, content truncated]"
+            if cache is not None:
+                cache.set(cache_key, content)
             return content
         else:
             return f"Failed to extract content: {response.status_code}"
     except Exception as e:
         return f"Error: {str(e)}"
 
-def read_from_text_file(self, filename: str, line_start: Optional[int] = 0, num_lines: Optional[int] = 1):
+@read_only
+def read_from_text_file(self, filename: str, line_start: Optional[int] = 1, num_lines: Optional[int] = 1, tail: Optional[bool] = False, byte_offset: Optional[int] = None, num_bytes: Optional[int] = None, max_chars: Optional[int] = None):
     """
     Read lines from a text file.
 
     Args:
         filename (str): The name of the file to read.
-        line_start (int): Line to start reading from.
+        line_start (Optional[int]): Line to start reading from, 1-based (defaults to 1).
         num_lines (Optional[int]): How many lines to read (defaults to 1).
+        tail (Optional[bool]): Read the last num_lines lines of the file instead, line_start is ignored.
+        byte_offset (Optional[int]): Read a byte range starting at this offset instead of lines.
+        num_bytes (Optional[int]): Length of the byte range read from byte_offset.
+        max_chars (Optional[int]): Maximum number of characters to return.
 
     Returns:
         str: Text read from the file
     """
-    max_chars = 500
+    from file_reader import READ_MAX_CHARS, READ_MAX_TOKENS, apply_budget, read_byte_range, read_lines, read_tail
+
     trunc_message = True
+    if max_chars is None:
+        max_chars = READ_MAX_CHARS
+    filename = os.path.join(noexport_workdir(self), os.path.expanduser(filename))
     if not os.path.exists(filename):
         raise FileNotFoundError(f"The file '{filename}' does not exist.")
 
-    if line_start < 1 or num_lines < 1:
-        raise ValueError("Both line_start and num_lines must be positive integers.")
-
-    lines = []
-    chars_read = 0
-    with open(filename, "r", encoding="utf-8") as file:
-        for current_line_number, line in enumerate(file, start=1):
-            if line_start <= current_line_number < line_start + num_lines:
-                chars_to_add = len(line)
-                if max_chars is not None and chars_read + chars_to_add > max_chars:
-                    # If adding this line exceeds MAX_CHARS, truncate the line if needed and stop reading further.
-                    excess_chars = (chars_read + chars_to_add) - max_chars
-                    lines.append(line[:-excess_chars].rstrip("\n"))
-                    if trunc_message:
-                        lines.append(f"[SYSTEM ALERT - max chars ({max_chars}) reached during file read]")
-                    break
-                else:
-                    lines.append(line.rstrip("\n"))
-                    chars_read += chars_to_add
-            if current_line_number >= line_start + num_lines - 1:
-                break
-
-    return "\n".join(lines)
+    notes = []
+    if byte_offset is not None:
+        if byte_offset < 0 or (num_bytes or 0) < 1:
+            raise ValueError("byte_offset must be non-negative and num_bytes a positive integer.")
+        data = read_byte_range(filename, byte_offset, byte_offset + num_bytes, max_chars=max_chars)
+        clamped = len(data) < min(num_bytes, max(0, os.path.getsize(filename) - byte_offset))
+        text = data.decode("utf-8", errors="replace")
+    else:
+        if line_start is None:
+            line_start = 1
+        if num_lines is None:
+            num_lines = 1
+        if line_start < 1 or num_lines < 1:
+            raise ValueError("Both line_start and num_lines must be positive integers.")
+        if tail:
+            text, first, index, clamped = read_tail(filename, num_lines, max_chars=max_chars)
+            notes.append(f"[lines {first}-{index.num_lines} of {index.num_lines}]")
+        else:
+            text, _, clamped = read_lines(filename, line_start, num_lines, max_chars=max_chars)
+        if text.endswith("\n"):
+            text = text[:-1]
+    if clamped:
+        notes.append(f"[requested range is longer than max_chars ({max_chars}), only its start was read]")
+
+    text, budget_hit = apply_budget(text, max_chars=max_chars, max_tokens=READ_MAX_TOKENS, model=(getattr(self, "llm_api_kwargs", None) or {}).get("model"))
+    if budget_hit and trunc_message:
+        text += f"\n[SYSTEM ALERT - {budget_hit} reached during file read]"
+    for note in notes:
+        text += "\n" + note
+    return text
 
 
 def append_to_text_file(self, filename: str, content: str):
@@ -123,6 +169,7 @@ def append_to_text_file(self, filename: str, content: str):
     Returns:
         Optional[str]: None is always returned as this function does not produce a response.
     """
+    filename = os.path.join(noexport_workdir(self), os.path.expanduser(filename))
     if not os.path.exists(filename):
         raise FileNotFoundError(f"The file '{filename}' does not exist.")
 
@@ -142,13 +189,15 @@ def raw_http_request(self, method: str, url: str, payload_json: Optional[str] =
     Returns:
         dict: The response from the HTTP request.
     """
+    from http_pool import http_get, http_request
+
     try:
         headers = {"Content-Type": "application/json"}
 
         # For GET requests, ignore the payload
         if method.upper() == "GET":
             print(f"[HTTP] launching GET request to {url}")
-            response = requests.get(url, headers=headers)
+            response = http_get(url, headers=headers)
         else:
             # Validate and convert the payload for other types of requests
             if payload_json:
@@ -156,13 +205,39 @@ def raw_http_request(self, method: str, url: str, payload_json: Optional[str] =
             else:
                 payload = {}
             print(f"[HTTP] launching {method} request to {url}, payload=\n{json.dumps(payload, indent=2, ensure_ascii=JSON_ENSURE_ASCII)}")
-            response = requests.request(method, url, json=payload, headers=headers)
+            response = http_request(method, url, json=payload, headers=headers)
 
-        return {"status_code": response.status_code, "headers": dict(response.headers), "body": response.text}
+        ret = {"status_code": response.status_code, "headers": response.headers, "body": response.text}
+        if response.truncated:
+            ret["truncated"] = True
+        return ret
     except Exception as e:
         return {"error": str(e)}
 
 
+@read_only
+def fetch_tool_output(self, ref: str, offset: Optional[int] = 0, max_chars: Optional[int] = 4000) -> str:
+    """
+    Read the full output of an earlier tool call that was shortened before it was shown to you.
+
+    Args:
+        ref (str): Reference id from the shortened output, e.g. "out-3f2a9c1b7d4e".
+        offset (Optional[int]): Character offset in the full output to start reading from.
+        max_chars (Optional[int]): Maximum number of characters to return, clamped to 8000.
+
+    Returns:
+        str: The requested part of the full output.
+    """
+    from tool_output import FETCH_MAX_CHARS, load_output
+
+    text = load_output(ref)
+    if text is None:
+        raise KeyError(f"No stored tool output with ref {ref!r}")
+    offset = max(0, offset or 0)
+    end = min(len(text), offset + min(max_chars or 4000, FETCH_MAX_CHARS))
+    return f"{text[offset:end]}\n[chars {offset}-{end} of {len(text)}]"
+
+
 def change_directory(self, path: str):
     """
     Change the current working directory.
@@ -174,9 +249,19 @@ def change_directory(self, path: str):
         str: The new current working directory.
     """
     global MEMGPT_WORKDIR
-    MEMGPT_WORKDIR = os.path.abspath(os.path.join(MEMGPT_WORKDIR, path))
-    os.chdir(MEMGPT_WORKDIR)
-    return MEMGPT_WORKDIR
+    workdir = os.path.abspath(os.path.join(noexport_workdir(self), path))
+    if not os.path.isdir(workdir):
+        raise FileNotFoundError(f"The directory '{workdir}' does not exist.")
+
+    if self is None:
+        MEMGPT_WORKDIR = workdir
+        return workdir
+
+    self.workdir = workdir
+    session = getattr(self, "shell_session", None)
+    if session is not None and session.alive:
+        session.run(f"cd {shlex.quote(workdir)}", timeout=SHELL_TIMEOUT)
+    return workdir
 
 
 # def list_directory(self, path: str = '.', recursive: bool = False):
@@ -217,30 +302,37 @@ def change_directory(self, path: str):
 #             result.append(os.path.relpath(entry_path, MEMGPT_WORKDIR))
 #     return '\n'.join(result)
 
-def grep(self, pattern: str, path: Optional[str] = None, ignore_case: Optional[bool] = True):
+@read_only
+def grep(self, pattern: str, path: Optional[str] = None, ignore_case: Optional[bool] = True, context_lines: Optional[int] = 0, max_results: Optional[int] = 50):
     """
-    Search for a pattern in files using the system grep command.
+    Search for a regex pattern in text files, files with the most matching lines first.
 
     Args:
-        pattern (str): The pattern to search for.
+        pattern (str): The regex pattern to search for, searched literally if it is not a valid regex.
         path (Optional[str]): The file or directory path to search in. Defaults to the current working directory.
         ignore_case (bool): Ignore case when searchning. Default true.
+        context_lines (Optional[int]): Number of lines to show before and after each match. Default 0.
+        max_results (Optional[int]): Maximum number of matching lines to return. Default 50.
 
     Returns:
-        str: The output of the grep command.
+        str: Matches as `path:line:text`, context lines as `path-line-text`.
     """
-    if path is None:
-        path = MEMGPT_WORKDIR
-
-    command = ['grep', '-n']
-    if ignore_case:
-        command += '-i'
-    command += [pattern]
-    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, cwd=MEMGPT_WORKDIR)
-    if process.returncode == 0:
-        return process.stdout
+    workdir = noexport_workdir(self)
+    target = os.path.normpath(os.path.join(workdir, os.path.expanduser(path or '.')))
+    if not os.path.exists(target):
+        return f"Error: path '{path}' does not exist"
+
+    # directories inside the workdir share its index
+    subpath = os.path.relpath(target, workdir)
+    if subpath == '.':
+        root, subpath = workdir, None
+    elif subpath.startswith('..'):
+        root, subpath = os.path.split(target) if os.path.isfile(target) else (target, None)
     else:
-        return process.stderr
+        root = workdir
+
+    return search_index.search(root, pattern, subpath=subpath, ignore_case=bool(ignore_case),
+                               context_lines=max(0, context_lines or 0), max_results=max(1, max_results or 50))
 
 
 # def file_search(self, pattern: str, files: Optional[List[str]] = None):
@@ -333,14 +425,35 @@ def exec_shell_cmd(self, cmd: str) -> str:
         raise RuntimeError(f"Command '{cmd}' is potentially destructive and forbidden for safety reasons.<%%!!>Use MEMGPT_DISABLE_SAFECMD=true to disable safety checks.</%%!!>")
    
 
-    process = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, cwd=MEMGPT_WORKDIR)
+    if self is not None and not SHELL_ONESHOT:
+        try:
+            result = noexport_shell_session(self).run(cmd, timeout=SHELL_TIMEOUT)
+        except ShellSessionError as e:
+            raise RuntimeError(str(e))
+        self.workdir = result.cwd
+        note = result.truncation_note()
+        if result.returncode != 0:
+            raise RuntimeError(f"Command '{cmd}' failed with return code {result.returncode}: {result.output}\n{note}")
+        return f"{cmd} returned {result.returncode}\n{result.output}" + (f"\n{note}" if note else "")
+
+    process = run_shell(
+        cmd,
+        cwd=noexport_workdir(self),
+        timeout=SHELL_TIMEOUT,
+        cpu_timeout=SHELL_CPU_TIMEOUT,
+        max_bytes=SHELL_MAX_OUTPUT_BYTES,
+    )
+    note = process.truncation_note()
+    if process.timed_out:
+        raise RuntimeError(f"Command '{cmd}' timed out after {SHELL_TIMEOUT}s and was killed, partial output:\n{process.stdout}\n{process.stderr}\n{note}")
     if process.returncode != 0:
-        raise RuntimeError(f"Command '{cmd}' failed with return code {process.returncode}: {process.stderr}")
-    
-    return f"{cmd} returned {process.returncode}\n{process.stdout}"
+        raise RuntimeError(f"Command '{cmd}' failed with return code {process.returncode}: {process.stderr}\n{note}")
 
+    return f"{cmd} returned {process.returncode}\n{process.stdout}" + (f"\n{note}" if note else "")
 
 
+
+@read_only
 def google_search(self, query: str):
     """
     Performs a web search using Google and returns a list of results.
@@ -354,6 +467,16 @@ def google_search(self, query: str):
             - title (str): The title of the result.
             - text (str): A text snippet from the result.
     """
+    from bs4 import BeautifulSoup
+    from http_pool import http_post
+
+    cache = get_web_cache()
+    cache_key = f"google_search:{normalize_query(query)}"
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print(f"[HTTP] cache hit for search {query!r}")
+            return json.loads(cached)
 
     url = "https://html.duckduckgo.com/lite/"
     payload = {"q": query}
@@ -367,7 +490,7 @@ def google_search(self, query: str):
             "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Safari/605.1.15",
         ),
     }
-    response = requests.post(
+    response = http_post(
         url, data=urllib.parse.urlencode(payload).encode("utf-8"), headers=headers
     )
 
@@ -396,4 +519,7 @@ def google_search(self, query: str):
             i += 1
         return results
 
-    return parse_results(response.text)
+    results = parse_results(response.text)
+    if cache is not None and results:
+        cache.set(cache_key, json.dumps(results))
+    return results
@@ -0,0 +1,408 @@
+import functools
+import hashlib
+import heapq
+import html
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+import fastjson
+from sqlite_cache import CACHE_DIR, SqliteCache
+
+# settings of the output pipeline, see process_tool_output
+DEFAULT_PIPELINE = dict(
+    boilerplate=False,  # strip HTML tags/scripts/navigation and markdown images/link targets
+    entropy=False,  # strip base64/hex/token blobs and line-number runs, or a dict of strip_high_entropy kwargs
+    dedup=True,  # drop repeated lines
+    max_tokens=2000,  # head/tail truncation budget, None to keep everything
+    head_ratio=0.7,  # share of the budget kept from the start, the rest from the end
+    summarize=False,  # replace the truncated middle with its most informative sentences
+    summary_sentences=6,
+)
+
+# per tool overrides of DEFAULT_PIPELINE, None disables the pipeline for a tool
+TOOL_PIPELINES = {
+    "send_message": None,
+    "fetch_tool_output": None,  # already a bounded slice of a stored output
+    "read_from_text_file": None,  # has its own char and token budget
+    "browse_url": dict(boilerplate=True, max_tokens=3000, summarize=True),
+    "raw_http_request": dict(boilerplate=True, entropy=True, max_tokens=1500),
+    "exec_shell_cmd": dict(head_ratio=0.3),  # errors and results tend to be at the end
+    "google_search": dict(dedup=False),
+}
+
+MIN_PROCESS_CHARS = int(os.environ.get("MEMGPT_TOOL_OUTPUT_MIN_CHARS", "2000"))  # shorter outputs pass untouched
+# fetch_tool_output slices bypass the pipeline, so they get the default token budget at ~4 chars per token
+FETCH_MAX_CHARS = DEFAULT_PIPELINE["max_tokens"] * 4
+DEDUP_MIN_LINE_CHARS = 20  # shorter lines ("}", "PASSED") may legitimately repeat apart from each other
+
+
+def pipeline_for(tool_name, overrides={}):
+    """
+    Effective pipeline settings of a tool, None if its output is passed through as is. Precedence:
+    DEFAULT_PIPELINE, then overrides["*"], TOOL_PIPELINES[tool_name] and overrides[tool_name].
+    """
+    if overrides.get(tool_name, TOOL_PIPELINES.get(tool_name, {})) is None:
+        return None
+    return {
+        **DEFAULT_PIPELINE,
+        **overrides.get("*", {}),
+        **(TOOL_PIPELINES.get(tool_name) or {}),
+        **(overrides.get(tool_name) or {}),
+    }
+
+
+# boilerplate
+
+HTML_RE = re.compile(r"<(?:!doctype|html|head|body|div|p|span|script|table)\b", re.IGNORECASE)
+BOILERPLATE_TAGS = ("script", "style", "noscript", "svg", "nav", "footer", "header", "aside", "form", "iframe")
+MD_IMAGE_RE = re.compile(r"!\[[^\]\n]*\]\([^)\n]*\)")
+MD_LINK_RE = re.compile(r"\[([^\]\n]*)\]\([^)\n]*\)")
+LINK_ONLY_LINE_RE = re.compile(r"^[\s*+\-|>#•·]*$")
+BLANK_LINES_RE = re.compile(r"\n\s*\n(?:\s*\n)+")
+
+
+def strip_html(text: str) -> str:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(text, "html.parser")
+    for tag in soup(BOILERPLATE_TAGS):
+        tag.decompose()
+    return soup.get_text("\n")
+
+
+def strip_markdown_boilerplate(text: str) -> str:
+    """Drop images and link targets, and navigation lines made of nothing but short links"""
+    lines = []
+    for line in MD_IMAGE_RE.sub("", text).split("\n"):
+        stripped = MD_LINK_RE.sub(r"\1", line)
+        if stripped != line:
+            rest = MD_LINK_RE.sub("", line)
+            if LINK_ONLY_LINE_RE.match(rest) and len(stripped.strip()) < 40:
+                continue
+        lines.append(stripped)
+    return "\n".join(lines)
+
+
+def strip_boilerplate(text: str) -> str:
+    if HTML_RE.search(text, 0, 5000):
+        text = html.unescape(strip_html(text))
+    text = strip_markdown_boilerplate(text)
+    return BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+# high-entropy strings
+
+HEX_CHARS = frozenset("0123456789abcdefABCDEF")
+# dictionary-like pieces of identifiers: camelCase/snake_case words and delimited ALLCAPS words
+IDENT_WORD_RE = re.compile(r"[A-Z]?[a-z]{2,}|(?<![A-Za-z])[A-Z]{2,}(?![A-Za-z])")
+VOWELS = frozenset("aeiouyAEIOUY")
+
+ENTROPY_MIN_LEN = 20
+ENTROPY_MIN_BITS = 3.5  # bits per char, random base64 of 20+ chars scores above ~3.6
+ENTROPY_MIN_HEX_BITS = 3.0  # hex digests and uuids score ~3.5-3.9 of the 4 possible
+ENTROPY_RANDOM_BITS = 4.8  # above this even identifiers made of words are random, natural text stays below ~4.3
+ENTROPY_WORD_RATIO = 0.7  # tokens with this share of their letters in words are identifiers, random ones rarely reach it
+ENTROPY_MIN_LINE_RUN = 3
+
+
+@functools.lru_cache(maxsize=None)
+def entropy_scan_re(min_len, min_line_run):
+    """Candidate tokens (min_len+ chars of the base64/url-safe alphabet) and runs of lines holding only a number"""
+    return re.compile(
+        # the lookbehind starts matching only at the beginning of a run, which keeps the scan linear and fast
+        rf"(?<![A-Za-z0-9+/=_-])(?:(?P<token>[A-Za-z0-9+/=_-]{{{min_len},}})"
+        rf"|(?P<lines>(?:^[ \t]*\d{{1,6}}[ \t]*\n){{{min_line_run},}}))",
+        re.MULTILINE,
+    )
+
+
+def shannon_entropy(counts, n) -> float:
+    """Bits per character of a string of length n with the given character counts"""
+    return -sum(c / n * math.log2(c / n) for c in counts.values())
+
+
+def word_ratio(token: str, letters: int) -> float:
+    """Share of the letters of token that belong to word-like pieces containing a vowel"""
+    if not letters:
+        return 0.0
+    return sum(len(w) for w in IDENT_WORD_RE.findall(token) if not VOWELS.isdisjoint(w)) / letters
+
+
+def is_high_entropy(token, min_bits=ENTROPY_MIN_BITS, min_hex_bits=ENTROPY_MIN_HEX_BITS, max_word_ratio=ENTROPY_WORD_RATIO):
+    counts = Counter(token)
+    chars = counts.keys()
+    if HEX_CHARS.issuperset(chars) and any(c.isdigit() for c in chars):
+        return shannon_entropy(counts, len(token)) >= min_hex_bits
+    bits = shannon_entropy(counts, len(token))
+    if bits < min_bits:
+        return False
+    if bits >= ENTROPY_RANDOM_BITS:
+        return True
+    letters = sum(n for c, n in counts.items() if c.isalpha())
+    return word_ratio(token, letters) < max_word_ratio
+
+
+def drop_line_number_runs(run: str, min_run: int) -> str:
+    """Remove sequences of at least min_run consecutive numbers (code listing gutters) from lines of numbers"""
+    lines = run.splitlines(keepends=True)
+    out = []
+    start = 0
+    for i in range(1, len(lines) + 1):
+        if i < len(lines) and int(lines[i]) == int(lines[i - 1]) + 1:
+            continue
+        if i - start < min_run:
+            out.extend(lines[start:i])
+        start = i
+    return "".join(out)
+
+
+def strip_high_entropy(
+    text: str,
+    min_len=ENTROPY_MIN_LEN,
+    min_bits=ENTROPY_MIN_BITS,
+    min_hex_bits=ENTROPY_MIN_HEX_BITS,
+    max_word_ratio=ENTROPY_WORD_RATIO,
+    min_line_run=ENTROPY_MIN_LINE_RUN,
+) -> str:
+    """
+    Remove base64/hex/token blobs and line-number gutters in one pass over text. Candidate tokens
+    are scored by their Shannon entropy, long identifiers, paths and slugs made of words are kept.
+    """
+    out = []
+    pos = 0
+    verdicts = {}  # pages repeat their urls and ids
+    for m in entropy_scan_re(min_len, min_line_run).finditer(text):
+        token = m.group("token")
+        if token is not None:
+            drop = verdicts.get(token)
+            if drop is None:
+                drop = verdicts[token] = is_high_entropy(token, min_bits, min_hex_bits, max_word_ratio)
+            if not drop:
+                continue
+            replacement = ""
+        else:
+            replacement = drop_line_number_runs(m.group("lines"), min_line_run)
+        out.append(text[pos : m.start()])
+        out.append(replacement)
+        pos = m.end()
+    if not out:
+        return text
+    out.append(text[pos:])
+    return "".join(out)
+
+
+# dedup
+
+def dedup_lines(text: str, min_chars=DEDUP_MIN_LINE_CHARS) -> str:
+    """Collapse runs of identical lines and drop later copies of long lines seen before"""
+    seen = set()
+    out = []
+    prev = None
+    repeats = 0
+
+    def flush_repeats():
+        if repeats:
+            out.append(f"[previous line repeated {repeats} more times]")
+
+    for line in text.split("\n"):
+        key = line.strip()
+        if key and key == prev:
+            repeats += 1
+            continue
+        flush_repeats()
+        repeats = 0
+        prev = key
+        if len(key) >= min_chars:
+            if key in seen:
+                continue
+            seen.add(key)
+        out.append(line)
+    flush_repeats()
+    return "\n".join(out)
+
+
+# summarization
+
+SENTENCE_RE = re.compile(r"[^.!?\n]+(?:[.!?]+|\n|$)")
+WORD_RE = re.compile(r"[^\W\d_]{3,}")
+STOPWORDS = frozenset(
+    "the and for are but not you all any can had her was one our out has have his how its may new now "
+    "see two who did get him let say she too use that with this from they will would there their what "
+    "about which when make like time just know take into year your some could them than then look only "
+    "come over also back after work first well even want because these give most".split()
+)
+
+
+def summarize_extractive(text: str, max_sentences=6) -> str:
+    """The max_sentences sentences with the most frequent content words, in their original order"""
+    sentences = [s.strip() for s in SENTENCE_RE.findall(text)]
+    sentences = [s for s in sentences if len(s) > 30]
+    if len(sentences) <= max_sentences:
+        return " ".join(sentences)
+
+    words = [[w for w in WORD_RE.findall(s.lower()) if w not in STOPWORDS] for s in sentences]
+    freq = Counter(w for ws in words for w in set(ws))
+
+    def score(i):
+        ws = words[i]
+        return sum(freq[w] for w in set(ws)) / (1 + len(ws)) ** 0.5
+
+    best = sorted(heapq.nlargest(max_sentences, range(len(sentences)), key=score))
+    return " ".join(sentences[i] for i in best)
+
+
+# truncation
+
+def count_tokens(text, model=None) -> int:
+    from omnitokenizer import local_tokenize
+
+    return len(local_tokenize(text, model))
+
+
+def snap_to_newline(text, pos, forward, window=200):
+    """Move a cut position to a nearby line boundary"""
+    if forward:
+        j = text.find("\n", pos, pos + window)
+        return pos if j < 0 else j + 1
+    j = text.rfind("\n", max(0, pos - window), pos)
+    return pos if j < 0 else j + 1
+
+
+def truncate_middle(text, max_tokens, head_ratio=0.7, model=None, summarize=False, summary_sentences=6, ref=None):
+    """Keep the head and tail of text within max_tokens, returns (text, was_truncated)"""
+    n = count_tokens(text, model)
+    if n <= max_tokens:
+        return text, False
+
+    chars_per_token = len(text) / n
+    head = snap_to_newline(text, int(max_tokens * head_ratio * chars_per_token), forward=False)
+    tail = snap_to_newline(text, len(text) - int(max_tokens * (1 - head_ratio) * chars_per_token), forward=True)
+    tail = max(tail, head)
+    middle = text[head:tail]
+
+    where = f', full output: fetch_tool_output(ref="{ref}")' if ref else ""
+    note = f"\n[... {len(middle)} chars omitted{where} ...]\n"
+    if summarize:
+        summary = summarize_extractive(middle, summary_sentences)
+        if summary:
+            note = f"\n[... {len(middle)} chars omitted{where}, key sentences: {summary} ...]\n"
+    return text[:head] + note + text[tail:], True
+
+
+# out-of-band storage
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_output_store():
+    """Full outputs of shortened tool calls, by reference id"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SqliteCache(
+                os.path.join(CACHE_DIR, "tool_outputs.sqlite"),
+                ttl=float(os.environ.get("MEMGPT_TOOL_OUTPUT_TTL", str(7 * 24 * 3600))),
+                max_bytes=int(os.environ.get("MEMGPT_TOOL_OUTPUT_MAX_BYTES", str(256 * 1024 * 1024))),
+            )
+        return _store
+
+
+def output_ref(text: str) -> str:
+    return "out-" + hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+
+
+def store_output(text: str) -> str:
+    ref = output_ref(text)
+    get_output_store().set(ref, text)
+    return ref
+
+
+def load_output(ref: str):
+    return get_output_store().get(ref)
+
+
+# pipeline
+
+def process_text(text: str, settings, model=None, ref=None, max_tokens=None) -> str:
+    if settings["boilerplate"]:
+        text = strip_boilerplate(text)
+    if settings["entropy"]:
+        text = strip_high_entropy(text, **(settings["entropy"] if isinstance(settings["entropy"], dict) else {}))
+    if settings["dedup"]:
+        text = dedup_lines(text)
+    max_tokens = settings["max_tokens"] if max_tokens is None else max_tokens
+    if max_tokens is not None:
+        text, _ = truncate_middle(
+            text,
+            max_tokens,
+            head_ratio=settings["head_ratio"],
+            model=model,
+            summarize=settings["summarize"],
+            summary_sentences=settings["summary_sentences"],
+            ref=ref,
+        )
+    return text
+
+
+def string_leaves(obj):
+    if isinstance(obj, str):
+        yield obj
+    elif isinstance(obj, dict):
+        for v in obj.values():
+            yield from string_leaves(v)
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            yield from string_leaves(v)
+
+
+def process_tool_output(tool_name, ret, overrides={}, model=None):
+    """
+    Shrink a tool's output before it goes into the prompt: boilerplate stripping, high-entropy
+    string removal, line dedup and head/tail truncation to a token budget, as configured per tool in TOOL_PIPELINES (and
+    `overrides`, e.g. from the tool_output section of the config). When anything was cut, the
+    full output is stored and the result points to it for fetch_tool_output. Structured outputs
+    keep their shape, their long strings are processed with a share of the budget each.
+    """
+    settings = pipeline_for(tool_name, overrides)
+    if settings is None or ret is None:
+        return ret
+
+    full = ret if isinstance(ret, str) else fastjson.dumps(ret)
+    if len(full) < MIN_PROCESS_CHARS:
+        return ret
+    ref = output_ref(full)
+
+    if isinstance(ret, str):
+        processed = process_text(ret, settings, model=model, ref=ref)
+    else:
+        total = sum(len(s) for s in string_leaves(ret)) or 1
+        budget = settings["max_tokens"]
+
+        def walk(obj):
+            if isinstance(obj, str):
+                if len(obj) < MIN_PROCESS_CHARS // 4:
+                    return obj
+                share = None if budget is None else max(64, int(budget * len(obj) / total))
+                return process_text(obj, settings, model=model, ref=ref, max_tokens=share)
+            if isinstance(obj, dict):
+                return {k: walk(v) for k, v in obj.items()}
+            if isinstance(obj, (list, tuple)):
+                return [walk(v) for v in obj]
+            return obj
+
+        processed = walk(ret)
+
+    if processed == ret:
+        return ret
+
+    store_output(full)
+    note = f'[tool output shortened from {len(full)} chars, full output: fetch_tool_output(ref="{ref}")]'
+    if isinstance(processed, str):
+        return processed + "\n" + note
+    if isinstance(processed, dict):
+        return {**processed, "full_output_ref": ref}
+    return {"items": processed, "full_output_ref": ref}
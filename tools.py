@@ -1,14 +1,25 @@
+import hashlib
+import importlib
+import importlib.util
 import inspect
-from types import ModuleType
-from schema_generator import generate_schema
-import tool_defs
 import json
-from pygments import highlight
-from pygments.lexers import JsonLexer
-from pygments.formatters import TerminalFormatter
+import os
+from types import ModuleType
+from sqlite_cache import CACHE_DIR
 from util import printd
 
+SCHEMA_CACHE_DIR = os.path.join(CACHE_DIR, "tool_schemas")
+SCHEMA_CACHE_VERSION = 2
+
+# module name -> "hit" / "miss", reported by --profile-startup
+schema_cache_stats = {}
+
+
 def json_to_highlighted_str(json_data, strip=True):
+    from pygments import highlight
+    from pygments.lexers import JsonLexer
+    from pygments.formatters import TerminalFormatter
+
     json_str = json.dumps(json_data, indent=4)
     lexer = JsonLexer()
     formatter = TerminalFormatter()
@@ -19,6 +30,8 @@ def json_to_highlighted_str(json_data, strip=True):
 
 def load_function_set(module: ModuleType, ignore_by_prefixes=["noexport_"]) -> dict:
     """Load the functions and generate schema for them, given a module object"""
+    from schema_generator import generate_schema
+
     function_dict = {}
 
     for attr_name in dir(module):
@@ -43,14 +56,87 @@ def load_function_set(module: ModuleType, ignore_by_prefixes=["noexport_"]) -> d
             function_dict[attr_name] = {
                 "python_function": attr,
                 "json_schema": generated_schema,
+                "read_only": getattr(attr, "read_only", False),
             }
 
     if len(function_dict) == 0:
         raise ValueError(f"No functions found in module {module}")
-    
+
     return function_dict
 
+
+class LazyTool(dict):
+    """Tool entry with a cached json_schema, its python_function is imported on first access"""
+
+    def __init__(self, module_name, json_schema, read_only=False):
+        super().__init__(json_schema=json_schema, read_only=read_only)
+        self.module_name = module_name
+
+    def __missing__(self, key):
+        if key != "python_function":
+            raise KeyError(key)
+        printd(f"Importing tool module {self.module_name} for {self['json_schema']['name']}")
+        fn = getattr(importlib.import_module(self.module_name), self["json_schema"]["name"])
+        self[key] = fn
+        return fn
+
+
+def source_hash(module_name, ignore_by_prefixes) -> str:
+    """Hash of a module's source and of the schema generator, without importing either"""
+    h = hashlib.sha256(repr((SCHEMA_CACHE_VERSION, sorted(ignore_by_prefixes))).encode("utf-8"))
+    for name in (module_name, "schema_generator"):
+        spec = importlib.util.find_spec(name)
+        if spec is None or not spec.origin or not os.path.isfile(spec.origin):
+            raise ImportError(f"Cannot locate the source of module {name}")
+        with open(spec.origin, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def load_lazy_function_set(module_name: str, ignore_by_prefixes=["noexport_"]) -> dict:
+    """
+    Like load_function_set, but the schemas come from a disk cache keyed by the module's source hash
+    and the module itself is only imported when one of its tools is called. On a cache miss the module
+    is imported and the schemas generated once.
+    """
+    key = source_hash(module_name, ignore_by_prefixes)
+    cache_path = os.path.join(SCHEMA_CACHE_DIR, f"{module_name}.json")
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached["hash"] == key:
+            schema_cache_stats[module_name] = "hit"
+            read_only = set(cached["read_only"])
+            return {
+                name: LazyTool(module_name, schema, read_only=name in read_only)
+                for name, schema in cached["schemas"].items()
+            }
+    except (OSError, ValueError, KeyError):
+        pass
+
+    schema_cache_stats[module_name] = "miss"
+    function_dict = load_function_set(importlib.import_module(module_name), ignore_by_prefixes=ignore_by_prefixes)
+    try:
+        os.makedirs(SCHEMA_CACHE_DIR, exist_ok=True)
+        tmp = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                dict(
+                    hash=key,
+                    schemas={name: tool["json_schema"] for name, tool in function_dict.items()},
+                    read_only=[name for name, tool in function_dict.items() if tool["read_only"]],
+                ),
+                f,
+            )
+        os.replace(tmp, cache_path)
+    except OSError as e:
+        printd(f"Could not write tool schema cache {cache_path}: {e}")
+    return function_dict
+
+
 def load_fn_as_tool(fn):
+    from schema_generator import generate_schema
+
     # Check if it's a callable function and not a built-in or special method
     if inspect.isfunction(fn): # and attr.__module__ == module.__name__:
         # if attr_name in function_dict:
@@ -60,6 +146,7 @@ def load_fn_as_tool(fn):
         return {
             "python_function": fn,
             "json_schema": generated_schema,
+            "read_only": getattr(fn, "read_only", False),
         }
 
-available_tools = load_function_set(tool_defs)
\ No newline at end of file
+available_tools = load_lazy_function_set("tool_defs")
@@ -0,0 +1,357 @@
+import contextlib
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from bisect import bisect_left
+
+# innermost open span of the current thread / asyncio task
+_current_span = contextvars.ContextVar("picoagent_span", default=None)
+
+
+def current_span():
+    return _current_span.get()
+
+
+class Span:
+    """One timed operation: an agent turn, an LLM call attempt, a tool call"""
+
+    def __init__(self, tracer, name, parent=None, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.status = "ok"
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self._t0 = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add_event(self, name, **attributes):
+        self.events.append((time.time_ns(), name, attributes))
+
+    def fail(self, error):
+        self.status = "error"
+        self.error = str(error)
+
+    def end(self):
+        if self.end_ns is None:
+            self.duration = time.perf_counter() - self._t0
+            self.end_ns = self.start_ns + int(self.duration * 1e9)
+            self.tracer.on_end(self)
+
+    def to_dict(self) -> dict:
+        return dict(
+            name=self.name,
+            trace_id=self.trace_id,
+            span_id=self.span_id,
+            parent_id=self.parent_id,
+            start=self.start_ns / 1e9,
+            duration_ms=self.duration * 1000 if self.duration is not None else None,
+            status=self.status,
+            error=self.error,
+            attributes=self.attributes,
+            events=[dict(time=t / 1e9, name=name, attributes=attrs) for t, name, attrs in self.events],
+        )
+
+
+class NoopSpan:
+    trace_id = span_id = parent_id = None
+
+    def set(self, **attributes):
+        pass
+
+    def add_event(self, name, **attributes):
+        pass
+
+    def fail(self, error):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class JSONLExporter:
+    """One JSON object per finished span"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf-8")
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+
+def otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": value if isinstance(value, str) else json.dumps(value, default=str)}
+
+
+def otlp_attributes(attributes) -> list:
+    return [{"key": k, "value": otlp_value(v)} for k, v in attributes.items() if v is not None]
+
+
+class OTLPFileExporter:
+    """
+    OpenTelemetry spans in the OTLP/JSON encoding, one ExportTraceServiceRequest per line,
+    as read by the collector's otlpjsonfile receiver.
+    """
+
+    def __init__(self, path, service_name="picoagent"):
+        self.path = path
+        self.resource = {"attributes": otlp_attributes({"service.name": service_name})}
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf-8")
+
+    def export(self, span):
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": otlp_attributes(span.attributes),
+            "events": [
+                {"timeUnixNano": str(t), "name": name, "attributes": otlp_attributes(attrs)}
+                for t, name, attrs in span.events
+            ],
+            "status": {"code": 2, "message": span.error} if span.status == "error" else {"code": 1},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        request = {
+            "resourceSpans": [
+                {"resource": self.resource, "scopeSpans": [{"scope": {"name": "picoagent"}, "spans": [otlp_span]}]}
+            ]
+        }
+        line = json.dumps(request) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+
+def label_key(labels) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(key) -> str:
+    if not key:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in key)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(key, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}{format_labels(key)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.series = {}  # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = label_key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0] * (len(self.buckets) + 2)
+        i = bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                yield f"{self.name}_bucket{format_labels(key + (('le', repr(float(bound))),))} {cumulative}"
+            yield f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {series[-1]}"
+            yield f"{self.name}_sum{format_labels(key)} {series[-2]}"
+            yield f"{self.name}_count{format_labels(key)} {series[-1]}"
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = tuple(2**i for i in range(8, 22))
+
+
+class Metrics:
+    """Prometheus-style counters and histograms fed from finished spans"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.turns = Counter("picoagent_turns_total", "Agent turns (update calls)")
+        self.turn_seconds = Histogram("picoagent_turn_seconds", "Duration of agent turns", LATENCY_BUCKETS)
+        self.llm_attempts = Counter("picoagent_llm_attempts_total", "LLM call attempts by outcome")
+        self.llm_attempt_seconds = Histogram(
+            "picoagent_llm_attempt_seconds", "Duration of single LLM call attempts", LATENCY_BUCKETS
+        )
+        self.llm_retries = Counter("picoagent_llm_retries_total", "LLM calls repeated after an invalid output")
+        self.tool_calls = Counter("picoagent_tool_calls_total", "Tool calls by tool and status")
+        self.tool_seconds = Histogram("picoagent_tool_seconds", "Duration of tool calls", LATENCY_BUCKETS)
+        self.prompt_chars = Histogram("picoagent_prompt_chars", "Prompt size in characters", SIZE_BUCKETS)
+        self.prompt_tokens = Histogram("picoagent_prompt_tokens", "Prompt size in tokens", SIZE_BUCKETS)
+        self.all = [
+            self.turns,
+            self.turn_seconds,
+            self.llm_attempts,
+            self.llm_attempt_seconds,
+            self.llm_retries,
+            self.tool_calls,
+            self.tool_seconds,
+            self.prompt_chars,
+            self.prompt_tokens,
+        ]
+
+    def record(self, span):
+        a = span.attributes
+        with self.lock:
+            if span.name == "agent.turn":
+                self.turns.inc()
+                self.turn_seconds.observe(span.duration)
+            elif span.name == "llm.call":
+                if a.get("retries"):
+                    self.llm_retries.inc(a["retries"])
+                if a.get("prompt_chars") is not None:
+                    self.prompt_chars.observe(a["prompt_chars"])
+                if a.get("prompt_tokens") is not None:
+                    self.prompt_tokens.observe(a["prompt_tokens"])
+            elif span.name == "llm.attempt":
+                outcome = "error" if span.status == "error" else a.get("outcome", "unknown")
+                self.llm_attempts.inc(outcome=outcome)
+                self.llm_attempt_seconds.observe(span.duration, outcome=outcome)
+            elif span.name == "tool.call":
+                tool = a.get("tool", "unknown")
+                status = "error" if span.status == "error" or a.get("error") else "ok"
+                self.tool_calls.inc(tool=tool, status=status)
+                self.tool_seconds.observe(span.duration, tool=tool)
+
+    def render(self) -> str:
+        with self.lock:
+            return "\n".join(line for metric in self.all for line in metric.render()) + "\n"
+
+    def write(self, path):
+        """Atomically rewrite a file in the text exposition format, e.g. for node_exporter's textfile collector"""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """Expose /metrics over HTTP from a daemon thread"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="picoagent-metrics", daemon=True).start()
+        return server
+
+
+class Tracer:
+    """
+    Creates spans and hands finished ones to the exporters and metrics. A tracer without either is
+    disabled and only hands out a no-op span, so instrumented code costs next to nothing by default.
+    """
+
+    def __init__(self, exporters=(), metrics=None):
+        self.exporters = list(exporters)
+        self.metrics = metrics
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporters) or self.metrics is not None
+
+    @contextlib.contextmanager
+    def span(self, name, parent=None, **attributes):
+        """Span around a block, nested under `parent` or else the current span, ended with error status on exceptions"""
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+        span = Span(self, name, parent=parent or current_span(), attributes=attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def on_end(self, span):
+        for exporter in self.exporters:
+            exporter.export(span)
+        if self.metrics is not None:
+            self.metrics.record(span)
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def configure(trace_jsonl=None, trace_otlp=None, metrics=False) -> Tracer:
+    """Set up the process-wide tracer, returns it"""
+    global _tracer
+    exporters = []
+    if trace_jsonl:
+        exporters.append(JSONLExporter(trace_jsonl))
+    if trace_otlp:
+        exporters.append(OTLPFileExporter(trace_otlp))
+    _tracer = Tracer(exporters, Metrics() if metrics else None)
+    return _tracer
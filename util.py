@@ -1,3 +1,5 @@
+import time
+
 DEBUG = False
 
 
@@ -9,3 +11,28 @@ def enable_debug():
 def printd(*args, **kwargs):
     if DEBUG:
         print(*args, **kwargs)
+
+
+def read_only(fn):
+    """Marks a tool as free of side effects, so it may run concurrently or speculatively"""
+    fn.read_only = True
+    return fn
+
+
+class PhaseTimer:
+    """Wall-clock durations of named startup phases, for --profile-startup"""
+
+    def __init__(self, t0=None):
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self.last = self.t0
+        self.phases = []
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self) -> str:
+        lines = [f"  {name:<24}{dt * 1000:9.1f} ms" for name, dt in self.phases]
+        lines.append(f"  {'total':<24}{(self.last - self.t0) * 1000:9.1f} ms")
+        return "\n".join(lines)
@@ -0,0 +1,77 @@
+import hashlib
+import json
+
+import fastjsonschema
+
+_validators_by_id = {}  # id(schema) -> (schema, validator), the schema ref keeps the id from being reused
+_validators_by_hash = {}
+
+
+def schema_hash(schema) -> str:
+    return hashlib.sha256(json.dumps(schema, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def find_dispatch_field(schema):
+    """Find the property holding a distinct const value in every anyOf branch, i.e. call_tool"""
+    # array branches (multi-call responses) are not dispatched and go through the full schema
+    branches = [b for b in schema.get("anyOf", []) if b.get("type") == "object"]
+    if not branches:
+        return None
+
+    candidates = None
+    for branch in branches:
+        consts = {k for k, v in branch.get("properties", {}).items() if isinstance(v, dict) and "const" in v}
+        candidates = consts if candidates is None else candidates & consts
+
+    for field in sorted(candidates or []):
+        values = [branch["properties"][field]["const"] for branch in branches]
+        if len(set(map(json.dumps, values))) == len(values):
+            return field
+
+    return None
+
+
+class CompiledValidator:
+    """
+    fastjsonschema-compiled validator for a tool call schema.
+
+    Instances carrying a known dispatch const (e.g. "call_tool") are checked against the matching
+    anyOf branch only, anything else goes through the full schema to produce a proper error.
+    Raises fastjsonschema.JsonSchemaException on invalid instances.
+    """
+
+    def __init__(self, schema):
+        self.validate_full = fastjsonschema.compile(schema, use_default=False)
+        self.dispatch_field = find_dispatch_field(schema)
+        self.branches = {}
+
+        if self.dispatch_field is not None:
+            for branch in schema["anyOf"]:
+                if branch.get("type") != "object":
+                    continue
+                const = branch["properties"][self.dispatch_field]["const"]
+                if isinstance(const, str):
+                    self.branches[const] = fastjsonschema.compile(branch, use_default=False)
+
+    def __call__(self, instance):
+        if self.branches and isinstance(instance, dict):
+            validate_branch = self.branches.get(instance.get(self.dispatch_field))
+            if validate_branch is not None:
+                validate_branch(instance)
+                return
+        self.validate_full(instance)
+
+
+def get_validator(schema) -> CompiledValidator:
+    """Get a compiled validator for the schema, compiling it once per distinct schema"""
+    cached = _validators_by_id.get(id(schema))
+    if cached is not None and cached[0] is schema:
+        return cached[1]
+
+    h = schema_hash(schema)
+    validator = _validators_by_hash.get(h)
+    if validator is None:
+        validator = _validators_by_hash[h] = CompiledValidator(schema)
+
+    _validators_by_id[id(schema)] = (schema, validator)
+    return validator